@@ -0,0 +1,331 @@
+"""
+End-to-end benchmark of the cloud connector. It runs the real Runner, with its TSDB and cloud connections, against local
+stand-ins of InfluxDB, an MQTT broker (as AWS IoT), thethings.io and PubNub, for several fleet sizes and strategies.
+
+Three modes are measured for each scenario:
+- fleet: the runner reads a simulated fleet and sends the readings, latency is the time to send the whole fleet.
+- ingest: concurrent clients send readings to PUT /sensor/data, latency is the time of each request. Clients run in
+  the same process, so their CPU is included in the CPU per reading.
+- alert: readings over an alert rule threshold are received while the fleet is read and sent, latency is the time
+  until the alert arrives at the MQTT broker. Only measured when AWS IoT is one of the clouds.
+
+Results are saved as JSON to compare versions:
+
+    python -m benchmarks.e2e --sizes 10 100 1000 --strategies All Variation
+    python -m benchmarks.e2e --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from random import Random
+from threading import Event, Thread
+
+import requests
+import yaml
+from werkzeug.serving import make_server
+
+import cloud_connector.runner as runner_module
+from cloud_connector import logs
+from cloud_connector.loadtest import percentile
+from cloud_connector.fleet import SimFleet
+from cloud_connector.runner import ConfiguratorYaml, Runner
+from benchmarks.stand_ins import StandIns
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), 'results')
+CONNECT_TIMEOUT = 5
+
+MEASURES = {'temperature': {'profile': 'random_walk', 'start': 22, 'step': 0.1},
+            'humidity': {'profile': 'diurnal', 'mean': 50, 'amplitude': 10, 'noise': 1},
+            'light': {'profile': 'step', 'low': 0, 'high': 500, 'probability': 0.05},
+            }
+STRATEGIES = {'All': None,
+              'Variation': {'type': 'Variation',
+                            'parameters': {'time_low': 60, 'time_high': 300,
+                                           'variability': {'temperature': 0.5, 'humidity': 2, 'light': 2}}},
+              'MessageLimit': {'type': 'MessageLimit', 'parameters': {'messages_per_day': 9000}},
+              }
+CLOUDS = ('aws', 'thethingsio', 'pubnub')
+# Temperature of the alert readings, the fleet never reaches it
+ALERT_THRESHOLD = 1000
+ALERT_INTERVAL = 0.02
+ALERT_TIMEOUT = 10
+
+
+def summarize(readings, seconds, cpu_seconds, latencies):
+    """
+    Throughput, latency percentiles in milliseconds and CPU per reading in microseconds.
+    :rtype: dict.
+    """
+    return {'readings': readings,
+            'seconds': round(seconds, 3),
+            'readings_per_second': round(readings / seconds, 1) if seconds else None,
+            'p50_ms': round(percentile(latencies, 50) * 1e3, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1e3, 3),
+            'cpu_us_per_reading': round(cpu_seconds / readings * 1e6, 1) if readings else None,
+            }
+
+
+def version():
+    """
+    Version of the code being benchmarked, from git.
+    :rtype: str.
+    """
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(__file__)).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def write_config(stand_ins, size, strategy, clouds, directory):
+    """
+    Write the configuration of a scenario, with a fleet and the TSDB and clouds pointing to the stand-ins.
+    :return: Configuration file path and device names of the fleet.
+    :rtype: tuple.
+    """
+    device_names = SimFleet('bench', size, MEASURES).device_names
+    cloud_config = {'aws': {'host': stand_ins.mqtt.host, 'port': stand_ins.mqtt.port},
+                    'thethingsio': {'tokens': {name: 'token-{}'.format(name) for name in device_names},
+                                    'url': stand_ins.thethingsio.things_url},
+                    'pubnub': {'publish_key': 'pub-benchmark', 'subscribe_key': 'sub-benchmark',
+                               'origin': stand_ins.pubnub.origin},
+                    }
+    config = {'devices': {'read_interval': 5,
+                          'fleet': {'name': 'bench', 'type': 'fleet', 'count': size, 'seed': 42,
+                                    'measures': MEASURES}},
+              'tsdb': {'influxdb': {'host': stand_ins.influxdb.host, 'port': stand_ins.influxdb.port,
+                                    'user': 'root', 'password': 'root', 'database': 'benchmark'}},
+              'cloud': {},
+              }
+    if 'aws' in clouds:
+        config['alerts'] = {'rules': {'benchmark': {'measure': 'temperature', 'above': ALERT_THRESHOLD,
+                                                    'clouds': ['aws']}}}
+    for cloud in clouds:
+        config['cloud'][cloud] = dict(cloud_config[cloud])
+        if STRATEGIES[strategy]:
+            config['cloud'][cloud]['strategy'] = STRATEGIES[strategy]
+    path = os.path.join(directory, 'config.yml')
+    with open(path, 'w') as config_file:
+        yaml.safe_dump(config, config_file, default_flow_style=False)
+    return path, device_names
+
+
+def wait_connected(configurator):
+    """
+    Wait until MQTT clouds are connected to the broker.
+    """
+    deadline = time.time() + CONNECT_TIMEOUT
+    for cloud in configurator.clouds or []:
+        while not getattr(cloud, '_conn_flag', True) and time.time() < deadline:
+            time.sleep(0.01)
+
+
+def measure_fleet(runner, size, rounds):
+    """
+    Read and send the whole fleet several times.
+    :rtype: dict.
+    """
+    latencies = []
+    cpu_start, start = time.process_time(), time.perf_counter()
+    for _ in range(rounds):
+        round_start = time.perf_counter()
+        runner.run()
+        latencies.append(time.perf_counter() - round_start)
+    return summarize(size * rounds, time.perf_counter() - start, time.process_time() - cpu_start, latencies)
+
+
+def measure_ingest(device_names, readings, clients):
+    """
+    Send readings to PUT /sensor/data from concurrent clients.
+    :rtype: dict.
+    """
+    server = make_server('127.0.0.1', 0, runner_module.app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:{}/sensor/data'.format(server.server_port)
+    latencies = []
+
+    def client(index):
+        random = Random(index)
+        session = requests.Session()
+        for number in range(index, readings, clients):
+            body = {'device_name': device_names[number % len(device_names)],
+                    'data': {'temperature': round(random.gauss(22, 2), 2),
+                             'humidity': round(random.gauss(50, 5), 2),
+                             'light': float(random.choice((0, 500)))}}
+            request_start = time.perf_counter()
+            session.put(url, json=body)
+            latencies.append(time.perf_counter() - request_start)
+        session.close()
+
+    threads = [Thread(target=client, args=(index,)) for index in range(clients)]
+    cpu_start, start = time.process_time(), time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarize(readings, time.perf_counter() - start, time.process_time() - cpu_start, latencies)
+    server.shutdown()
+    server.server_close()
+    return result
+
+
+def measure_alerts(runner, broker, device_names, alerts):
+    """
+    Receive readings over the alert threshold, each in its own thread as REST requests are, while the fleet is read and
+    sent continuously.
+    :rtype: dict.
+    """
+    sent, arrived = {}, {}
+    all_arrived, stop = Event(), Event()
+
+    def on_publish(topic, payload):
+        value = json.loads(payload.decode('utf-8')).get('temperature')
+        # The first arrival counts, the reading can also be sent by the strategy
+        if value in sent and value not in arrived:
+            arrived[value] = time.perf_counter()
+            if len(arrived) == alerts:
+                all_arrived.set()
+
+    def load():
+        while not stop.is_set():
+            runner.run()
+
+    broker.on_publish = on_publish
+    loader = Thread(target=load)
+    loader.start()
+    threads = []
+    cpu_start, start = time.process_time(), time.perf_counter()
+    for index in range(alerts):
+        value = float(ALERT_THRESHOLD + index + 1)
+        data = {'temperature': value, 'humidity': 50.0, 'light': 0.0}
+        thread = Thread(target=runner.sender.send_data, args=(data, device_names[index % len(device_names)]))
+        sent[value] = time.perf_counter()
+        thread.start()
+        threads.append(thread)
+        time.sleep(ALERT_INTERVAL)
+    all_arrived.wait(ALERT_TIMEOUT)
+    seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+    stop.set()
+    loader.join()
+    for thread in threads:
+        thread.join()
+    broker.on_publish = None
+    result = summarize(alerts, seconds, cpu_seconds, [arrived[value] - sent[value] for value in list(arrived)])
+    result['alerts_lost'] = alerts - len(arrived)
+    return result
+
+
+def run_scenario(stand_ins, size, strategy, clouds, rounds, readings, clients, alerts):
+    """
+    Benchmark a fleet size and strategy in fleet, ingest and alert modes.
+    :return: Result of each mode.
+    :rtype: list.
+    """
+    path, device_names = write_config(stand_ins, size, strategy, clouds, tempfile.mkdtemp())
+    configurator = ConfiguratorYaml(path)
+    runner = runner_module.runner = Runner(configurator)
+    wait_connected(configurator)
+    results = []
+    modes = [('fleet', lambda: measure_fleet(runner, size, rounds)),
+             ('ingest', lambda: measure_ingest(device_names, readings, clients))]
+    if 'aws' in clouds and alerts:
+        modes.append(('alert', lambda: measure_alerts(runner, stand_ins.mqtt, device_names, alerts)))
+    for mode, measure in modes:
+        received = stand_ins.readings()
+        result = {'size': size, 'strategy': strategy, 'mode': mode}
+        result.update(measure())
+        # Let the MQTT network loop and PubNub publish the queued readings
+        time.sleep(0.5)
+        result['delivered'] = {name: count - received[name] for name, count in stand_ins.readings().items()}
+        results.append(result)
+    runner.stop(timeout=CONNECT_TIMEOUT)
+    return results
+
+
+def run(sizes, strategies, clouds, rounds, readings, clients, alerts):
+    """
+    Run all the scenarios.
+    :return: Benchmark results with the version and parameters.
+    :rtype: dict.
+    """
+    report = {'version': version(),
+              'python': platform.python_version(),
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'parameters': {'sizes': sizes, 'strategies': strategies, 'clouds': clouds, 'rounds': rounds,
+                             'readings': readings, 'clients': clients, 'alerts': alerts},
+              'results': [],
+              }
+    with StandIns() as stand_ins:
+        for strategy in strategies:
+            for size in sizes:
+                for result in run_scenario(stand_ins, size, strategy, clouds, rounds, readings, clients, alerts):
+                    print_result(result)
+                    report['results'].append(result)
+    return report
+
+
+def print_result(result):
+    print('{size:>7} {strategy:<13} {mode:<7} {readings_per_second:>10} readings/s  p50 {p50_ms:>9} ms  '
+          'p99 {p99_ms:>9} ms  {cpu_us_per_reading:>8} us CPU/reading  delivered {delivered}'.format(**result))
+
+
+def save(report, directory=RESULTS_DIRECTORY):
+    """
+    Save the results of a benchmark.
+    :return: File path.
+    :rtype: str.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'e2e-{}-{}.json'.format(report['version'], time.strftime('%Y%m%d-%H%M%S')))
+    with open(path, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+    return path
+
+
+def compare(old_path, new_path):
+    """
+    Print the change of throughput, latency and CPU between two saved benchmarks.
+    """
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    print('{} -> {}'.format(old['version'], new['version']))
+    baseline = {(result['size'], result['strategy'], result['mode']): result for result in old['results']}
+    for result in new['results']:
+        previous = baseline.get((result['size'], result['strategy'], result['mode']))
+        if not previous:
+            continue
+        changes = ['{} {:+.1f}%'.format(key, 100.0 * (result[key] - previous[key]) / previous[key])
+                   for key in ('readings_per_second', 'p50_ms', 'p99_ms', 'cpu_us_per_reading')
+                   if result[key] and previous[key]]
+        print('{:>7} {:<13} {:<7} {}'.format(result['size'], result['strategy'], result['mode'], '  '.join(changes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark against local backend stand-ins.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000], help='Fleet sizes.')
+    parser.add_argument('--strategies', nargs='+', default=list(STRATEGIES), choices=list(STRATEGIES))
+    parser.add_argument('--clouds', nargs='+', default=list(CLOUDS), choices=CLOUDS)
+    parser.add_argument('--rounds', type=int, default=5, help='Reads of the whole fleet in fleet mode.')
+    parser.add_argument('--readings', type=int, default=2000, help='Readings sent in ingest mode.')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients in ingest mode.')
+    parser.add_argument('--alerts', type=int, default=100, help='Alert readings sent in alert mode, 0 to skip it.')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', default=RESULTS_DIRECTORY, help='Directory to save the results.')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two saved results.')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    logs.configure({'level': args.log_level, 'async': True, 'rate_limit': 60,
+                    'levels': {'werkzeug': args.log_level}})
+    report = run(args.sizes, args.strategies, args.clouds, args.rounds, args.readings, args.clients, args.alerts)
+    print('Results saved to {}'.format(save(report, args.output)))
+
+
+if __name__ == '__main__':
+    main()
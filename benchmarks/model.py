@@ -0,0 +1,121 @@
+"""
+Microbenchmark of the data model: time and memory per reading of the previous path with a dictionary for each reading,
+against readings and record batches. Each path builds the readings of a fleet and their TSDB points, as a fleet read
+sent to the TSDB does, and keeps them as the sender keeps pending readings.
+
+    python -m benchmarks.model --size 10000
+"""
+import argparse
+import timeit
+import tracemalloc
+
+from cloud_connector.data.model import Reading, RecordBatch
+from cloud_connector.data.tsdb import InfluxDB
+
+MEASURES = ('temperature', 'humidity', 'light', 'pressure')
+CLOUDS = ('CloudAmazonMQTT',)
+
+
+def fleet_columns(size):
+    """
+    Columns of values of a fleet, as produced by a simulated fleet.
+    :rtype: tuple.
+    """
+    device_names = ['bench{:05d}'.format(index) for index in range(size)]
+    columns = {measure: [float(index % 100 + position) for index in range(size)]
+               for position, measure in enumerate(MEASURES)}
+    return device_names, columns
+
+
+def dict_path(device_names, columns):
+    """
+    Previous path: a dictionary for each reading, converted to float in place, and a point with new tags.
+    """
+    rows = zip(*(columns[measure] for measure in MEASURES))
+    readings = [(dict(zip(MEASURES, row)), device_name) for device_name, row in zip(device_names, rows)]
+    points = []
+    for data, device_name in readings:
+        for key, value in data.items():
+            if isinstance(value, int):
+                data[key] = float(value)
+        tags = {'cloud': ';'.join(CLOUDS)}
+        tags.update({'device': device_name})
+        points.append({'measurement': 'environment', 'tags': tags, 'fields': data})
+    return readings, points
+
+
+def batch_path(device_names, columns):
+    """
+    Record batch path: readings created from the columns, used as the fields of points with shared tags.
+    """
+    readings = RecordBatch(device_names, columns, 1534000000.0)
+    points = [InfluxDB._point(reading, InfluxDB._tags(reading.device_name, CLOUDS)) for reading in readings]
+    return readings, points
+
+
+def single_dict_path(device_names, columns):
+    """
+    Previous path of readings received one by one, as from the REST API.
+    """
+    readings = []
+    for index, device_name in enumerate(device_names):
+        data = {measure: columns[measure][index] for measure in MEASURES}
+        for key, value in data.items():
+            if isinstance(value, int):
+                data[key] = float(value)
+        readings.append((data, device_name))
+    return readings, None
+
+
+def single_reading_path(device_names, columns):
+    """
+    Readings received one by one, converted to Reading without modifying the data received.
+    """
+    readings = []
+    for index, device_name in enumerate(device_names):
+        data = {measure: columns[measure][index] for measure in MEASURES}
+        readings.append(Reading(device_name, data))
+    return readings, None
+
+
+PATHS = (('dict batch', dict_path),
+         ('record batch', batch_path),
+         ('dict single', single_dict_path),
+         ('reading single', single_reading_path),
+         )
+
+
+def measure(path, device_names, columns, repeat):
+    """
+    Measure a path.
+    :return: Microseconds and bytes kept per reading.
+    :rtype: dict.
+    """
+    size = len(device_names)
+    seconds = min(timeit.repeat(lambda: path(device_names, columns), number=1, repeat=repeat))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = path(device_names, columns)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return {'us_per_reading': round(seconds / size * 1e6, 3),
+            'bytes_per_reading': round((after - before) / size, 1),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Data model microbenchmark.')
+    parser.add_argument('--size', type=int, default=10000, help='Readings of each run.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each path, the fastest is reported.')
+    args = parser.parse_args()
+
+    device_names, columns = fleet_columns(args.size)
+    for name, path in PATHS:
+        result = measure(path, device_names, columns, args.repeat)
+        print('{:<15} {:>8} us/reading {:>8} bytes/reading'.format(name, result['us_per_reading'],
+                                                                   result['bytes_per_reading']))
+
+
+if __name__ == '__main__':
+    main()
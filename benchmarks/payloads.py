@@ -0,0 +1,89 @@
+"""
+Benchmark of the cloud payload codecs: bytes and encode CPU per reading of the JSON payload against the binary codec,
+with and without delta coding and zlib. Each device sends a series of readings of slowly changing measures, as sensors
+do, and the binary payloads are decoded to check that no value is changed.
+
+    python -m benchmarks.payloads --devices 100 --readings 100
+"""
+import argparse
+import random
+import time
+
+from cloud_connector.data.model import Reading
+from cloud_connector.data.payloads import BinaryCodec, BinaryDecoder, JsonCodec
+
+READING_INTERVAL = 60
+
+CODECS = (('json', lambda: JsonCodec()),
+          ('binary', lambda: BinaryCodec(delta=False)),
+          ('binary delta', lambda: BinaryCodec()),
+          ('binary delta zlib', lambda: BinaryCodec(compress=True)),
+          )
+
+
+def fleet_series(devices, readings, seed=0):
+    """
+    Readings of a fleet in the order they are sent: temperature with 1 decimal, humidity in units, pressure with 2
+    decimals and a light level without rounding.
+    :rtype: list.
+    """
+    generator = random.Random(seed)
+    state = {'bench{:05d}'.format(index): [20.0, 50.0, 1013.25, 300.0] for index in range(devices)}
+    series = []
+    for number in range(readings):
+        timestamp = 1534000000.0 + number * READING_INTERVAL
+        for device_name, values in state.items():
+            values[0] = round(values[0] + generator.choice((-0.1, 0.0, 0.0, 0.1)), 1)
+            values[1] = float(max(0, min(100, values[1] + generator.choice((-1, 0, 0, 0, 1)))))
+            values[2] = round(values[2] + generator.choice((-0.25, 0.0, 0.25)), 2)
+            values[3] = values[3] + generator.random()
+            series.append(Reading(device_name, {'temperature': values[0], 'humidity': values[1],
+                                                'pressure': values[2], 'light': values[3]}, timestamp))
+    return series
+
+
+def measure(codec, series):
+    """
+    Encode a series.
+    :return: Bytes and encode CPU microseconds per reading, and the payloads.
+    :rtype: tuple.
+    """
+    start = time.process_time()
+    payloads = [codec.encode(reading, reading.device_name) for reading in series]
+    cpu = time.process_time() - start
+    size = sum(len(payload) for payload in payloads)
+    return {'bytes_per_reading': round(size / len(series), 1),
+            'cpu_us_per_reading': round(cpu / len(series) * 1e6, 2),
+            }, payloads
+
+
+def check(series, payloads):
+    """
+    Decode binary payloads with the reference decoder.
+    :raises: AssertionError, if a reading is not decoded as sent.
+    """
+    decoder = BinaryDecoder()
+    for reading, payload in zip(series, payloads):
+        decoded = decoder.decode(payload, reading.device_name)
+        assert decoded == reading, 'Decoded {!r}, sent {!r}'.format(decoded, reading)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cloud payload codecs benchmark.')
+    parser.add_argument('--devices', type=int, default=100, help='Devices of the fleet.')
+    parser.add_argument('--readings', type=int, default=100, help='Readings of each device.')
+    args = parser.parse_args()
+
+    series = fleet_series(args.devices, args.readings)
+    baseline = None
+    for name, codec_factory in CODECS:
+        result, payloads = measure(codec_factory(), series)
+        if name != 'json':
+            check(series, payloads)
+        baseline = baseline or result['bytes_per_reading']
+        print('{:<18} {:>7} bytes/reading {:>6.1%} of JSON {:>7} us/reading'.format(
+            name, result['bytes_per_reading'], result['bytes_per_reading'] / baseline, result['cpu_us_per_reading']))
+
+
+if __name__ == '__main__':
+    main()
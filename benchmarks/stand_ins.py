@@ -0,0 +1,287 @@
+"""
+Local stand-ins of the backends used by the cloud connector, to benchmark it without network or cloud accounts.
+They implement just enough of each protocol to accept data, and count the readings received.
+"""
+import json
+import socketserver
+import struct
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread, Lock
+from urllib.parse import urlparse, parse_qs
+
+# MQTT control packet types
+MQTT_CONNECT = 1
+MQTT_PUBLISH = 3
+MQTT_PUBREL = 6
+MQTT_SUBSCRIBE = 8
+MQTT_PINGREQ = 12
+MQTT_DISCONNECT = 14
+
+# Seconds a PubNub subscribe request is held without messages
+PUBNUB_LONG_POLL = 1
+
+
+class _QuietMixIn(object):
+    """
+    Ignore the connections closed by clients, for instance when the connector is stopped.
+    """
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super(_QuietMixIn, self).handle_error(request, client_address)
+
+
+class _ThreadingHTTPServer(_QuietMixIn, socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _ThreadingTCPServer(_QuietMixIn, socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StandInBase(object):
+    """
+    Base class for stand-ins, a server listening on a free local port in a background thread.
+    :param host: Address to listen.
+    :type host: str.
+    """
+    name = None
+
+    def __init__(self, host='127.0.0.1'):
+        self.host = host
+        self.readings = 0
+        self.requests = 0
+        self._lock = Lock()
+        self._server = self._create_server(host)
+        self.port = self._server.server_address[1]
+        self._thread = Thread(target=self._server.serve_forever, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _create_server(self, host):
+        raise NotImplementedError
+
+    def count(self, readings):
+        """
+        Count a request and the readings received with it.
+        :param readings: Number of readings.
+        :type readings: int.
+        """
+        with self._lock:
+            self.requests += 1
+            self.readings += readings
+
+    def close(self):
+        """
+        Stop the server.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class HTTPStandInBase(StandInBase):
+    """
+    Base class for stand-ins of HTTP APIs, answering JSON.
+    """
+
+    @property
+    def url(self):
+        """
+        Base URL of the server.
+        :rtype: str.
+        """
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def _create_server(self, host):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in._handle(self)
+
+            do_POST = do_PUT = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        return _ThreadingHTTPServer((host, 0), Handler)
+
+    def _handle(self, request):
+        body = request.rfile.read(int(request.headers.get('Content-Length', 0)))
+        url = urlparse(request.path)
+        status, response = self.respond(request.command, url.path, parse_qs(url.query), body)
+        payload = json.dumps(response).encode('utf-8') if response is not None else b''
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def respond(self, method, path, query, body):
+        """
+        Answer a request.
+        :return: HTTP status and JSON response (None for no content).
+        :rtype: tuple.
+        """
+        raise NotImplementedError
+
+
+class FakeInfluxDB(HTTPStandInBase):
+    """
+    InfluxDB 1.x HTTP API: every database exists, and points written are counted.
+    """
+    name = 'influxdb'
+
+    def respond(self, method, path, query, body):
+        if path == '/write':
+            self.count(sum(1 for line in body.split(b'\n') if line.strip()))
+            return 204, None
+        if path == '/query' and 'SHOW DATABASES' in query.get('q', [''])[0].upper():
+            database = query.get('db', ['benchmark'])[0]
+            return 200, {'results': [{'statement_id': 0,
+                                      'series': [{'name': 'databases', 'columns': ['name'],
+                                                  'values': [[database]]}]}]}
+        if path == '/query':
+            return 200, {'results': [{'statement_id': 0}]}
+        return 204, None
+
+
+class FakeThingsIO(HTTPStandInBase):
+    """
+    thethings.io things API: each write of a thing token is one reading.
+    """
+    name = 'thethingsio'
+
+    @property
+    def things_url(self):
+        """
+        URL of the things API, to configure the cloud.
+        :rtype: str.
+        """
+        return self.url + '/v2/things/'
+
+    def respond(self, method, path, query, body):
+        self.count(1)
+        return 201, {'status': 'created'}
+
+
+class FakePubNub(HTTPStandInBase):
+    """
+    PubNub REST API: each publish is one reading, subscribe requests are long polls without messages.
+    """
+    name = 'pubnub'
+
+    @property
+    def origin(self):
+        """
+        Host and port, to configure the cloud.
+        :rtype: str.
+        """
+        return '{}:{}'.format(self.host, self.port)
+
+    def respond(self, method, path, query, body):
+        timetoken = str(int(time.time() * 1e7))
+        if path.startswith('/publish/'):
+            self.count(1)
+            return 200, [1, 'Sent', timetoken]
+        if path.startswith('/subscribe/'):
+            if not path.rstrip('/').endswith('/0'):
+                time.sleep(PUBNUB_LONG_POLL)
+            return 200, [[], timetoken]
+        if path.startswith('/time/'):
+            return 200, [int(timetoken)]
+        return 200, {'status': 200, 'message': 'OK', 'service': 'Presence'}
+
+
+class FakeMQTTBroker(StandInBase):
+    """
+    MQTT 3.1.1 broker that acknowledges connections and publishes without routing them to subscribers. A function
+    set as on_publish is called with the topic and payload of each publish, when it arrives.
+    """
+    name = 'mqtt'
+    on_publish = None
+
+    def _create_server(self, host):
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                broker._serve(self.request)
+
+        return _ThreadingTCPServer((host, 0), Handler)
+
+    def _serve(self, connection):
+        stream = connection.makefile('rb')
+        while True:
+            header = stream.read(1)
+            if not header:
+                return
+            length, multiplier = 0, 1
+            while True:
+                byte = stream.read(1)[0]
+                length += (byte & 127) * multiplier
+                multiplier *= 128
+                if not byte & 128:
+                    break
+            body = stream.read(length)
+            packet_type, flags = header[0] >> 4, header[0] & 15
+            if packet_type == MQTT_CONNECT:
+                connection.sendall(b'\x20\x02\x00\x00')
+            elif packet_type == MQTT_PUBLISH:
+                self.count(1)
+                qos = (flags >> 1) & 3
+                topic_length = struct.unpack('!H', body[:2])[0]
+                if self.on_publish:
+                    self.on_publish(body[2:2 + topic_length].decode('utf-8'),
+                                    body[2 + topic_length + (2 if qos else 0):])
+                if qos:
+                    packet_id = body[2 + topic_length:4 + topic_length]
+                    connection.sendall((b'\x40\x02' if qos == 1 else b'\x50\x02') + packet_id)
+            elif packet_type == MQTT_PUBREL:
+                connection.sendall(b'\x70\x02' + body[:2])
+            elif packet_type == MQTT_SUBSCRIBE:
+                connection.sendall(b'\x90\x03' + body[:2] + b'\x00')
+            elif packet_type == MQTT_PINGREQ:
+                connection.sendall(b'\xd0\x00')
+            elif packet_type == MQTT_DISCONNECT:
+                return
+
+
+class StandIns(object):
+    """
+    All the stand-ins, to be used as a context manager.
+    """
+
+    def __init__(self):
+        self.influxdb = FakeInfluxDB()
+        self.mqtt = FakeMQTTBroker()
+        self.thethingsio = FakeThingsIO()
+        self.pubnub = FakePubNub()
+
+    def readings(self):
+        """
+        Readings received by each stand-in.
+        :rtype: dict.
+        """
+        return {stand_in.name: stand_in.readings for stand_in in self._stand_ins}
+
+    @property
+    def _stand_ins(self):
+        return self.influxdb, self.mqtt, self.thethingsio, self.pubnub
+
+    def close(self):
+        """
+        Stop all the stand-ins.
+        """
+        for stand_in in self._stand_ins:
+            stand_in.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,101 @@
+"""
+Startup benchmark of the cloud connector. For several configurations it starts a new Python process that imports the
+runner and builds the configuration against local backend stand-ins, and reports the import time, configuration time,
+maximum resident memory and the third party libraries loaded.
+
+    python -m benchmarks.startup --repeat 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import median
+
+import yaml
+
+from benchmarks.e2e import RESULTS_DIRECTORY, version, write_config
+from benchmarks.stand_ins import StandIns
+
+LIBRARIES = ('flask', 'influxdb', 'requests', 'paho', 'pubnub', 'retry', 'numpy', 'dateutil')
+
+# Code run in the measured process, the configuration file is the first argument
+PROBE = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import cloud_connector.runner as runner
+imported = time.perf_counter()
+runner.ConfiguratorYaml(sys.argv[1])
+configured = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1e3,
+                  'configure_ms': (configured - imported) * 1e3,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+                  'libraries': [library for library in %r if library in sys.modules]}))
+''' % (LIBRARIES,)
+
+
+def write_configs(stand_ins, directory):
+    """
+    Write the configurations measured: TSDB only, a simulated fleet and all the clouds.
+    :return: Configuration file path by name.
+    :rtype: dict.
+    """
+    tsdb_only = os.path.join(directory, 'tsdb_only.yml')
+    with open(tsdb_only, 'w') as config_file:
+        yaml.safe_dump({'tsdb': {'influxdb': {'host': stand_ins.influxdb.host, 'port': stand_ins.influxdb.port,
+                                              'user': 'root', 'password': 'root', 'database': 'benchmark'}}},
+                       config_file, default_flow_style=False)
+    configs = {'tsdb-only': tsdb_only}
+    for name, clouds in (('fleet', []), ('all-clouds', ['aws', 'thethingsio', 'pubnub'])):
+        scenario_directory = os.path.join(directory, name)
+        os.makedirs(scenario_directory)
+        configs[name] = write_config(stand_ins, 10, 'All', clouds, scenario_directory)[0]
+    return configs
+
+
+def measure(config_path, repeat):
+    """
+    Start the connector several times with a configuration.
+    :return: Median import and configuration times, maximum RSS and libraries loaded.
+    :rtype: dict.
+    """
+    runs = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-c', PROBE, config_path], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        if process.returncode:
+            return {'error': process.stderr.decode('utf-8').strip().splitlines()[-1]}
+        runs.append(json.loads(process.stdout.decode('utf-8').strip().splitlines()[-1]))
+    return {'import_ms': round(median(run['import_ms'] for run in runs), 1),
+            'configure_ms': round(median(run['configure_ms'] for run in runs), 1),
+            'rss_mb': round(max(run['rss_mb'] for run in runs), 1),
+            'libraries': runs[-1]['libraries'],
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup time and memory benchmark.')
+    parser.add_argument('--repeat', type=int, default=5, help='Process starts for each configuration.')
+    parser.add_argument('--output', default=RESULTS_DIRECTORY, help='Directory to save the results.')
+    args = parser.parse_args()
+
+    report = {'version': version(), 'results': {}}
+    with StandIns() as stand_ins:
+        for name, config_path in write_configs(stand_ins, tempfile.mkdtemp()).items():
+            result = report['results'][name] = measure(config_path, args.repeat)
+            if 'error' in result:
+                print('{:<11} error: {}'.format(name, result['error']))
+                continue
+            print('{:<11} import {:>7} ms  configure {:>7} ms  RSS {:>6} MB  libraries: {}'.format(
+                name, result['import_ms'], result['configure_ms'], result['rss_mb'], ', '.join(result['libraries'])))
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, 'startup-{}.json'.format(report['version']))
+    with open(path, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+    print('Results saved to {}'.format(path))
+
+
+if __name__ == '__main__':
+    main()
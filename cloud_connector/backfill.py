@@ -0,0 +1,240 @@
+"""
+Backfill of a cloud with the readings stored in the TSDB that were not sent to it, when its uplink was down or when it
+has been added. Readings are read in chunks, oldest first, and sent with the connector of the cloud at a limited rate,
+so the quota of the cloud is respected. Progress is saved in a checkpoint file, an interrupted backfill resumes after
+the last reading sent:
+
+    python -m cloud_connector.backfill --config config.yml --cloud aws --start 2024-05-01T00:00:00 --rate 0.5
+
+Readings are selected by the cloud tag of the TSDB, which also lacks the cloud for the readings its strategy did not
+send, so the range should be limited to the period to fill. The cloud strategy is not evaluated, and the cloud tag is
+not updated, the checkpoint is what avoids sending them again.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import yaml
+
+from cloud_connector import logs
+from cloud_connector.data.strategies import TimeLimit
+from cloud_connector.data.tsdb import InfluxDB, ShardedInfluxDB
+from cloud_connector.replay import parse_timestamp
+from cloud_connector.runner import ConfiguratorYaml, available_clouds
+
+DEFAULT_CHUNK_SIZE = 100
+# Readings sent between checkpoint saves, it is also saved at the end of each chunk
+CHECKPOINT_EVERY = 10
+# Part of the quota of the cloud used by default, the rest is left to the readings sent by the connector
+DEFAULT_QUOTA_SHARE = 0.5
+
+
+class RateLimiter(object):
+    """
+    Token bucket, to do at most rate operations per second on average with bursts of burst operations.
+    :param rate: Operations per second.
+    :type rate: float.
+    :param burst: Operations done at once after being idle.
+    :type burst: int.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def acquire(self):
+        """
+        Wait until an operation can be done.
+        :return: Seconds waited.
+        :rtype: float.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        waited = 0.0
+        if self._tokens < 1:
+            waited = (1 - self._tokens) / self.rate
+            time.sleep(waited)
+            self._tokens = 1.0
+            self._updated = time.monotonic()
+        self._tokens -= 1
+        return waited
+
+
+class Checkpoint(object):
+    """
+    Progress of a backfill saved in a JSON file: cloud, time range, position of the last reading sent and number of
+    readings sent. It is written to a temporary file first, so an interruption does not leave it half written.
+    :param path: File path.
+    :type path: str.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """
+        :return: Progress saved, or None.
+        :rtype: dict.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return None
+        with open(self.path) as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    def save(self, progress):
+        if not self.path:
+            return
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as checkpoint_file:
+            json.dump(progress, checkpoint_file)
+        os.replace(temporary, self.path)
+
+
+class Backfill(object):
+    """
+    Send to a cloud the readings of the TSDB not sent to it.
+    :param tsdb: TSDB with the readings.
+    :type tsdb: TSDatabase.
+    :param cloud: Cloud service.
+    :type cloud: CloudServiceBase.
+    :param rate: Readings sent per second.
+    :type rate: float.
+    :param start: Start time in epoch seconds, no limit by default.
+    :type start: float.
+    :param end: End time in epoch seconds, the time of the first run by default.
+    :type end: float.
+    :param checkpoint: Checkpoint file path, the backfill is not resumable without it.
+    :type checkpoint: str.
+    :param chunk_size: Readings read from the TSDB at once.
+    :type chunk_size: int.
+    """
+
+    def __init__(self, tsdb, cloud, rate, start=None, end=None, checkpoint=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.tsdb = tsdb
+        self.cloud = cloud
+        self.cloud_name = cloud.__class__.__name__
+        self.limiter = RateLimiter(rate)
+        self.chunk_size = chunk_size
+        self.checkpoint = Checkpoint(checkpoint)
+        self.progress = self.checkpoint.load()
+        if self.progress and self.progress['cloud'] == self.cloud_name and start in (None, self.progress['start']) \
+                and end in (None, self.progress['end']):
+            logging.info('Resuming backfill of %s after %s readings', self.cloud_name, self.progress['sent'])
+        else:
+            self.progress = {'cloud': self.cloud_name,
+                             'start': start,
+                             # Readings received meanwhile are sent by the connector
+                             'end': end if end is not None else time.time(),
+                             'position': None,
+                             'sent': 0,
+                             'done': False,
+                             }
+
+    def run(self):
+        """
+        Send the readings until the end of the range, saving the progress.
+        :return: Progress, with the number of readings sent.
+        :rtype: dict.
+        :raises: The error sending a reading, the progress is saved up to the previous one.
+        """
+        progress = self.progress
+        if progress['done']:
+            return progress
+        chunks = self.tsdb.unsent(self.cloud_name, progress['start'], progress['end'], self.chunk_size,
+                                  tuple(progress['position']) if progress['position'] else None)
+        try:
+            for chunk in chunks:
+                for count, (position, reading) in enumerate(chunk, 1):
+                    self.limiter.acquire()
+                    self.cloud.send_now(reading, reading.device_name)
+                    progress['position'] = list(position)
+                    progress['sent'] += 1
+                    if count % CHECKPOINT_EVERY == 0:
+                        self.checkpoint.save(progress)
+                self.checkpoint.save(progress)
+                logging.info('%s readings sent to %s', progress['sent'], self.cloud_name)
+            progress['done'] = True
+        finally:
+            self.checkpoint.save(progress)
+        return progress
+
+
+def quota_rate(cloud, share=DEFAULT_QUOTA_SHARE):
+    """
+    Part of the readings per second allowed by the strategy of a cloud, if it limits the time between messages.
+    :param cloud: Cloud service.
+    :type cloud: CloudServiceBase.
+    :param share: Part of the quota, between 0 and 1.
+    :type share: float.
+    :rtype: float.
+    """
+    if isinstance(cloud.strategy, TimeLimit):
+        return share / cloud.strategy.seconds_between_messages.total_seconds()
+    return None
+
+
+def build(config_path, cloud_key):
+    """
+    Build the TSDB and a cloud of a configuration file.
+    :param config_path: Configuration file path.
+    :type config_path: str.
+    :param cloud_key: Name of the cloud in the cloud section.
+    :type cloud_key: str.
+    :return: TSDB and cloud service.
+    :rtype: tuple.
+    """
+    with open(config_path) as config_file:
+        config = yaml.safe_load(config_file)
+    parameters = dict(config['cloud'][cloud_key])
+    # noinspection PyProtectedMember
+    strategy = ConfiguratorYaml._strategy_factory(parameters.pop('strategy', None))
+    influx = config['tsdb']['influxdb']
+    if isinstance(influx, list):
+        sharding = {key: value for key, value in (config['tsdb'].get('sharding') or {}).items()
+                    if key not in ('rebalance', 'ring_file')}
+        tsdb = ShardedInfluxDB(influx, **sharding)
+    else:
+        tsdb = InfluxDB(**influx)
+    return tsdb, available_clouds[cloud_key](strategy=strategy, **parameters)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send to a cloud the readings of the TSDB not sent to it.')
+    parser.add_argument('--config', default='config.yml', help='Configuration file.')
+    parser.add_argument('--cloud', required=True, help='Name of the cloud in the cloud section.')
+    parser.add_argument('--start', type=parse_timestamp, help='Start time, ISO 8601 or epoch seconds.')
+    parser.add_argument('--end', type=parse_timestamp, help='End time, ISO 8601 or epoch seconds, now by default.')
+    parser.add_argument('--rate', type=float,
+                        help='Readings per second, by default a share of the limit of the cloud strategy (TimeLimit '
+                             'or MessageLimit), which is shared with the readings sent by the connector.')
+    parser.add_argument('--quota-share', type=float, default=DEFAULT_QUOTA_SHARE,
+                        help='Share of the limit of the cloud strategy used without --rate, 0.5 by default.')
+    parser.add_argument('--checkpoint', default='backfill-checkpoint.json', help='Checkpoint file to resume.')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Readings read at once.')
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+
+    logs.configure({'level': args.log_level})
+    tsdb, cloud = build(args.config, args.cloud)
+    if not 0 < args.quota_share <= 1:
+        parser.error('--quota-share must be between 0 and 1')
+    rate = args.rate or quota_rate(cloud, args.quota_share)
+    if not rate:
+        parser.error('--rate is required, the strategy of {} has no message limit'.format(args.cloud))
+    try:
+        progress = Backfill(tsdb, cloud, rate, args.start, args.end, args.checkpoint, args.chunk_size).run()
+        print('{} readings sent to {}'.format(progress['sent'], args.cloud))
+    except KeyboardInterrupt:
+        print('Interrupted, run again to resume from {}'.format(args.checkpoint))
+    finally:
+        cloud.close()
+        tsdb.close()
+
+
+if __name__ == '__main__':
+    main()
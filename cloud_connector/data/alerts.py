@@ -0,0 +1,294 @@
+"""
+Alert rules evaluated on ingest. Thresholds and rates of change of a measure are compiled into predicates, grouped by
+measure so a reading only evaluates the rules of its measures. A reading matching a rule is pushed on a priority lane,
+threads that send it to the clouds of the rule without evaluating their strategies and without waiting for the routine
+sends. When routes are configured, an alert is only sent to the clouds of the routes of its device, with the measures
+of the route. The routine sends skip the clouds an alert is sent to, so a reading is sent once to each cloud, and the
+TSDB write waits for the alert to record the clouds it has been delivered to.
+"""
+import logging
+import re
+import time
+from collections import OrderedDict
+from fnmatch import translate
+from queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+
+from cloud_connector.cc_exceptions import ConfigurationError
+from cloud_connector.data.model import RecordBatch
+from cloud_connector.metrics import ALERTS, ALERT_SECONDS, READINGS_DROPPED
+
+DEFAULT_THREADS = 2
+DEFAULT_QUEUE_SIZE = 10000
+# Maximum number of device and measure series whose last value is kept for rate rules
+DEFAULT_MAX_SERIES = 100000
+# Seconds the priority lane waits for alerts before checking if it is closed
+STOP_CHECK_INTERVAL = 0.5
+# Seconds to wait for the delivery of an alert before writing its reading to the TSDB
+DELIVERY_WAIT = 5
+
+
+def compile_comparison(above=None, below=None):
+    """
+    Compile a comparison of a value with limits.
+    :param above: The value matches when it is greater.
+    :type above: float.
+    :param below: The value matches when it is lower.
+    :type below: float.
+    :return: Predicate of a value, or None if there are no limits.
+    :rtype: function.
+    """
+    if above is not None and below is not None:
+        above, below = float(above), float(below)
+        return lambda value: value > above or value < below
+    if above is not None:
+        above = float(above)
+        return lambda value: value > above
+    if below is not None:
+        below = float(below)
+        return lambda value: value < below
+    return None
+
+
+class Rule(object):
+    """
+    Alert rule of a measure: a value out of thresholds, or a rate of change (units per second since the previous
+    reading of the device) out of limits.
+    :param name: Rule name.
+    :type name: str.
+    :param measure: Measure evaluated.
+    :type measure: str.
+    :param above: Alert when the value is greater.
+    :param below: Alert when the value is lower.
+    :param rate_above: Alert when the rate of change is greater.
+    :param rate_below: Alert when the rate of change is lower.
+    :param devices: Device name patterns (as in shell, mote*) the rule applies to, all by default.
+    :type devices: list.
+    :param clouds: Names of the clouds (keys of the cloud section) to send alerts to, all by default.
+    :type clouds: list.
+    """
+    __slots__ = ('name', 'measure', 'value', 'rate', 'devices', 'clouds')
+
+    def __init__(self, name, measure, above=None, below=None, rate_above=None, rate_below=None, devices=None,
+                 clouds=None):
+        self.name = name
+        self.measure = measure
+        self.value = compile_comparison(above, below)
+        self.rate = compile_comparison(rate_above, rate_below)
+        if not self.value and not self.rate:
+            raise ConfigurationError('Alert rule {} has no threshold or rate limit'.format(name))
+        self.devices = re.compile('|'.join(translate(pattern) for pattern in devices)).match if devices else None
+        self.clouds = frozenset(clouds) if clouds else None
+
+
+class Alert(object):
+    """
+    Alert pushed on the priority lane.
+    :param reading: Reading that matches the rules.
+    :type reading: Reading.
+    :param sends: Cloud, data sent to it and strategy of its route (None without routes), for each cloud.
+    :type sends: tuple.
+    """
+    __slots__ = ('reading', 'sends', 'delivered', '_done')
+
+    def __init__(self, reading, sends):
+        self.reading = reading
+        self.sends = sends
+        self.delivered = []
+        self._done = Event()
+
+    @property
+    def clouds(self):
+        """
+        Clouds the alert is sent to.
+        :rtype: tuple.
+        """
+        return tuple(cloud for cloud, _, _ in self.sends)
+
+    def wait(self, timeout=DELIVERY_WAIT):
+        """
+        Wait until the alert has been sent to all its clouds.
+        :param timeout: Seconds to wait.
+        :type timeout: float.
+        :return: Clouds the alert has been delivered to, None if it is still being sent.
+        :rtype: list.
+        """
+        return self.delivered if self._done.wait(timeout) else None
+
+
+class AlertEngine(object):
+    """
+    Evaluates the alert rules and sends the alerts on the priority lane.
+    :param rules: Parameters of each rule by name.
+    :type rules: dict.
+    :param threads: Threads of the priority lane.
+    :type threads: int.
+    :param queue_size: Alerts waiting to be sent, more are dropped.
+    :type queue_size: int.
+    :param max_series: Maximum number of series whose last value is kept for rate rules.
+    :type max_series: int.
+    """
+
+    def __init__(self, rules, threads=DEFAULT_THREADS, queue_size=DEFAULT_QUEUE_SIZE, max_series=DEFAULT_MAX_SERIES):
+        self.rules = [Rule(name, **parameters) for name, parameters in rules.items()]
+        self._by_measure = {}
+        for rule in self.rules:
+            self._by_measure.setdefault(rule.measure, []).append(rule)
+        self._rate_measures = frozenset(rule.measure for rule in self.rules if rule.rate)
+        self.max_series = max_series
+        # Timestamp and value of the last reading by device and measure, for rate rules
+        self._last = OrderedDict()
+        self._lock = Lock()
+        # Clouds by name and routing table, set by the configuration
+        self.clouds = {}
+        self.routing = None
+        self._queue = Queue(queue_size)
+        self._stopping = Event()
+        self._threads = [Thread(target=self._deliver, name='Alerts-{}'.format(index), daemon=True)
+                         for index in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def check(self, readings):
+        """
+        Evaluate the rules with the readings received, and push the readings that match on the priority lane.
+        :param readings: Readings received.
+        :type readings: RecordBatch or list.
+        :return: Alert pushed, by index of the reading in readings. Alerts dropped are not included.
+        :rtype: dict.
+        """
+        by_measure = self._by_measure
+        matches = {}
+        if isinstance(readings, RecordBatch):
+            # Only the columns with rules are evaluated, without creating the readings
+            for measure in readings.measures:
+                rules = by_measure.get(measure)
+                if rules:
+                    column = readings.column(measure)
+                    for index, device_name in enumerate(readings.device_names):
+                        matched = self._evaluate(rules, device_name, readings.timestamps[index], column[index])
+                        if matched:
+                            matches.setdefault(index, []).extend(matched)
+        else:
+            for index, reading in enumerate(readings):
+                for measure, value in reading.items():
+                    rules = by_measure.get(measure)
+                    if rules:
+                        matched = self._evaluate(rules, reading.device_name, reading.timestamp, value)
+                        if matched:
+                            matches.setdefault(index, []).extend(matched)
+        alerted = {}
+        for index, rules in matches.items():
+            alert = self._push(readings[index], rules)
+            if alert:
+                alerted[index] = alert
+        return alerted
+
+    def _evaluate(self, rules, device_name, timestamp, value):
+        """
+        Rules matched by a value of a device.
+        :rtype: list.
+        """
+        if type(value) is not float:
+            return None
+        measure = rules[0].measure
+        rate = None
+        if measure in self._rate_measures:
+            key = (device_name, measure)
+            with self._lock:
+                last = self._last.pop(key, None)
+                self._last[key] = (timestamp, value)
+                if len(self._last) > self.max_series:
+                    self._last.popitem(last=False)
+            if last is not None and timestamp > last[0]:
+                rate = (value - last[1]) / (timestamp - last[0])
+        matched = None
+        for rule in rules:
+            if rule.devices and not rule.devices(device_name):
+                continue
+            if (rule.value and rule.value(value)) or (rate is not None and rule.rate and rule.rate(rate)):
+                if matched is None:
+                    matched = []
+                matched.append(rule)
+        return matched
+
+    def _push(self, reading, rules):
+        """
+        Push an alert on the priority lane, to the clouds of its rules with the measures of the routes of its device.
+        :return: Alert, None if it is dropped or it has no clouds.
+        :rtype: Alert.
+        """
+        for rule in rules:
+            ALERTS.inc(rule.name)
+        logging.warning('Alert %s: %s %s', ', '.join(rule.name for rule in rules), reading.device_name,
+                        reading.to_dict())
+        names = set()
+        for rule in rules:
+            if rule.clouds is None:
+                names.update(self.clouds)
+                break
+            names.update(rule.clouds)
+        clouds = [cloud for name, cloud in list(self.clouds.items()) if name in names]
+        routing = self.routing
+        if routing:
+            sends = []
+            for route in routing.lookup(reading.device_name):
+                if route.cloud in clouds:
+                    data = route.select(reading)
+                    if data is not None:
+                        sends.append((route.cloud, data, route.strategy))
+            alert = Alert(reading, tuple(sends))
+        else:
+            alert = Alert(reading, tuple((cloud, reading, None) for cloud in clouds))
+        if not alert.sends:
+            return None
+        try:
+            self._queue.put_nowait(alert)
+        except Full:
+            READINGS_DROPPED.inc('alert')
+            logging.error('Alert lane full, alert of %s dropped', reading.device_name)
+            return None
+        return alert
+
+    # noinspection PyBroadException
+    def _deliver(self):
+        """
+        Send the alerts to their clouds until None is received, or until there are no alerts waiting once closed.
+        """
+        while True:
+            try:
+                alert = self._queue.get(timeout=STOP_CHECK_INTERVAL)
+            except Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            if alert is None:
+                return
+            reading = alert.reading
+            try:
+                for cloud, data, _ in alert.sends:
+                    try:
+                        cloud.send_now(data, reading.device_name)
+                        ALERT_SECONDS.observe(time.time() - reading.timestamp, cloud.name)
+                        alert.delivered.append(cloud)
+                    except Exception as e:
+                        logging.error('Unable to send alert of %s to %s: %s', reading.device_name, cloud.name, e)
+            finally:
+                alert._done.set()
+
+    def close(self, timeout=None):
+        """
+        Stop the priority lane once the alerts waiting have been sent.
+        :param timeout: Seconds to wait for the alerts waiting, until they are sent by default.
+        :type timeout: float.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        self._stopping.set()
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except Full:
+                # The threads stop when the lane is empty
+                break
+        for thread in self._threads:
+            thread.join(max(deadline - time.time(), 0) if deadline is not None else None)
@@ -1,16 +1,23 @@
 """
 Classes to interact with cloud systems.
 """
-import json
 from abc import ABCMeta, abstractmethod
 import logging
-import paho.mqtt.client as mqttc
+import time
 import ssl
+from threading import Lock
 from retry import retry
 from cloud_connector.cc_exceptions import ConnectionException
+from cloud_connector.data.payloads import build_codec
 from cloud_connector.data.strategies import All
+from cloud_connector.lazy import LazyImport
+from cloud_connector.metrics import (STRATEGY_SECONDS, CLOUD_SEND_SECONDS, READINGS_SENT, READINGS_SUPPRESSED,
+                                     READINGS_DROPPED, RetryCounter)
 from cloud_connector.third_party.thethingsAPI import thethingsiO
-from pubnub import Pubnub
+
+# Client libraries are imported when a client of the cloud is created
+mqttc = LazyImport('paho.mqtt.client')
+Pubnub = LazyImport('pubnub:Pubnub')
 
 QOS_LEVEL = 1
 CLOUD_RETRIES = 7
@@ -36,34 +43,83 @@ class CloudServiceBase(object):
         else:
             self.strategy = strategy
 
-    def insert_data(self, data, device_name):
+    def insert_data(self, data, device_name, trace=None, strategy=None):
         """
         Insert data into cloud service if strategy allows to.
         :param data: Data to be inserted
-        :type data: dict.
+        :type data: Reading or dict.
         :param device_name:
         :type device_name:str.
-        :return: Class name
+        :param trace: Trace of the reading, if it is traced.
+        :type trace: Trace.
+        :param strategy: Strategy of the route of the device, the strategy of the cloud service by default.
+        :type strategy: StrategyBase.
+        :return: Class name, or None if data has not been sent.
         :rtype: str.
         """
-        if self.strategy.has_to_send_data(data):
-            self._send_data(data, device_name)
+        start = time.perf_counter()
+        has_to_send_data = (strategy or self.strategy).has_to_send_data(data)
+        STRATEGY_SECONDS.observe(time.perf_counter() - start, self.name)
+        if trace:
+            trace.mark('strategy:' + self.name)
+        if has_to_send_data:
+            start = time.perf_counter()
+            try:
+                sent = self._send_data(data, device_name)
+            except Exception:
+                READINGS_DROPPED.inc('cloud')
+                if trace:
+                    trace.mark('failed:' + self.name)
+                raise
+            if sent is False:
+                if trace:
+                    trace.mark('failed:' + self.name)
+                return None
+            CLOUD_SEND_SECONDS.observe(time.perf_counter() - start, self.name)
+            READINGS_SENT.inc(self.name)
+            if trace:
+                trace.mark('sent:' + self.name)
             return self.__class__.__name__
         else:
-            logging.debug('Data is not going to be updated to {} cloud service.'.format(self.name))
+            READINGS_SUPPRESSED.inc(self.name)
+            if trace:
+                trace.mark('suppressed:' + self.name)
+            logging.debug('Data is not going to be updated to %s cloud service.', self.name)
             return False
 
+    def send_now(self, data, device_name):
+        """
+        Send data to the cloud service without evaluating the strategy, for alerts.
+        :param data: Data to be inserted
+        :type data: Reading or dict.
+        :param device_name:
+        :type device_name:str.
+        :raises: ConnectionException, if data has not been sent.
+        """
+        start = time.perf_counter()
+        if self._send_data(data, device_name) is False:
+            raise ConnectionException('Data of {} not sent to {}'.format(device_name, self.name))
+        CLOUD_SEND_SECONDS.observe(time.perf_counter() - start, self.name)
+        READINGS_SENT.inc(self.name)
+
     @abstractmethod
     def _send_data(self, data, device_name):
         """
         Send the data to the cloud
         :param data: Data to be inserted
-        :type data: dict.
+        :type data: Reading or dict.
         :param device_name:
         :type device_name:str.
+        :return: False if data has not been sent and the error has been handled.
         """
         raise NotImplementedError
 
+    def close(self):
+        """
+        Close cloud service connection (if necessary)
+        """
+        pass
+
 
 # noinspection PyShadowingNames
 class CloudAmazonMQTT(CloudServiceBase):
@@ -71,9 +127,10 @@ class CloudAmazonMQTT(CloudServiceBase):
     Configures Amazon as Cloud Service using MQTT
     """
 
-    def __init__(self, host, port, ca_path, cert_path, key_path, strategy=None):
+    def __init__(self, host, port, ca_path=None, cert_path=None, key_path=None, strategy=None, codec=None):
         """
-        Initialize the class
+        Initialize the class. The connection uses TLS when a Certificate Authority is given, without it any MQTT broker
+        can be used, for instance a local one.
         :param host: AWS host
         :type host: str
         :param port: AWS port
@@ -86,10 +143,15 @@ class CloudAmazonMQTT(CloudServiceBase):
         :type key_path: str
         :param strategy: Strategy object to send data to cloud.
         :type strategy: StrategyBase.
+        :param codec: Payload codec type and parameters, JSON by default.
+        :type codec: dict.
         """
         super(CloudAmazonMQTT, self).__init__(strategy)
         self.name = 'AWS IoT'
         self._conn_flag = False
+        self.codec = build_codec(codec)
+        # Messages of a device are coded against the previous one, so they are published in the order encoded
+        self._publish_lock = Lock()
 
         self._mqtt_client = mqttc.Client()
         self._configure_mqtt_client(ca_path, cert_path, key_path)
@@ -109,6 +171,8 @@ class CloudAmazonMQTT(CloudServiceBase):
         """
         self._mqtt_client.on_connect = self._on_connect
         self._mqtt_client.on_message = self._on_message
+        if not ca_path:
+            return
         # Use PROTOCOL_TLSv1 to ensure compatibility with python < 2.7.9
         self._mqtt_client.tls_set(ca_path,
                                   certfile=cert_path,
@@ -123,7 +187,7 @@ class CloudAmazonMQTT(CloudServiceBase):
         on_connect method passed to MQTT client
         """
         self._conn_flag = True
-        logging.debug('Amazon connection returned result: {}'.format(rc))
+        logging.debug('Amazon connection returned result: %s', rc)
 
     # noinspection PyUnusedLocal
     @staticmethod
@@ -131,24 +195,35 @@ class CloudAmazonMQTT(CloudServiceBase):
         """
         on_message method passed to MQTT client
         """
-        logging.debug('msg.topic {}'.format(msg.payload))
+        logging.debug('msg.topic %s', msg.payload)
 
-    @retry(ConnectionException, tries=CLOUD_RETRIES, delay=CLOUD_RETRY_WAIT)
+    @retry(ConnectionException, tries=CLOUD_RETRIES, delay=CLOUD_RETRY_WAIT, logger=RetryCounter('AWS IoT'))
     def _send_data(self, data, device_name):
         logging.debug('Trying to send MQTT message')
         if not self._conn_flag:
             logging.error('Not connected to AWS MQTT')
             raise ConnectionException('Unable to connect with AWS IoT')
         topic = '{}/{}'.format(BASE_TOPIC, device_name)
-        data_json = self._convert_data_to_json(data)
-        self._mqtt_client.publish(topic,
-                                  data_json,
-                                  qos=QOS_LEVEL)
-        logging.info('Sent to AWS: {}:{}'.format(topic, data_json))
+        with self._publish_lock:
+            payload = self.codec.encode(data, device_name)
+            try:
+                self._mqtt_client.publish(topic,
+                                          payload,
+                                          qos=QOS_LEVEL)
+            except Exception:
+                # The next message of the device can not be coded against this one
+                self.codec.reset(device_name)
+                raise
+        logging.info('Sent to AWS: %s:%s', topic, payload)
 
-    @staticmethod
-    def _convert_data_to_json(data):
-        return json.dumps(data)
+    def close(self):
+        """
+        Disconnect from AWS, waiting for the network loop to send the pending messages.
+        """
+        self._mqtt_client.disconnect()
+        self._mqtt_client.loop_stop()
+        self._conn_flag = False
+        logging.info('AWS MQTT connection closed')
 
 
 class CloudThingsIO(CloudServiceBase):
@@ -156,28 +231,30 @@ class CloudThingsIO(CloudServiceBase):
     Configures thethings.io as cloud service
     """
 
-    def __init__(self, tokens, strategy=None):
+    def __init__(self, tokens, strategy=None, url=None):
         """
         Initialize class
         :param tokens: Dictionary of devices and tokens.
         :type tokens: dict.
         :param strategy: Strategy object to send data to cloud.
         :type strategy: StrategyBase.
+        :param url: Things API URL, thethings.io by default.
+        :type url: str.
         """
         super(CloudThingsIO, self).__init__(strategy=strategy)
         self.name = 'thethings.io'
         self._tokens = tokens
         self._thethings_connector = {}
         for device_name, token in tokens.items():
-            self._thethings_connector[device_name] = thethingsiO(token)
+            self._thethings_connector[device_name] = thethingsiO(token, url_root=url)
 
     def _send_data(self, data, device_name):
         """
         Insert data into thethings.io
         :param data: Data to be sent.
         :param device_name: dict.
-        :return: Class name.
-        :rtype: str.
+        :return: False if the device has no token or data could not be sent.
+        :rtype: bool.
         """
         try:
             tt = self._thethings_connector[device_name]
@@ -186,18 +263,22 @@ class CloudThingsIO(CloudServiceBase):
             try:
                 logging.debug('Sending data to thethings.iO')
                 response_code = tt.write()
-                logging.info('Sent to thethings.io with response code {}: {}:{}'.format(response_code, device_name, data))
+                logging.info('Sent to thethings.io with response code %s: %s:%s', response_code, device_name, data)
             except Exception:
+                READINGS_DROPPED.inc('cloud')
                 logging.error('Unable to send data to thethings.io')
+                return False
         except KeyError:
-            logging.warning('Device <{0}> not found on thethingsio'.format(device_name))
+            logging.warning('Device <%s> not found on thethingsio', device_name)
+            return False
+        return True
 
 
 class CloudPubNub(CloudServiceBase):
     """
     PubNub cloud service connector
     """
-    def __init__(self, publish_key, subscribe_key, strategy=None):
+    def __init__(self, publish_key, subscribe_key, strategy=None, origin=None):
         """
 
         :param publish_key: Publish key
@@ -206,10 +287,15 @@ class CloudPubNub(CloudServiceBase):
         :type subscribe_key: str
         :param strategy: Strategy object to send data to cloud.
         :type strategy: StrategyBase.
+        :param origin: PubNub host and port, PubNub network by default.
+        :type origin: str.
         """
         super(CloudPubNub, self).__init__(strategy=strategy)
         self.name = 'pubnub'
-        self.pubnub = Pubnub(publish_key=publish_key, subscribe_key=subscribe_key)
+        if origin:
+            self.pubnub = Pubnub(publish_key=publish_key, subscribe_key=subscribe_key, origin=origin)
+        else:
+            self.pubnub = Pubnub(publish_key=publish_key, subscribe_key=subscribe_key)
         self.pubnub.subscribe(channels="iot_data", callback=self._callback_subscribe, error=self._error)
 
     @staticmethod
@@ -217,22 +303,29 @@ class CloudPubNub(CloudServiceBase):
         """
         Callback method for subscribe.
         """
-        logging.info('PubNub reads: {}'.format(message))
+        logging.info('PubNub reads: %s', message)
 
     @staticmethod
     def _error(message):
         """
         Error method for subscribe.
         """
-        logging.error('PubNub: {}'.format(message))
+        logging.error('PubNub: %s', message)
 
     @staticmethod
     def _callback_publish(message):
         """
         Callback method for publish.
         """
-        logging.info('PubNub: {}'.format(message))
+        logging.info('PubNub: %s', message)
 
     def _send_data(self, data, device_name):
-        self.pubnub.publish("iot_data", data, callback=self._callback_publish, error=self._callback_publish)
+        self.pubnub.publish("iot_data", dict(data), callback=self._callback_publish, error=self._callback_publish)
+
+    def close(self):
+        """
+        Unsubscribe from PubNub channel.
+        """
+        self.pubnub.unsubscribe(channel="iot_data")
+        logging.info('PubNub connection closed')
 
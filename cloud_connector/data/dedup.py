@@ -0,0 +1,214 @@
+"""
+Detection of readings received more than once, when devices or gateways retry a request whose response was lost.
+
+A reading can be identified by a sequence number given by its device, checked against a sliding window of the latest
+sequence numbers of the device as in the IPsec anti-replay window. A sequence number behind the newest one received
+after restart_gap seconds without readings of the device is taken as a restart of its counter, retries come sooner.
+Readings without a sequence number can be identified by a hash of their content and the timestamp given by the client,
+checked against two Bloom filters rotated every ttl seconds, so a retry is detected during at least ttl seconds.
+Readings without sequence number or timestamp are not checked, since equal readings of a stable measure are not
+duplicates. Memory is bounded in both cases, a Bloom filter may take a new reading as a duplicate with probability
+error_rate. A reading whose send fails is forgotten, so the retry of the client is sent.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+from math import ceil, log
+from threading import Lock
+import time
+
+from cloud_connector.data.model import DEFAULT_MAX_DEVICES
+from cloud_connector.metrics import DEDUP_HITS
+
+DEFAULT_WINDOW = 1024
+DEFAULT_RESTART_GAP = 10
+DEFAULT_TTL = 300
+DEFAULT_CAPACITY = 100000
+DEFAULT_ERROR_RATE = 0.001
+
+
+def content_hash(data, device_name, timestamp=None):
+    """
+    Hash of the data of a device at a time, the same for equal data whatever the order of its measures.
+    :param data: Data received.
+    :type data: dict.
+    :param device_name: Device name.
+    :type device_name: str.
+    :param timestamp: Time of the reading given by the client.
+    :type timestamp: float.
+    :rtype: bytes.
+    """
+    content = json.dumps([device_name, timestamp, data], sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+
+class BloomFilter(object):
+    """
+    Bloom filter of hashes, each hash gives the positions of its bits.
+    :param capacity: Number of hashes for the error rate.
+    :type capacity: int.
+    :param error_rate: Probability of a false positive when the filter holds capacity hashes.
+    :type error_rate: float.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.bits = int(ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits / capacity * log(2))))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, digest):
+        # Double hashing with the two halves of the digest
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:16], 'little') | 1
+        return [(first + index * second) % self.bits for index in range(self.hashes)]
+
+    def __contains__(self, digest):
+        array = self._array
+        return all(array[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class Deduplicator(object):
+    """
+    Remembers the readings received to detect duplicates.
+    :param window: Sequence numbers remembered for each device. A sequence number that far behind the newest one is
+        taken as a restart of the device, and the window starts again.
+    :type window: int.
+    :param max_devices: Maximum number of devices whose window is kept, the least recently updated are evicted.
+    :type max_devices: int.
+    :param restart_gap: Seconds without readings of a device after which a sequence number behind the newest one is
+        taken as a restart of the device, and the window starts again.
+    :type restart_gap: float.
+    :param hash: Identify readings without sequence number by the hash of their content and timestamp, only when the
+        client gives the timestamp.
+    :type hash: bool.
+    :param ttl: Seconds a content hash is remembered at least, and at most twice that.
+    :type ttl: float.
+    :param capacity: Hashes of each Bloom filter, it is rotated early when it is full.
+    :type capacity: int.
+    :param error_rate: Probability of taking a new reading as a duplicate.
+    :type error_rate: float.
+    """
+
+    # noinspection PyShadowingBuiltins
+    def __init__(self, window=DEFAULT_WINDOW, max_devices=DEFAULT_MAX_DEVICES, hash=False, ttl=DEFAULT_TTL,
+                 capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE, restart_gap=DEFAULT_RESTART_GAP):
+        self.window = window
+        self.max_devices = max_devices
+        self.restart_gap = restart_gap
+        self.hash = hash
+        self.ttl = ttl
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.hits = 0
+        # Newest sequence number, bit mask of the ones received behind it and time of the last reading, by device
+        self._sequences = OrderedDict()
+        self._mask = (1 << window) - 1
+        self._filters = [BloomFilter(capacity, error_rate), BloomFilter(capacity, error_rate)]
+        self._rotation = time.monotonic() + ttl
+        # Hashes can not be removed from a Bloom filter, the ones forgotten are kept until they leave the filters
+        self._forgotten = {}
+        self._lock = Lock()
+
+    def seen(self, data, device_name, sequence=None, timestamp=None):
+        """
+        Check if a reading has been received before, and remember it otherwise.
+        :param data: Data received.
+        :type data: dict.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param sequence: Sequence number of the reading given by the device.
+        :type sequence: int.
+        :param timestamp: Time of the reading given by the client, to identify it by its hash.
+        :type timestamp: float.
+        :return: True if the reading is a duplicate.
+        :rtype: bool.
+        """
+        if sequence is not None:
+            method = 'sequence'
+            with self._lock:
+                duplicate = self._seen_sequence(device_name, sequence)
+                if duplicate:
+                    self.hits += 1
+        elif self.hash and timestamp is not None:
+            method = 'hash'
+            digest = content_hash(data, device_name, timestamp)
+            with self._lock:
+                duplicate = self._seen_hash(digest)
+                if duplicate:
+                    self.hits += 1
+        else:
+            return False
+        if duplicate:
+            DEDUP_HITS.inc(method)
+        return duplicate
+
+    def forget(self, data, device_name, sequence=None, timestamp=None):
+        """
+        Forget a reading remembered by seen, because it could not be sent. It is not a duplicate when it is received
+        again.
+        :param data: Data received.
+        :type data: dict.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param sequence: Sequence number of the reading given by the device.
+        :type sequence: int.
+        :param timestamp: Time of the reading given by the client.
+        :type timestamp: float.
+        """
+        if sequence is not None:
+            with self._lock:
+                state = self._sequences.get(device_name)
+                if state is not None and 0 <= state[0] - sequence < self.window:
+                    self._sequences[device_name] = (state[0], state[1] & ~(1 << state[0] - sequence), state[2])
+        elif self.hash and timestamp is not None:
+            digest = content_hash(data, device_name, timestamp)
+            with self._lock:
+                # It leaves the filters after two rotations
+                self._forgotten[digest] = time.monotonic() + 2 * self.ttl
+
+    def _seen_sequence(self, device_name, sequence):
+        sequences = self._sequences
+        state = sequences.get(device_name)
+        now = time.monotonic()
+        if state is None:
+            sequences[device_name] = (sequence, 1, now)
+            if len(sequences) > self.max_devices:
+                sequences.popitem(last=False)
+            return False
+        sequences.move_to_end(device_name)
+        newest, mask, last_seen = state
+        if sequence > newest:
+            shift = sequence - newest
+            sequences[device_name] = (sequence, ((mask << shift) | 1) & self._mask if shift < self.window else 1, now)
+            return False
+        offset = newest - sequence
+        if offset >= self.window or (offset and now - last_seen >= self.restart_gap):
+            # Restarted device, its counter starts again
+            sequences[device_name] = (sequence, 1, now)
+            return False
+        if mask >> offset & 1:
+            sequences[device_name] = (newest, mask, now)
+            return True
+        sequences[device_name] = (newest, mask | 1 << offset, now)
+        return False
+
+    def _seen_hash(self, digest):
+        current, previous = self._filters
+        if time.monotonic() >= self._rotation or current.count >= self.capacity:
+            previous, current = current, BloomFilter(self.capacity, self.error_rate)
+            self._filters = [current, previous]
+            self._rotation = time.monotonic() + self.ttl
+            now = time.monotonic()
+            self._forgotten = {forgotten: expiry for forgotten, expiry in self._forgotten.items() if expiry > now}
+        if self._forgotten.pop(digest, None) is not None:
+            current.add(digest)
+            return False
+        if digest in current or digest in previous:
+            return True
+        current.add(digest)
+        return False
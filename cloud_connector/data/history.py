@@ -0,0 +1,161 @@
+"""
+Class to read the history of a device from the TSDB, caching recent results in memory. A cached result is removed when
+data of its device arrives within its time range, so ranges up to now are always current and past ranges are reused.
+"""
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from cloud_connector.data.model import RecordBatch
+from cloud_connector.data.tsdb import HISTORY_CHUNK_SIZE
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 60
+DEFAULT_MAX_POINTS = 10000
+
+
+def _covers(start, end, timestamp):
+    return (start is None or start <= timestamp) and (end is None or timestamp <= end)
+
+
+class _Query(object):
+    """
+    Query being read from the TSDB, marked as stale if data of its range arrives meanwhile.
+    """
+    __slots__ = ('start', 'end', 'stale')
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.stale = False
+
+
+class History(object):
+    """
+    Reads histories from the TSDB in chunks, with an LRU cache of results with a time to live. Results with more than
+    max_points points are streamed without being cached.
+    :param max_entries: Maximum number of results cached.
+    :type max_entries: int.
+    :param ttl: Seconds a result is cached.
+    :type ttl: float.
+    :param max_points: Maximum number of points of a cached result.
+    :type max_points: int.
+    :param chunk_size: Points read from the TSDB at once.
+    :type chunk_size: int.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, max_points=DEFAULT_MAX_POINTS,
+                 chunk_size=HISTORY_CHUNK_SIZE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_points = max_points
+        self.chunk_size = chunk_size
+        self.hits = 0
+        self.misses = 0
+        # Points and expiration time by query key, the least recently used first
+        self._entries = OrderedDict()
+        # Keys cached and queries being read, by device name
+        self._keys = {}
+        self._queries = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def query(self, tsdb, device_name, measures=None, start=None, end=None, limit=None):
+        """
+        Get the points of a device in a time range, from the cache or from the TSDB.
+        :param tsdb: TSDB to read from.
+        :type tsdb: TSDatabase.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param measures: Measures to get, all by default.
+        :type measures: list.
+        :param start: Start time in epoch seconds, no limit by default.
+        :type start: float.
+        :param end: End time in epoch seconds, no limit by default.
+        :type end: float.
+        :param limit: Maximum number of points.
+        :type limit: int.
+        :return: Iterator of lists of points, oldest first.
+        """
+        key = (device_name, tuple(sorted(measures)) if measures else None, start, end, limit)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                points = entry[0]
+            else:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                points = None
+        if points is not None:
+            return self._chunks(points)
+        return self._read(tsdb, key, measures)
+
+    def _chunks(self, points):
+        for index in range(0, len(points), self.chunk_size):
+            yield points[index:index + self.chunk_size]
+
+    def _read(self, tsdb, key, measures):
+        device_name, _, start, end, limit = key
+        query = _Query(start, end)
+        with self._lock:
+            self._queries.setdefault(device_name, []).append(query)
+        points = []
+        try:
+            for chunk in tsdb.history(device_name, measures, start, end, limit, self.chunk_size):
+                if points is not None:
+                    points.extend(chunk)
+                    if len(points) > self.max_points:
+                        points = None
+                yield chunk
+        finally:
+            with self._lock:
+                queries = self._queries[device_name]
+                queries.remove(query)
+                if not queries:
+                    del self._queries[device_name]
+        if points is not None and not query.stale:
+            self._put(key, points)
+
+    def _put(self, key, points):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                self._keys.setdefault(key[0], set()).add(key)
+            self._entries[key] = (points, time.monotonic() + self.ttl)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._keys[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys[key[0]]
+
+    def invalidate(self, readings):
+        """
+        Remove the cached results whose range includes new readings of their device.
+        :param readings: Readings received.
+        :type readings: RecordBatch or list.
+        """
+        if not self._keys and not self._queries:
+            return
+        if isinstance(readings, RecordBatch):
+            pairs = zip(readings.device_names, readings.timestamps)
+        else:
+            pairs = ((reading.device_name, reading.timestamp) for reading in readings)
+        with self._lock:
+            for device_name, timestamp in pairs:
+                keys = self._keys.get(device_name)
+                if keys:
+                    for key in [key for key in keys if _covers(key[2], key[3], timestamp)]:
+                        self._remove(key)
+                for query in self._queries.get(device_name, ()):
+                    if _covers(query.start, query.end, timestamp):
+                        query.stale = True
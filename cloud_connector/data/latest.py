@@ -0,0 +1,87 @@
+"""
+Class to keep in memory the latest value of each measure of each device, to read current values without querying the
+TSDB.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+from cloud_connector.data.model import DEFAULT_MAX_DEVICES
+
+DEFAULT_MAX_MEASURES = 64
+
+
+class LatestCache(object):
+    """
+    Latest reading of each device and measure. The readings are kept without copying them, and a measure is only
+    replaced by a newer reading, so data replayed from the spool does not hide current values. Memory is bounded: the
+    devices not updated for the longest time are evicted, and new measures of a device are ignored when it has too many.
+    :param max_devices: Maximum number of devices kept.
+    :type max_devices: int.
+    :param max_measures: Maximum number of measures kept for each device.
+    :type max_measures: int.
+    """
+
+    def __init__(self, max_devices=DEFAULT_MAX_DEVICES, max_measures=DEFAULT_MAX_MEASURES):
+        self.max_devices = max_devices
+        self.max_measures = max_measures
+        self.evicted = 0
+        # Readings of each measure by device, the least recently updated device first
+        self._devices = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def update(self, readings):
+        """
+        Keep the readings that are newer than the ones kept.
+        :param readings: Readings received.
+        :type readings: RecordBatch or list.
+        """
+        devices, max_measures = self._devices, self.max_measures
+        with self._lock:
+            for reading in readings:
+                device_name, timestamp = reading.device_name, reading.timestamp
+                measures = devices.get(device_name)
+                if measures is None:
+                    measures = devices[device_name] = {}
+                    if len(devices) > self.max_devices:
+                        devices.popitem(last=False)
+                        self.evicted += 1
+                else:
+                    devices.move_to_end(device_name)
+                for measure in reading:
+                    last = measures.get(measure)
+                    if last is None:
+                        if len(measures) >= max_measures:
+                            continue
+                    elif last.timestamp > timestamp:
+                        continue
+                    measures[measure] = reading
+
+    def get(self, device_name):
+        """
+        Latest value of each measure of a device, and the time it was received.
+        :param device_name: Device name.
+        :type device_name: str.
+        :return: Value and timestamp by measure, or None if the device is not kept.
+        :rtype: dict.
+        """
+        with self._lock:
+            measures = self._devices.get(device_name)
+            if measures is None:
+                return None
+            measures = list(measures.items())
+        return {measure: {'value': reading[measure], 'timestamp': reading.timestamp} for measure, reading in measures}
+
+    def get_all(self):
+        """
+        Latest values of all the devices.
+        :return: Value and timestamp by measure, by device name.
+        :rtype: dict.
+        """
+        with self._lock:
+            devices = [(device_name, list(measures.items())) for device_name, measures in self._devices.items()]
+        return {device_name: {measure: {'value': reading[measure], 'timestamp': reading.timestamp}
+                              for measure, reading in measures}
+                for device_name, measures in devices}
@@ -0,0 +1,238 @@
+"""
+Data model of the readings moving through the pipeline. A Reading is an immutable and compact reading of a device, and
+a RecordBatch keeps the readings of many devices with the same measures in columns. Both are read only mappings of
+measure to value, so sinks and strategies use them as they used data dictionaries.
+"""
+import time
+from collections.abc import Mapping, Sequence
+from operator import attrgetter
+
+# Maximum number of schemas (measure names) shared between readings
+SCHEMA_CACHE_SIZE = 1024
+# Devices whose state is kept by the caches and tables of each device, twice a fleet of 50000 devices so the devices
+# that come and go do not evict the ones sending data. max_devices in the configuration file changes it.
+DEFAULT_MAX_DEVICES = 100000
+
+_schemas = {}
+
+
+class Schema(object):
+    """
+    Measure names of readings and the position of each one, shared by all the readings with the same measures.
+    :param names: Measure names.
+    :type names: tuple.
+    """
+    __slots__ = ('names', 'index')
+
+    def __init__(self, names):
+        self.names = names
+        self.index = {name: position for position, name in enumerate(names)}
+
+
+def get_schema(names):
+    """
+    Get the shared schema of some measure names.
+    :param names: Measure names.
+    :type names: tuple.
+    :rtype: Schema.
+    """
+    schema = _schemas.get(names)
+    if schema is None:
+        schema = Schema(names)
+        if len(_schemas) < SCHEMA_CACHE_SIZE:
+            _schemas[names] = schema
+    return schema
+
+
+def _to_float(value):
+    return float(value) if isinstance(value, int) else value
+
+
+class Reading(Mapping):
+    """
+    Immutable reading of a device: measure values, device name and the time it was received. Integer values are stored
+    as floats, so a measure has the same type in the TSDB whatever the device sends.
+    :param device_name: Device name.
+    :type device_name: str.
+    :param fields: Value of each measure.
+    :type fields: dict.
+    :param timestamp: Time of the reading, current time by default.
+    :type timestamp: float.
+    """
+    __slots__ = ('_device_name', '_timestamp', '_schema', '_values')
+
+    def __init__(self, device_name, fields, timestamp=None):
+        values = tuple(fields.values())
+        for value in values:
+            if isinstance(value, int):
+                values = tuple([_to_float(value) for value in values])
+                break
+        self._device_name = device_name
+        self._timestamp = time.time() if timestamp is None else timestamp
+        self._schema = get_schema(tuple(fields))
+        self._values = values
+
+    @classmethod
+    def _make(cls, device_name, timestamp, schema, values):
+        """
+        Create a reading without converting its values, for readings of a batch.
+        """
+        reading = cls.__new__(cls)
+        reading._device_name = device_name
+        reading._timestamp = timestamp
+        reading._schema = schema
+        reading._values = values
+        return reading
+
+    device_name = property(attrgetter('_device_name'), doc='Device name.')
+    timestamp = property(attrgetter('_timestamp'), doc='Time of the reading.')
+
+    def __getitem__(self, measure):
+        return self._values[self._schema.index[measure]]
+
+    def __contains__(self, measure):
+        return measure in self._schema.index
+
+    def __iter__(self):
+        return iter(self._schema.names)
+
+    def __len__(self):
+        return len(self._values)
+
+    def items(self):
+        """
+        Measures and values.
+        :rtype: iterator.
+        """
+        return zip(self._schema.names, self._values)
+
+    def values(self):
+        """
+        Values of the measures.
+        :rtype: tuple.
+        """
+        return self._values
+
+    def to_dict(self):
+        """
+        New dictionary of measure and value, to be serialized.
+        :rtype: dict.
+        """
+        return dict(zip(self._schema.names, self._values))
+
+    def __eq__(self, other):
+        if isinstance(other, Reading):
+            return (self.device_name == other.device_name and self.timestamp == other.timestamp and
+                    self._schema.names == other._schema.names and self._values == other._values)
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return Reading, (self.device_name, self.to_dict(), self.timestamp)
+
+    def __repr__(self):
+        return 'Reading({!r}, {!r}, {!r})'.format(self.device_name, self.to_dict(), self.timestamp)
+
+
+class RecordBatch(Sequence):
+    """
+    Readings of many devices with the same measures, kept in a column of values for each measure. Readings are created
+    when they are accessed.
+    :param device_names: Device name of each reading.
+    :type device_names: list.
+    :param columns: Values of each reading for each measure.
+    :type columns: dict.
+    :param timestamps: Time of each reading, or a time for all of them (current time by default).
+    :type timestamps: list or float.
+    """
+    __slots__ = ('device_names', 'timestamps', 'columns', '_schema')
+
+    def __init__(self, device_names, columns, timestamps=None):
+        self.device_names = list(device_names)
+        if timestamps is None:
+            timestamps = time.time()
+        if not isinstance(timestamps, (list, tuple)):
+            timestamps = [timestamps] * len(self.device_names)
+        self.timestamps = timestamps
+        self.columns = columns
+        self._schema = get_schema(tuple(columns))
+        for measure, column in columns.items():
+            if len(column) != len(self.device_names) or len(timestamps) != len(self.device_names):
+                raise ValueError('Column {} has {} values for {} devices'.format(measure, len(column),
+                                                                                 len(self.device_names)))
+
+    @classmethod
+    def from_pairs(cls, readings, timestamp=None):
+        """
+        Create a batch from data dictionaries with the same measures.
+        :param readings: List of data and device name.
+        :type readings: list.
+        :param timestamp: Time of the readings, current time by default.
+        :type timestamp: float.
+        :rtype: RecordBatch.
+        :raises: ValueError if the readings do not have the same measures.
+        """
+        measures = tuple(readings[0][0]) if readings else ()
+        columns = {measure: [] for measure in measures}
+        for data, device_name in readings:
+            if len(data) != len(measures):
+                raise ValueError('Reading of {} has measures {}, not {}'.format(device_name, list(data), measures))
+            for measure, value in data.items():
+                try:
+                    columns[measure].append(_to_float(value))
+                except KeyError:
+                    raise ValueError('Reading of {} has measure {}, not in {}'.format(device_name, measure, measures))
+        return cls([device_name for _, device_name in readings], columns, timestamp)
+
+    @property
+    def measures(self):
+        """
+        Measure names.
+        :rtype: tuple.
+        """
+        return self._schema.names
+
+    def column(self, measure):
+        """
+        Values of a measure for all the readings.
+        :param measure: Measure name.
+        :type measure: str.
+        :rtype: list.
+        """
+        return self.columns[measure]
+
+    def __len__(self):
+        return len(self.device_names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RecordBatch(self.device_names[index],
+                               {measure: column[index] for measure, column in self.columns.items()},
+                               self.timestamps[index])
+        values = tuple(self.columns[measure][index] for measure in self._schema.names)
+        return Reading._make(self.device_names[index], self.timestamps[index], self._schema, values)
+
+    def __iter__(self):
+        make, schema = Reading._make, self._schema
+        rows = zip(*(self.columns[measure] for measure in schema.names)) if schema.names else ((),) * len(self)
+        for device_name, timestamp, values in zip(self.device_names, self.timestamps, rows):
+            yield make(device_name, timestamp, schema, values)
+
+    def __repr__(self):
+        return 'RecordBatch({} readings of {})'.format(len(self), list(self._schema.names))
+
+
+def to_reading(data, device_name, timestamp=None):
+    """
+    Get a reading from data received, without modifying it.
+    :param data: Reading or data dictionary.
+    :param device_name: Device name.
+    :type device_name: str.
+    :param timestamp: Time of the data, current time by default.
+    :type timestamp: float.
+    :rtype: Reading.
+    """
+    if isinstance(data, Reading):
+        return data
+    return Reading(device_name, data, timestamp)
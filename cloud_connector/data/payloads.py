@@ -0,0 +1,424 @@
+"""
+Codecs of the payloads sent to a cloud. The JSON codec sends the measures of each reading as a JSON object. The binary
+codec is for metered uplinks, it sends each reading of a device in a few bytes:
+
+- Measure names are coded as numbers, a name is only sent the first time after a keyframe.
+- Values are coded as decimal integers when they have a few decimals (22.5 is 225 with 1 decimal), or as float32 or
+  float64 otherwise, so values are not rounded. With delta coding a value is sent as the difference with the last
+  value of the measure sent, and an unchanged value only with its measure number.
+- The time of the reading is sent in milliseconds, as the difference with the previous reading.
+- The message can be compressed with zlib, when it is smaller.
+
+A message is a byte with the version and flags, followed by varints: sequence number of the device, time, number of
+measures and, for each measure, its number, kind of value and value. A device has a keyframe, with the names and the
+complete values, every keyframe_interval messages, so a decoder that misses a message (or starts later) decodes again
+from the next keyframe. The BinaryDecoder is the reference decoder, for the consumers of the cloud.
+"""
+from collections import OrderedDict
+import json
+import math
+import struct
+from threading import Lock
+import time
+import zlib
+
+from cloud_connector.cc_exceptions import ConfigurationError
+from cloud_connector.data.model import DEFAULT_MAX_DEVICES, Reading
+
+VERSION = 1
+KEYFRAME = 0x01
+COMPRESSED = 0x02
+FLAGS_MASK = 0x0f
+
+# Kinds of value
+SAME = 0
+DELTA = 1
+DECIMAL = 2
+FLOAT32 = 3
+FLOAT64 = 4
+TEXT = 5
+NULL = 6
+
+MAX_DECIMALS = 6
+DEFAULT_KEYFRAME_INTERVAL = 100
+
+_SCALES = tuple(10 ** places for places in range(MAX_DECIMALS + 1))
+_float32 = struct.Struct('<f')
+_float64 = struct.Struct('<d')
+
+
+def write_varint(buffer, number):
+    """
+    Append an unsigned integer to a buffer, 7 bits per byte.
+    :type buffer: bytearray.
+    :type number: int.
+    """
+    while number > 0x7f:
+        buffer.append((number & 0x7f) | 0x80)
+        number >>= 7
+    buffer.append(number)
+
+
+def read_varint(payload, position):
+    """
+    Read an unsigned integer.
+    :return: Integer and position after it.
+    :rtype: tuple.
+    :raises: ValueError, if the payload ends before the integer.
+    """
+    number = shift = 0
+    while True:
+        try:
+            byte = payload[position]
+        except IndexError:
+            raise ValueError('Truncated payload')
+        number |= (byte & 0x7f) << shift
+        position += 1
+        if byte < 0x80:
+            return number, position
+        shift += 7
+
+
+def zigzag(number):
+    """
+    Signed integer as unsigned, small negative numbers are small too.
+    """
+    return number * 2 if number >= 0 else -number * 2 - 1
+
+
+def unzigzag(number):
+    return number // 2 if not number & 1 else -(number + 1) // 2
+
+
+def decimals(value):
+    """
+    Smallest number of decimals that represent a value exactly.
+    :type value: float.
+    :return: Decimals, or None if it needs more than MAX_DECIMALS.
+    :rtype: int.
+    """
+    if not math.isfinite(value) or math.copysign(1, value) < 0 and value == 0:
+        # -0.0 is sent as float to keep its sign
+        return None
+    for places, scale in enumerate(_SCALES):
+        if round(value * scale) / scale == value:
+            return places
+    return None
+
+
+def _is_float32(value):
+    """
+    Whether a value is exact as float32.
+    """
+    try:
+        return _float32.unpack(_float32.pack(value))[0] == value
+    except OverflowError:
+        return False
+
+
+def _varint_size(number):
+    size = 1
+    while number > 0x7f:
+        number >>= 7
+        size += 1
+    return size
+
+
+class JsonCodec(object):
+    """
+    Measures of a reading as a JSON object, the default payload.
+    """
+    stateful = False
+
+    def encode(self, data, device_name):
+        """
+        :param data: Reading.
+        :type data: Reading or dict.
+        :param device_name: Device name.
+        :type device_name: str.
+        :rtype: str.
+        """
+        return json.dumps(dict(data))
+
+    def reset(self, device_name):
+        pass
+
+
+class _Stream(object):
+    """
+    Last message of a device, to code the next one.
+    """
+    __slots__ = ('sequence', 'timestamp', 'ids', 'values', 'messages')
+
+    def __init__(self):
+        self.sequence = 0
+        self.timestamp = 0
+        # Encoder: measure number by name. Decoder: measure name by number.
+        self.ids = {}
+        self.values = {}
+        self.messages = 0
+
+
+class BinaryCodec(object):
+    """
+    Compact binary payloads, coded against the last message of each device. Messages of a device have to be encoded in
+    the order they are sent.
+    :param delta: Code values as the difference with the last value sent.
+    :type delta: bool.
+    :param compress: Compress messages with zlib, when they are smaller.
+    :type compress: bool.
+    :param level: zlib compression level.
+    :type level: int.
+    :param keyframe_interval: Messages of a device between keyframes.
+    :type keyframe_interval: int.
+    :param max_devices: Devices whose last message is kept, the least recently sent starts with a keyframe.
+    :type max_devices: int.
+    """
+    stateful = True
+
+    def __init__(self, delta=True, compress=False, level=zlib.Z_BEST_COMPRESSION,
+                 keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, max_devices=DEFAULT_MAX_DEVICES):
+        self.delta = delta
+        self.compress = compress
+        self.level = level
+        self.keyframe_interval = keyframe_interval
+        self.max_devices = max_devices
+        self._streams = OrderedDict()
+        self._lock = Lock()
+
+    def encode(self, data, device_name):
+        """
+        :param data: Reading, values are numbers, text or None.
+        :type data: Reading or dict.
+        :param device_name: Device name.
+        :type device_name: str.
+        :rtype: bytes.
+        :raises: ValueError, if a value can not be coded.
+        """
+        timestamp = getattr(data, 'timestamp', None)
+        milliseconds = int(round((time.time() if timestamp is None else timestamp) * 1000))
+        with self._lock:
+            last = self._streams.get(device_name)
+            keyframe = last is None or last.messages >= self.keyframe_interval
+            stream = _Stream()
+            if last is not None:
+                stream.sequence = last.sequence
+                if not keyframe:
+                    stream.timestamp, stream.ids, stream.values, stream.messages = (last.timestamp, dict(last.ids),
+                                                                                    dict(last.values), last.messages)
+            # The stream is only updated when the message has been encoded
+            body = self._encode_body(data, stream, milliseconds, keyframe)
+            self._streams.pop(device_name, None)
+            self._streams[device_name] = stream
+            if len(self._streams) > self.max_devices:
+                self._streams.popitem(last=False)
+        flags = KEYFRAME if keyframe else 0
+        if self.compress:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            compressed = compressor.compress(body) + compressor.flush()
+            if len(compressed) < len(body):
+                body, flags = compressed, flags | COMPRESSED
+        return bytes([VERSION << 4 | flags]) + body
+
+    def _encode_body(self, data, stream, milliseconds, keyframe):
+        buffer = bytearray()
+        stream.sequence += 1
+        write_varint(buffer, stream.sequence)
+        write_varint(buffer, milliseconds if keyframe else zigzag(milliseconds - stream.timestamp))
+        write_varint(buffer, len(data))
+        for name, value in data.items():
+            measure_id = stream.ids.get(name)
+            new = measure_id is None
+            if new:
+                measure_id = stream.ids[name] = len(stream.ids)
+            last = stream.values.get(name) if self.delta and not keyframe else None
+            kind, payload, stream.values[name] = self._encode_value(value, last)
+            write_varint(buffer, measure_id << 4 | kind << 1 | new)
+            if new:
+                encoded_name = name.encode('utf-8')
+                write_varint(buffer, len(encoded_name))
+                buffer += encoded_name
+            buffer += payload
+        stream.timestamp = milliseconds
+        stream.messages += 1
+        return bytes(buffer)
+
+    @staticmethod
+    def _encode_value(value, last):
+        """
+        Shortest coding of a value.
+        :param last: Last value sent and its decimals, to code the value against it.
+        :type last: tuple.
+        :return: Kind, coded value, and the value and its decimals to code the next one.
+        :rtype: tuple.
+        """
+        if isinstance(value, int):
+            value = float(value)
+        if last is not None and type(last[0]) is type(value) and last[0] == value:
+            return SAME, b'', last
+        if value is None:
+            return NULL, b'', (None, None)
+        buffer = bytearray()
+        if isinstance(value, str):
+            encoded = value.encode('utf-8')
+            write_varint(buffer, len(encoded))
+            return TEXT, bytes(buffer) + encoded, (value, None)
+        if not isinstance(value, float):
+            raise ValueError('Value {!r} can not be coded'.format(value))
+        places = decimals(value)
+        state = (value, places)
+        if places is not None:
+            kind, coded_places, number = DECIMAL, places, zigzag(round(value * 10 ** places))
+            if last is not None and last[1] is not None:
+                delta_places = max(places, last[1])
+                scale = 10 ** delta_places
+                difference = round(value * scale) - round(last[0] * scale)
+                if (round(last[0] * scale) + difference) / scale == value and \
+                        _varint_size(zigzag(difference)) <= _varint_size(number):
+                    kind, coded_places, number = DELTA, delta_places, zigzag(difference)
+            # Decimals and varint against float32 when it is exact, or float64
+            if _varint_size(number) < _float64.size:
+                buffer.append(coded_places)
+                write_varint(buffer, number)
+                if len(buffer) <= _float32.size or not _is_float32(value):
+                    return kind, bytes(buffer), state
+        if _is_float32(value):
+            return FLOAT32, _float32.pack(value), state
+        return FLOAT64, _float64.pack(value), state
+
+    def reset(self, device_name):
+        """
+        Start the next message of a device with a keyframe, when a message encoded has not been sent.
+        :param device_name: Device name.
+        :type device_name: str.
+        """
+        with self._lock:
+            stream = self._streams.get(device_name)
+            if stream is not None:
+                stream.messages = self.keyframe_interval
+
+
+class BinaryDecoder(object):
+    """
+    Reference decoder of the binary codec, for the messages of many devices.
+    :param max_devices: Devices whose last message is kept.
+    :type max_devices: int.
+    """
+
+    def __init__(self, max_devices=DEFAULT_MAX_DEVICES):
+        self.max_devices = max_devices
+        self._streams = OrderedDict()
+
+    def decode(self, payload, device_name):
+        """
+        :param payload: Message.
+        :type payload: bytes.
+        :param device_name: Device name, for instance from the MQTT topic.
+        :type device_name: str.
+        :return: Reading, or None if the message has already been decoded (it was sent again).
+        :rtype: Reading.
+        :raises: ValueError, if the message is wrong or a previous message of the device is missing, in that case the
+            device is decoded again from its next keyframe.
+        """
+        if not payload or payload[0] >> 4 != VERSION:
+            raise ValueError('Unknown payload version')
+        flags = payload[0] & FLAGS_MASK
+        body = payload[1:]
+        if flags & COMPRESSED:
+            try:
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+            except zlib.error as e:
+                raise ValueError('Wrong payload compression: {}'.format(e))
+        keyframe = bool(flags & KEYFRAME)
+        sequence, position = read_varint(body, 0)
+        last = self._streams.get(device_name)
+        if last is not None and (sequence == last.sequence or (not keyframe and sequence < last.sequence)):
+            return None
+        if not keyframe and (last is None or sequence != last.sequence + 1):
+            self._streams.pop(device_name, None)
+            raise ValueError('Message {} of {} decoded without the previous one, waiting for a keyframe'.format(
+                sequence, device_name))
+        stream = _Stream()
+        if not keyframe:
+            stream.ids = dict(last.ids)
+            stream.values = dict(last.values)
+        try:
+            reading = self._decode_body(body, position, keyframe, stream, last, device_name)
+        except (KeyError, IndexError, TypeError, struct.error, UnicodeDecodeError) as e:
+            self._streams.pop(device_name, None)
+            raise ValueError('Wrong message {} of {}: {!r}'.format(sequence, device_name, e))
+        stream.sequence = sequence
+        self._streams.pop(device_name, None)
+        self._streams[device_name] = stream
+        if len(self._streams) > self.max_devices:
+            self._streams.popitem(last=False)
+        return reading
+
+    @staticmethod
+    def _decode_body(body, position, keyframe, stream, last, device_name):
+        milliseconds, position = read_varint(body, position)
+        stream.timestamp = milliseconds if keyframe else last.timestamp + unzigzag(milliseconds)
+        count, position = read_varint(body, position)
+        fields = {}
+        for _ in range(count):
+            header, position = read_varint(body, position)
+            measure_id, kind, new = header >> 4, header >> 1 & 0x07, header & 1
+            if new:
+                length, position = read_varint(body, position)
+                stream.ids[measure_id] = body[position:position + length].decode('utf-8')
+                position += length
+            try:
+                name = stream.ids[measure_id]
+            except KeyError:
+                raise ValueError('Unknown measure {} of {}'.format(measure_id, device_name))
+            if kind in (DELTA, DECIMAL):
+                if position >= len(body):
+                    raise ValueError('Truncated payload')
+                places = body[position]
+                number, position = read_varint(body, position + 1)
+                scale = 10 ** places
+                if kind == DELTA:
+                    value = (round(stream.values[name] * scale) + unzigzag(number)) / scale
+                else:
+                    value = unzigzag(number) / scale
+            elif kind == SAME:
+                value = stream.values[name]
+            elif kind == FLOAT32:
+                value = _float32.unpack_from(body, position)[0]
+                position += _float32.size
+            elif kind == FLOAT64:
+                value = _float64.unpack_from(body, position)[0]
+                position += _float64.size
+            elif kind == TEXT:
+                length, position = read_varint(body, position)
+                value = body[position:position + length].decode('utf-8')
+                position += length
+            elif kind == NULL:
+                value = None
+            else:
+                raise ValueError('Unknown kind of value {}'.format(kind))
+            fields[name] = value
+            stream.values[name] = value
+        return Reading(device_name, fields, stream.timestamp / 1000)
+
+
+available_codecs = {'json': JsonCodec,
+                    'binary': BinaryCodec,
+                    }
+
+
+def build_codec(codec_config):
+    """
+    Build a payload codec, JSON by default.
+    :param codec_config: Codec type and parameters.
+    :type codec_config: dict.
+    :rtype: JsonCodec or BinaryCodec.
+    :raises: ConfigurationError, if the codec type is unknown.
+    """
+    if not codec_config:
+        return JsonCodec()
+    try:
+        codec_class = available_codecs[codec_config['type']]
+    except KeyError:
+        raise ConfigurationError('Unknown payload codec {}'.format(codec_config.get('type')))
+    return codec_class(**codec_config.get('parameters', {}))
@@ -0,0 +1,165 @@
+"""
+Routing of the readings of each device to the clouds and measures it subscribes to. The routes are compiled once in a
+table by device name, so a reading only evaluates the strategies and calls the connectors of its clouds.
+"""
+from collections import OrderedDict
+from fnmatch import translate
+import re
+from threading import Lock
+
+from cloud_connector.cc_exceptions import ConfigurationError
+from cloud_connector.data.model import DEFAULT_MAX_DEVICES, Reading
+
+
+
+class Route(object):
+    """
+    Route of a device to a cloud.
+    :param cloud: Cloud service.
+    :type cloud: CloudServiceBase.
+    :param measures: Measures sent, all by default.
+    :type measures: tuple.
+    :param strategy: Strategy used instead of the strategy of the cloud.
+    :type strategy: StrategyBase.
+    """
+    __slots__ = ('cloud', 'measures', 'strategy')
+
+    def __init__(self, cloud, measures=None, strategy=None):
+        self.cloud = cloud
+        self.measures = measures
+        self.strategy = strategy
+
+    def select(self, reading):
+        """
+        Measures of a reading sent by the route.
+        :param reading: Reading received.
+        :type reading: Reading.
+        :return: The reading, a reading with the measures of the route, or None if it has none of them.
+        :rtype: Reading.
+        """
+        if self.measures is None:
+            return reading
+        fields = {measure: reading[measure] for measure in self.measures if measure in reading}
+        if not fields:
+            return None
+        return Reading(reading.device_name, fields, reading.timestamp)
+
+
+class _RouteRule(object):
+    """
+    Route of the configuration, matching device names.
+    """
+    __slots__ = ('names', 'match', 'clouds', 'measures', 'strategies')
+
+    def __init__(self, names, patterns, clouds, measures, strategies):
+        self.names = names
+        self.match = re.compile('|'.join(translate(pattern) for pattern in patterns)).match if patterns else None
+        self.clouds = clouds
+        self.measures = measures
+        self.strategies = strategies
+
+    def matches(self, device_name):
+        return device_name in self.names or bool(self.match and self.match(device_name))
+
+
+def _is_pattern(name):
+    return any(character in name for character in '*?[')
+
+
+class RoutingTable(object):
+    """
+    Clouds and measures of each device. Each route gives clouds for devices by name, shell pattern (mote*) or group,
+    the first route of a device for each cloud is used. Devices without routes are sent to the default clouds. The
+    routes of each device are computed the first time it sends data, and kept for up to max_devices devices.
+    :param routes: Routes in order, each with devices or groups, clouds and optionally measures and strategy.
+    :type routes: list.
+    :param groups: Device names or patterns by group name.
+    :type groups: dict.
+    :param default: Clouds of the devices without routes, none by default.
+    :type default: list.
+    :param strategy_factory: Function to build a strategy from its configuration.
+    :type strategy_factory: function.
+    :param max_devices: Maximum number of devices whose routes are kept.
+    :type max_devices: int.
+    """
+
+    def __init__(self, routes, groups=None, default=None, strategy_factory=None, max_devices=DEFAULT_MAX_DEVICES):
+        groups = groups or {}
+        self.default = tuple(default or ())
+        self.max_devices = max_devices
+        self._rules = []
+        for index, route in enumerate(routes):
+            members = list(route.get('devices', []))
+            for group in route.get('groups', []):
+                if group not in groups:
+                    raise ConfigurationError('Route {} uses unknown group {}'.format(index, group))
+                members.extend(groups[group])
+            if not members or not route.get('clouds'):
+                raise ConfigurationError('Route {} needs devices or groups, and clouds'.format(index))
+            # A strategy for each cloud, they keep the data sent to the cloud
+            strategies = {cloud: strategy_factory(route['strategy']) for cloud in route['clouds']} \
+                if route.get('strategy') else {}
+            self._rules.append(_RouteRule(frozenset(name for name in members if not _is_pattern(name)),
+                                          [name for name in members if _is_pattern(name)],
+                                          tuple(route['clouds']),
+                                          tuple(route['measures']) if route.get('measures') else None,
+                                          strategies))
+        self._clouds = {}
+        # Routes by device name, the least recently used first
+        self._table = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def strategies(self):
+        """
+        Strategies of the routes.
+        :rtype: list.
+        """
+        return [strategy for rule in self._rules for strategy in rule.strategies.values()]
+
+    @property
+    def clouds(self):
+        """
+        Cloud services by the name of the cloud section.
+        :rtype: dict.
+        """
+        return self._clouds
+
+    @clouds.setter
+    def clouds(self, clouds):
+        names = set(self.default).union(*(rule.clouds for rule in self._rules))
+        unknown = names.difference(clouds)
+        if unknown:
+            raise ConfigurationError('Routes use unknown clouds: {}'.format(', '.join(sorted(unknown))))
+        with self._lock:
+            self._clouds = clouds
+            self._table.clear()
+
+    def lookup(self, device_name):
+        """
+        Routes of a device.
+        :param device_name: Device name.
+        :type device_name: str.
+        :rtype: tuple.
+        """
+        with self._lock:
+            routes = self._table.get(device_name)
+            if routes is not None:
+                self._table.move_to_end(device_name)
+                return routes
+            routes = self._table[device_name] = self._compile(device_name)
+            if len(self._table) > self.max_devices:
+                self._table.popitem(last=False)
+            return routes
+
+    def _compile(self, device_name):
+        routes = OrderedDict()
+        for rule in self._rules:
+            if rule.matches(device_name):
+                for cloud in rule.clouds:
+                    if cloud not in routes:
+                        routes[cloud] = Route(self._clouds[cloud], rule.measures, rule.strategies.get(cloud))
+        if not routes:
+            for cloud in self.default:
+                routes[cloud] = Route(self._clouds[cloud])
+        return tuple(routes.values())
@@ -3,6 +3,13 @@ Class to handle the send data to TSDB and clouds.
 """
 
 import logging
+import time
+from itertools import count
+from threading import Condition, Thread
+
+from cloud_connector.data.model import Reading, RecordBatch, to_reading
+from cloud_connector.data.tsdb import ShardedInfluxDB
+from cloud_connector.metrics import READINGS_RECEIVED, READINGS_DROPPED, TSDB_WRITE_SECONDS
 
 
 class DataSender(object):
@@ -18,20 +25,352 @@ class DataSender(object):
         """
         self._tsdb = configurator.db
         self._clouds = configurator.clouds
+        self._spool = configurator.spool
+        self._tracer = configurator.tracer
+        self._latest = configurator.latest
+        self._stats = configurator.stats
+        self._history = configurator.history
+        self._alerts = configurator.alerts
+        self._dedup = configurator.dedup
+        self._routing = configurator.routing
+        self._watch_writes(self._tsdb)
+        self.accepting = True
+        # Readings being sent, by an increasing id
+        self._pending = {}
+        self._ids = count()
+        self._idle = Condition()
 
-    def send_data(self, data, device_name):
+    def send_data(self, data, device_name, source='rest', trace_id=None, sequence=None, timestamp=None):
         """
-        Save data in TSDB and cloud services
-        :param data:
+        Save data in TSDB and cloud services. When the sender is closed, data is written to the spool. When
+        deduplication is configured, data received before is not sent again.
+        :param data: Reading or data dictionary, which is not modified.
+        :type data: Reading or dict.
         :param device_name:
-        :return:
+        :param source: Where data comes from, for tracing.
+        :type source: str.
+        :param trace_id: Trace id given by the client, the reading is always traced.
+        :type trace_id: str.
+        :param sequence: Sequence number of the reading given by the device, to detect duplicates.
+        :type sequence: int.
+        :param timestamp: Time of the reading given by the client, current time by default.
+        :type timestamp: float.
+        :return: False if data is a duplicate.
+        :rtype: bool.
         """
-        for key, value in data.items():
-            if isinstance(value, int):
-                data[key] = float(value)
-        cloud_names = []
-        if self._clouds:
-            cloud_names = [cloud.insert_data(data, device_name) for cloud in self._clouds]
-            cloud_names = [cloud for cloud in cloud_names if cloud]  # Filter all clouds that have not send data
+        dedup = self._dedup if source != 'spool' else None
+        if dedup and dedup.seen(data, device_name, sequence, timestamp):
+            logging.debug('Duplicate data from %s ignored', device_name)
+            return False
+        trace = self._tracer.start(device_name, source, trace_id)
+        try:
+            self._send([to_reading(data, device_name, timestamp)], batch=False, traces={0: trace} if trace else None,
+                       alerts=source != 'spool')
+        except Exception:
+            if dedup:
+                # Not sent, so the retry of the client is not a duplicate
+                dedup.forget(data, device_name, sequence, timestamp)
+            raise
+        return True
+
+    def send_batch(self, readings, source='fleet'):
+        """
+        Save data of many devices in TSDB with a single write and send it to cloud services.
+        :param readings: A record batch, or a list of readings or of data and device name.
+        :type readings: RecordBatch or list.
+        :param source: Where data comes from, for tracing.
+        :type source: str.
+        """
+        if not isinstance(readings, RecordBatch):
+            readings = [reading if isinstance(reading, Reading) else to_reading(*reading) for reading in readings]
+        self._send(readings, batch=True, traces=self._tracer.start_batch(readings, source))
+
+    @property
+    def latest(self):
+        """
+        Latest value of each device and measure.
+        :rtype: LatestCache.
+        """
+        return self._latest
+
+    @property
+    def stats(self):
+        """
+        Rolling window statistics of each device and measure, if they are configured.
+        :rtype: WindowStats.
+        """
+        return self._stats
+
+    def history(self, device_name, measures=None, start=None, end=None, limit=None):
+        """
+        Get the points of a device in a time range from the TSDB, or from the cache if they have been read recently.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param measures: Measures to get, all by default.
+        :type measures: list.
+        :param start: Start time in epoch seconds, no limit by default.
+        :type start: float.
+        :param end: End time in epoch seconds, no limit by default.
+        :type end: float.
+        :param limit: Maximum number of points.
+        :type limit: int.
+        :return: Iterator of lists of points, oldest first.
+        """
+        return self._history.query(self._tsdb, device_name, measures, start, end, limit)
+
+    @property
+    def tracer(self):
+        """
+        Tracer of the readings.
+        :rtype: Tracer.
+        """
+        return self._tracer
+
+    def _send(self, readings, batch, traces=None, alerts=True):
+        """
+        Send readings keeping them as pending until they are sent. When the sender is closed, they are spooled. The
+        alert rules are evaluated first, except for spooled readings whose alerts would be late. A reading sent as an
+        alert is not sent again to the same clouds, it is only recorded as sent to them once delivered.
+        """
+        READINGS_RECEIVED.inc(amount=len(readings))
+        alerted = self._alerts.check(readings) if alerts and self._alerts else None
+        self._latest.update(readings)
+        if self._stats:
+            self._stats.update(readings)
+        if not self.accepting:
+            self._spool_readings(readings)
+            return
+        reading_id = next(self._ids)
+        with self._idle:
+            self._pending[reading_id] = readings
+        try:
+            self._send_readings(readings, batch, traces, alerted)
+        finally:
+            with self._idle:
+                self._pending.pop(reading_id, None)
+                if not self._pending:
+                    self._idle.notify_all()
+            if traces:
+                for trace in traces.values():
+                    self._tracer.finish(trace)
+
+    def _send_readings(self, readings, batch, traces=None, alerted=None):
+        # Keep the same TSDB, clouds and routes for all the readings, even if they are updated by a reload
+        tsdb, clouds, routing = self._tsdb, self._clouds, self._routing
+        rows = []
+        for index, reading in enumerate(readings):
+            trace = traces.get(index) if traces else None
+            # Clouds where the reading is sent as an alert
+            alert_clouds = alerted[index].clouds if alerted and index in alerted else ()
+            if routing:
+                cloud_names = self._insert_in_routes(routing.lookup(reading.device_name), reading, trace,
+                                                     alert_clouds)
+            else:
+                cloud_names = self._insert_in_clouds(clouds, reading, reading.device_name, trace, alert_clouds)
+            rows.append((reading, reading.device_name, cloud_names))
+        if alerted:
+            for index, alert in alerted.items():
+                self._record_alert(alert, rows[index][2], traces.get(index) if traces else None)
         logging.debug('Inserting data into TSDB')
-        self._tsdb.insert_data(data, device_name, cloud_names)
+        start = time.perf_counter()
+        if batch:
+            tsdb.insert_batch(rows)
+            TSDB_WRITE_SECONDS.observe(time.perf_counter() - start, 'batch')
+        else:
+            tsdb.insert_data(*rows[0])
+            TSDB_WRITE_SECONDS.observe(time.perf_counter() - start, 'insert')
+        # Cached histories are removed once the readings can be read from the TSDB
+        self._history.invalidate(readings)
+        if traces:
+            for trace in traces.values():
+                trace.mark('tsdb')
+
+    @staticmethod
+    def _record_alert(alert, cloud_names, trace=None):
+        """
+        Wait for the delivery of an alert and add the clouds it has been delivered to to the names of the clouds where
+        its reading has been sent. The clouds it could not be delivered to are sent the routine way. The clouds of an
+        alert still being sent are not recorded, so a backfill can send the reading to them.
+        """
+        delivered = alert.wait()
+        if delivered is None:
+            logging.warning('Alert of %s not delivered in time, not recorded as sent', alert.reading.device_name)
+            return
+        for cloud, data, strategy in alert.sends:
+            cloud_name = cloud.__class__.__name__ if cloud in delivered else \
+                cloud.insert_data(data, alert.reading.device_name, trace, strategy)
+            if cloud_name and cloud_name not in cloud_names:
+                cloud_names.append(cloud_name)
+
+    @staticmethod
+    def _insert_in_clouds(clouds, data, device_name, trace=None, skip=()):
+        """
+        Insert data in cloud services, except the ones to skip.
+        :return: Names of the clouds where data has been sent.
+        :rtype: list.
+        """
+        if not clouds:
+            return []
+        cloud_names = [cloud.insert_data(data, device_name, trace) for cloud in clouds if cloud not in skip]
+        return [cloud for cloud in cloud_names if cloud]  # Filter all clouds that have not send data
+
+    @staticmethod
+    def _insert_in_routes(routes, reading, trace=None, skip=()):
+        """
+        Insert the measures of a reading in the cloud services of its routes, except the ones to skip.
+        :return: Names of the clouds where data has been sent.
+        :rtype: list.
+        """
+        cloud_names = []
+        for route in routes:
+            if route.cloud in skip:
+                continue
+            data = route.select(reading)
+            if data is not None:
+                cloud_name = route.cloud.insert_data(data, reading.device_name, trace, route.strategy)
+                if cloud_name:
+                    cloud_names.append(cloud_name)
+        return cloud_names
+
+    def update(self, configurator):
+        """
+        Use the TSDB and clouds of a reloaded configuration. The data being sent keeps using the previous ones.
+        :param configurator: Configurator class.
+        :type configurator: ConfiguratorYaml
+        """
+        self._tsdb, self._clouds, self._spool = configurator.db, configurator.clouds, configurator.spool
+        self._tracer = configurator.tracer
+        self._latest = configurator.latest
+        self._stats = configurator.stats
+        self._history = configurator.history
+        self._alerts = configurator.alerts
+        self._dedup = configurator.dedup
+        self._routing = configurator.routing
+        self._watch_writes(self._tsdb)
+
+    def _watch_writes(self, tsdb):
+        """
+        A sharded TSDB writes the rows in background, the cached histories are removed again when they are written,
+        and the rows that can not be written are spooled.
+        """
+        if isinstance(tsdb, ShardedInfluxDB):
+            tsdb.on_written = lambda rows: self._history.invalidate([row[0] for row in rows])
+            tsdb.on_failed = self._spool_rows
+
+    def retire(self, elements, timeout):
+        """
+        Close the elements no longer used after a reload, once the data being sent has been sent.
+        :param elements: Elements no longer used.
+        :type elements: list.
+        :param timeout: Seconds to wait for the data being sent.
+        :type timeout: float.
+        """
+        if not self.drain(timeout):
+            logging.warning('Closing retired connections with data being sent')
+        for element in elements:
+            if hasattr(element, 'close'):
+                self._close_sink(element)
+
+    def _spool_readings(self, readings):
+        if self._spool is not None:
+            self._spool.write(readings)
+        elif readings:
+            READINGS_DROPPED.inc('shutdown', amount=len(readings))
+            logging.error('No spool configured, %s readings dropped', len(readings))
+
+    def _spool_rows(self, rows):
+        """
+        Spool the rows of readings sent to the clouds but not written to the TSDB, they are only written to it again.
+        """
+        if self._spool is not None:
+            self._spool.write_rows([(reading, device_name, clouds or []) for reading, device_name, clouds in rows])
+        elif rows:
+            READINGS_DROPPED.inc('tsdb', amount=len(rows))
+            logging.error('No spool configured, %s rows not written to the TSDB dropped', len(rows))
+
+    # noinspection PyBroadException
+    def replay_spool(self):
+        """
+        Send the data left in the spool by a previous shutdown. The readings already sent to the clouds are only
+        written to the TSDB.
+        """
+        if self._spool is None:
+            return
+        rows = self._spool.pop_rows()
+        readings = [reading for reading, _, clouds in rows if clouds is None]
+        unwritten = [row for row in rows if row[2] is not None]
+        if readings:
+            logging.info('Sending %s readings from spool', len(readings))
+        if unwritten:
+            logging.info('Writing %s readings from spool to the TSDB', len(unwritten))
+            try:
+                self._tsdb.insert_batch(unwritten)
+                self._history.invalidate([row[0] for row in unwritten])
+            except Exception as e:
+                logging.error('Unable to write spooled data to the TSDB: %s', e)
+                self._spool_rows(unwritten)
+        for index, reading in enumerate(readings):
+            try:
+                self.send_data(reading, reading.device_name, source='spool')
+            except Exception as e:
+                logging.error('Unable to send spooled data: %s', e)
+                self._spool_readings(readings[index:])
+                break
+
+    def drain(self, timeout):
+        """
+        Wait until there is no data being sent.
+        :param timeout: Seconds to wait.
+        :type timeout: float.
+        :return: True if all data has been sent.
+        :rtype: bool.
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+    def close(self, timeout):
+        """
+        Stop accepting data, wait for the data being sent until timeout, spool data not sent, and close TSDB and cloud
+        connections in parallel.
+        :param timeout: Seconds to wait for data being sent and connections to close.
+        :type timeout: float.
+        """
+        deadline = time.time() + timeout
+        self.accepting = False
+        if not self.drain(timeout):
+            with self._idle:
+                pending = [reading for readings in self._pending.values() for reading in readings]
+            logging.warning('%s readings not sent before shutdown deadline', len(pending))
+            self._spool_readings(pending)
+        self._flush_tsdb(max(deadline - time.time(), 0))
+        if self._alerts:
+            self._alerts.close(max(deadline - time.time(), 0))
+
+        sinks = [self._tsdb] + list(self._clouds or [])
+        threads = [Thread(target=self._close_sink, args=(sink,), daemon=True) for sink in sinks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(max(deadline - time.time(), 0))
+        not_closed = [thread for thread in threads if thread.is_alive()]
+        if not_closed:
+            logging.warning('%s connections not closed before shutdown deadline', len(not_closed))
+
+    def _flush_tsdb(self, timeout):
+        """
+        Wait until timeout for the rows that a sharded TSDB writes in background, the ones not written are spooled.
+        """
+        tsdb = self._tsdb
+        if not isinstance(tsdb, ShardedInfluxDB) or tsdb.flush(timeout):
+            return
+        rows = tsdb.abort()
+        logging.warning('%s readings not written to the TSDB before shutdown deadline', len(rows))
+        self._spool_rows(rows)
+
+    # noinspection PyBroadException
+    @staticmethod
+    def _close_sink(sink):
+        try:
+            sink.close()
+        except Exception as e:
+            logging.error('Error closing connection: %s', e)
@@ -0,0 +1,81 @@
+"""
+Class to keep on disk the data that could not be sent, to send it later.
+"""
+import json
+import logging
+import os
+from threading import Lock
+
+from cloud_connector.data.model import Reading
+
+
+class Spool(object):
+    """
+    Append only file of readings (device name, data and timestamp) in JSON lines. A reading already sent to the clouds
+    but not written to the TSDB also has the clouds where it was sent.
+    :param path: Spool file path.
+    :type path: str.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+
+    def __len__(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'r') as spool_file:
+            return sum(1 for _ in spool_file)
+
+    def write(self, readings):
+        """
+        Add readings to the spool.
+        :param readings: Readings to keep.
+        :type readings: list.
+        """
+        self.write_rows([(reading, reading.device_name, None) for reading in readings])
+
+    def write_rows(self, rows):
+        """
+        Add to the spool readings that only have to be written to the TSDB.
+        :param rows: List of reading, device name and clouds where it was sent, None if it has not been sent.
+        :type rows: list.
+        """
+        if not rows:
+            return
+        with self._lock, open(self.path, 'a') as spool_file:
+            for reading, device_name, clouds in rows:
+                line = {'device_name': device_name, 'data': reading.to_dict(), 'timestamp': reading.timestamp}
+                if clouds is not None:
+                    line['clouds'] = list(clouds)
+                spool_file.write(json.dumps(line) + '\n')
+        logging.info('%s readings written to spool %s', len(rows), self.path)
+
+    def pop_all(self):
+        """
+        Get all the readings of the spool and empty it. They keep the time they were received.
+        :return: List of readings.
+        :rtype: list.
+        """
+        return [reading for reading, _, _ in self.pop_rows()]
+
+    def pop_rows(self):
+        """
+        Get all the readings of the spool with the clouds where they were sent, and empty it.
+        :return: List of reading, device name and clouds where it was sent, None if it has not been sent.
+        :rtype: list.
+        """
+        with self._lock:
+            if not os.path.exists(self.path):
+                return []
+            with open(self.path, 'r') as spool_file:
+                rows = []
+                for line in spool_file:
+                    try:
+                        row = json.loads(line)
+                        reading = Reading(row['device_name'], row['data'], row.get('timestamp'))
+                        rows.append((reading, reading.device_name, row.get('clouds')))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        logging.error('Discarding malformed spool line: %s', line.strip())
+            os.remove(self.path)
+        return rows
@@ -0,0 +1,193 @@
+"""
+Edge analytics: rolling window statistics (count, min, max, mean and standard deviation) of each device and measure,
+kept incrementally as readings arrive instead of querying the TSDB.
+
+Each window is split in buckets of the same length kept in a ring. A reading updates the Welford accumulator of the
+current bucket of each window, in constant time. A query merges the buckets of the window, so the window slides by
+bucket steps and covers between window - window / buckets and window seconds.
+"""
+from array import array
+from collections import OrderedDict
+from math import sqrt
+from threading import Lock
+import time
+
+from cloud_connector.data.model import DEFAULT_MAX_DEVICES, RecordBatch
+
+DEFAULT_WINDOWS = (300, 3600)
+DEFAULT_BUCKETS = 10
+DEFAULT_MAX_MEASURES = 16
+
+# Values kept for each bucket: bucket number, count, mean, sum of squared differences, min and max
+_BUCKET, _COUNT, _MEAN, _M2, _MIN, _MAX = range(6)
+_FIELDS = 6
+
+
+def _new_series(windows, buckets):
+    # Bucket number -1 marks an empty bucket
+    return [array('d', (-1.0, 0.0, 0.0, 0.0, 0.0, 0.0) * buckets) for _ in windows]
+
+
+def _add(accumulators, bucket_lengths, buckets, timestamp, value):
+    """
+    Add a value to the current bucket of each window.
+    """
+    for accumulator, bucket_length in zip(accumulators, bucket_lengths):
+        bucket = timestamp // bucket_length
+        base = int(bucket % buckets) * _FIELDS
+        if accumulator[base] != bucket:
+            if accumulator[base] > bucket:
+                # Older than the buckets kept
+                continue
+            accumulator[base:base + _FIELDS] = array('d', (bucket, 1.0, value, 0.0, value, value))
+            continue
+        count = accumulator[base + _COUNT] + 1
+        mean = accumulator[base + _MEAN]
+        delta = value - mean
+        mean += delta / count
+        accumulator[base + _COUNT] = count
+        accumulator[base + _MEAN] = mean
+        accumulator[base + _M2] += delta * (value - mean)
+        if value < accumulator[base + _MIN]:
+            accumulator[base + _MIN] = value
+        elif value > accumulator[base + _MAX]:
+            accumulator[base + _MAX] = value
+
+
+def _merge(accumulator, bucket_length, buckets, now):
+    """
+    Merge the buckets of a window that are not expired, with the parallel algorithm of Chan et al.
+    :return: Count, min, max, mean and sample standard deviation, or None if there are no values.
+    :rtype: dict.
+    """
+    oldest = now // bucket_length - buckets + 1
+    count = mean = m2 = 0.0
+    minimum = maximum = None
+    for base in range(0, buckets * _FIELDS, _FIELDS):
+        if accumulator[base] < oldest:
+            continue
+        bucket_count, bucket_mean = accumulator[base + _COUNT], accumulator[base + _MEAN]
+        total = count + bucket_count
+        delta = bucket_mean - mean
+        mean += delta * bucket_count / total
+        m2 += accumulator[base + _M2] + delta * delta * count * bucket_count / total
+        count = total
+        minimum = accumulator[base + _MIN] if minimum is None else min(minimum, accumulator[base + _MIN])
+        maximum = accumulator[base + _MAX] if maximum is None else max(maximum, accumulator[base + _MAX])
+    if not count:
+        return None
+    return {'count': int(count),
+            'min': minimum,
+            'max': maximum,
+            'mean': mean,
+            'std': sqrt(m2 / (count - 1)) if count > 1 else None,
+            }
+
+
+class WindowStats(object):
+    """
+    Rolling window statistics of each device and measure. Memory is bounded: each series keeps windows x buckets
+    accumulators, the devices not updated for the longest time are evicted, and new measures of a device are ignored
+    when it has too many. Values that are not numbers are ignored.
+    :param windows: Window lengths in seconds.
+    :type windows: list.
+    :param buckets: Buckets of each window.
+    :type buckets: int.
+    :param max_devices: Maximum number of devices kept.
+    :type max_devices: int.
+    :param max_measures: Maximum number of measures kept for each device.
+    :type max_measures: int.
+    """
+
+    def __init__(self, windows=DEFAULT_WINDOWS, buckets=DEFAULT_BUCKETS, max_devices=DEFAULT_MAX_DEVICES,
+                 max_measures=DEFAULT_MAX_MEASURES):
+        self.windows = tuple(sorted(windows))
+        self.buckets = buckets
+        self.max_devices = max_devices
+        self.max_measures = max_measures
+        self.evicted = 0
+        self._bucket_lengths = tuple(float(window) / buckets for window in self.windows)
+        # Accumulators of each window by measure, by device, the least recently updated device first
+        self._devices = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def update(self, readings):
+        """
+        Add the values of the readings.
+        :param readings: Readings received.
+        :type readings: RecordBatch or list.
+        """
+        with self._lock:
+            if isinstance(readings, RecordBatch):
+                # Go through the columns, without creating the readings
+                for measure, column in readings.columns.items():
+                    for device_name, timestamp, value in zip(readings.device_names, readings.timestamps, column):
+                        self._add(device_name, measure, timestamp, value)
+            else:
+                for reading in readings:
+                    for measure, value in reading.items():
+                        self._add(reading.device_name, measure, reading.timestamp, value)
+
+    def _add(self, device_name, measure, timestamp, value):
+        if type(value) is not float:
+            return
+        devices = self._devices
+        series = devices.get(device_name)
+        if series is None:
+            series = devices[device_name] = {}
+            if len(devices) > self.max_devices:
+                devices.popitem(last=False)
+                self.evicted += 1
+        else:
+            devices.move_to_end(device_name)
+        accumulators = series.get(measure)
+        if accumulators is None:
+            if len(series) >= self.max_measures:
+                return
+            accumulators = series[measure] = _new_series(self.windows, self.buckets)
+        _add(accumulators, self._bucket_lengths, self.buckets, timestamp, value)
+
+    def window(self, device_name, measure, window):
+        """
+        Statistics of a measure of a device in a window, for instance to be used by a strategy.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param measure: Measure name.
+        :type measure: str.
+        :param window: Window length in seconds, one of the windows configured.
+        :type window: int.
+        :return: Count, min, max, mean and std, or None if there are no values.
+        :rtype: dict.
+        """
+        index = self.windows.index(window)
+        with self._lock:
+            accumulators = self._devices.get(device_name, {}).get(measure)
+            if accumulators is None:
+                return None
+            accumulator = array('d', accumulators[index])
+        return _merge(accumulator, self._bucket_lengths[index], self.buckets, time.time())
+
+    def get(self, device_name, window=None):
+        """
+        Statistics of all the measures of a device.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param window: Window length in seconds, all the windows by default.
+        :type window: int.
+        :return: Statistics by window (in seconds) by measure, or None if the device is not kept.
+        :rtype: dict.
+        """
+        indexes = [self.windows.index(window)] if window is not None else range(len(self.windows))
+        with self._lock:
+            series = self._devices.get(device_name)
+            if series is None:
+                return None
+            series = [(measure, [array('d', accumulators[index]) for index in indexes])
+                      for measure, accumulators in series.items()]
+        now = time.time()
+        return {measure: {self.windows[index]: _merge(accumulator, self._bucket_lengths[index], self.buckets, now)
+                          for index, accumulator in zip(indexes, accumulators)}
+                for measure, accumulators in series}
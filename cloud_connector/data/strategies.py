@@ -10,17 +10,19 @@ from datetime import datetime, timedelta
 
 class StrategyBase(object):
     """
-    Base class to define strategies.
+    Base class to define strategies. When window statistics are configured they are set in stats, to be used by
+    strategies as stats.window(device_name, measure, window).
     """
     __metaclass__ = ABCMeta
 
     def __init__(self):
         self._last_data_sent = None
+        self.stats = None
 
     def has_to_send_data(self, data):
         """
         According to the strategy, does the data has to be sent to cloud system?
-        :param data: New data.
+        :param data: New data, a reading or a dictionary of measure and value.
         :return: If the strategy has t be sent or not.
         :rtype: bool.
         """
@@ -104,7 +106,7 @@ class Variation(StrategyBase):
                 if abs(last_data_measures[measure] - value) > self.variability[measure]:
                     return self.ok_to_insert_data(data)
             except KeyError:
-                logging.error('Measure {} not defined in strategy'.format(measure))
+                logging.error('Measure %s not defined in strategy', measure)
 
         return False
 
@@ -133,3 +135,34 @@ class MessageLimit(TimeLimit):
     def __init__(self, messages_per_day):
         seconds = 86400 / messages_per_day
         super(MessageLimit, self).__init__(seconds)
+
+
+class Deviation(StrategyBase):
+    """
+    Send data when a measure deviates from the mean of its window statistics, and at least every time_high seconds.
+    Data is sent while there are not enough statistics, or when window statistics are not configured.
+    """
+    def __init__(self, window, sigmas, time_high):
+        """
+        :param window: Window of the statistics in seconds, one of the windows configured.
+        :param sigmas: Standard deviations from the mean to send data.
+        :param time_high: Higher time to update in seconds.
+        """
+        super(Deviation, self).__init__()
+        self.window = window
+        self.sigmas = sigmas
+        self.time_high = timedelta(seconds=time_high)
+
+    def has_to_send_data(self, data):
+        if not self.last_data_sent or self.get_time_since_last_send() > self.time_high:
+            return self.ok_to_insert_data(data)
+        device_name = getattr(data, 'device_name', None)
+        if not self.stats or device_name is None:
+            return self.ok_to_insert_data(data)
+
+        for measure, value in data.items():
+            stats = self.stats.window(device_name, measure, self.window)
+            if not stats or stats['std'] is None or abs(value - stats['mean']) > self.sigmas * stats['std']:
+                return self.ok_to_insert_data(data)
+
+        return False
@@ -2,15 +2,58 @@
 Define classes to connect to TSDB.
 """
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
 import logging
+import re
+from threading import Condition, Lock, Thread
+import time
 
-from influxdb import InfluxDBClient
-import dateutil
-import requests
 from cloud_connector.cc_exceptions import ConnectionTimeout
+from cloud_connector.data.model import DEFAULT_MAX_DEVICES, Reading
+from cloud_connector.lazy import LazyImport
+from cloud_connector.metrics import READINGS_DROPPED, TSDB_WRITE_SECONDS
+from cloud_connector.sharding import HashRing, DEFAULT_VIRTUAL_NODES
+
+# Client libraries are imported when a client of the TSDB is created
+InfluxDBClient = LazyImport('influxdb:InfluxDBClient')
+date_parser = LazyImport('dateutil.parser')
+requests = LazyImport('requests')
 
 
 INFLUXDB_TIMEOUT = 5
+INFLUXDB_BATCH_SIZE = 5000
+# Tags of each device and clouds, shared by all its points
+TAGS_CACHE_SIZE = 4096
+# Points read by each query of a history
+HISTORY_CHUNK_SIZE = 1000
+# Tags of the points, not returned as measures in a history
+HISTORY_TAGS = ('device', 'cloud')
+# Seconds to wait for a batch of a shard to be full before writing it
+SHARD_FLUSH_INTERVAL = 1
+# Rows waiting to be written to a shard, writes wait when there are more
+SHARD_MAX_PENDING = 100000
+# Retries of a batch that can not be written to a shard, waiting twice as long each time
+SHARD_RETRIES = 3
+SHARD_RETRY_WAIT = 1
+
+
+def quote_identifier(name):
+    """
+    Quote a name (measure, tag) to be used in an InfluxQL query.
+    :type name: str.
+    :rtype: str.
+    """
+    return '"{}"'.format(str(name).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def quote_literal(value):
+    """
+    Quote a string value to be used in an InfluxQL query.
+    :type value: str.
+    :rtype: str.
+    """
+    return "'{}'".format(str(value).replace('\\', '\\\\').replace("'", "\\'"))
 
 
 # noinspection PyShadowingNames
@@ -33,7 +76,7 @@ class TSDatabase(object):
         self.db = self.connect(self.parameters)
         if not self.db_exists:
             self.create_database()
-            logging.info('Database {} created in {}:{}'.format(database, host, port))
+            logging.info('Database %s created in %s:%s', database, host, port)
 
     @abstractmethod
     def connect(self, parameters):
@@ -85,6 +128,59 @@ class TSDatabase(object):
         """
         raise NotImplementedError
 
+    def history(self, device_name, measures=None, start=None, end=None, limit=None, chunk_size=HISTORY_CHUNK_SIZE):
+        """
+        Get the points of a device in a time range, oldest first, read in chunks so a large range is not loaded in
+        memory at once.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param measures: Measures to get, all by default.
+        :type measures: list.
+        :param start: Start time in epoch seconds (included), no limit by default.
+        :type start: float.
+        :param end: End time in epoch seconds (included), no limit by default.
+        :type end: float.
+        :param limit: Maximum number of points.
+        :type limit: int.
+        :param chunk_size: Points read at once.
+        :type chunk_size: int.
+        :return: Iterator of lists of points, each one a dictionary with time (epoch seconds) and measure values.
+        """
+        raise NotImplementedError
+
+    def unsent(self, cloud, start=None, end=None, chunk_size=HISTORY_CHUNK_SIZE, position=None):
+        """
+        Get the readings of all the devices not sent to a cloud, by the clouds they were inserted in, oldest first and
+        read in chunks. Each reading comes with its position, to resume reading after it.
+        :param cloud: Cloud class name, as recorded with the readings.
+        :type cloud: str.
+        :param start: Start time in epoch seconds (included), no limit by default.
+        :type start: float.
+        :param end: End time in epoch seconds (included), no limit by default.
+        :type end: float.
+        :param chunk_size: Readings read at once.
+        :type chunk_size: int.
+        :param position: Position of the last reading used, to resume after it.
+        :type position: tuple.
+        :return: Iterator of lists of positions and readings.
+        """
+        raise NotImplementedError
+
+    def insert_batch(self, rows):
+        """
+        Insert data of many devices in TSDB
+        :param rows: List of data, device name and clouds where data was inserted.
+        :type rows: list.
+        """
+        for data, device_name, clouds in rows:
+            self.insert_data(data, device_name, clouds)
+
+    def close(self):
+        """
+        Close TSDB connection.
+        """
+        pass
+
 
 # noinspection PyShadowingNames
 class InfluxDB(TSDatabase):
@@ -125,14 +221,12 @@ class InfluxDB(TSDatabase):
             logging.error(err_msg)
             raise ConnectionTimeout(err_msg)
         dbs_list = [value for dbs_dict in dbs_dicts for key, value in dbs_dict.items()]
-        logging.debug('Existing databases are: {}'.format(dbs_list))
+        logging.debug('Existing databases are: %s', dbs_list)
         if self.parameters['database'] in dbs_list:
-            logging.debug('Database {} already exists in server'.
-                          format(self.parameters['database']))
+            logging.debug('Database %s already exists in server', self.parameters['database'])
             return True
         else:
-            logging.debug('Database {} does not exists in server'.
-                          format(self.parameters['database']))
+            logging.debug('Database %s does not exists in server', self.parameters['database'])
             return False
 
     def get_current_time(self):
@@ -143,9 +237,8 @@ class InfluxDB(TSDatabase):
         """
         rs = self.query('show diagnostics')
         current_time = rs.raw['series'][3]['values'][0][1]
-        logging.debug('Current time: {}'.format(current_time))
-        # noinspection PyUnresolvedReferences
-        return dateutil.parser.parse(current_time)
+        logging.debug('Current time: %s', current_time)
+        return date_parser.parse(current_time)
 
     def query(self, query):
         """
@@ -157,17 +250,152 @@ class InfluxDB(TSDatabase):
         """
         return self.db.query(query)
 
+    def history(self, device_name, measures=None, start=None, end=None, limit=None, chunk_size=HISTORY_CHUNK_SIZE):
+        """
+        Get the points of a device in a time range, oldest first. Each chunk is a query starting after the last point
+        of the previous one. Names and values are quoted and times are integers, so the query cannot be altered.
+        """
+        fields = ', '.join(quote_identifier(measure) for measure in measures) if measures else '*'
+        conditions = ['"device" = {}'.format(quote_literal(device_name))]
+        if end is not None:
+            conditions.append('time <= {:d}'.format(int(end * 1e9)))
+        after = 'time >= {:d}'.format(int(start * 1e9)) if start is not None else None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            query = 'SELECT {} FROM "environment" WHERE {} ORDER BY time ASC LIMIT {:d}'.format(
+                fields, ' AND '.join(conditions + [after] if after else conditions), size)
+            logging.debug('History query: %s', query)
+            points = list(self.db.query(query, epoch='ns').get_points())
+            if points:
+                yield [self._history_point(point) for point in points]
+            if len(points) < size:
+                return
+            if remaining is not None:
+                remaining -= len(points)
+            after = 'time > {:d}'.format(int(points[-1]['time']))
+
+    def unsent(self, cloud, start=None, end=None, chunk_size=HISTORY_CHUNK_SIZE, position=None):
+        """
+        Get the readings not sent to a cloud, whose cloud tag does not include it. A position is the time of a reading
+        in nanoseconds and the number of readings of that time up to it, so readings of many devices with the same
+        time are not skipped or repeated between chunks.
+        """
+        if not re.match(r'^\w+$', cloud):
+            raise ValueError('Wrong cloud name: {}'.format(cloud))
+        conditions = ['"cloud" !~ /(^|;){}(;|$)/'.format(cloud)]
+        if end is not None:
+            conditions.append('time <= {:d}'.format(int(end * 1e9)))
+        position = position or (int(start * 1e9) if start is not None else 0, 0)
+        for chunk in self._scan(conditions, chunk_size, position):
+            yield [(point_position, self._unsent_reading(point)) for point_position, point in chunk]
+
+    def _scan(self, conditions, chunk_size, position):
+        """
+        Get the points matching some conditions oldest first, in chunks of LIMIT and OFFSET from the time of the last
+        point read, each one with its position.
+        :param conditions: InfluxQL conditions.
+        :type conditions: list.
+        :param position: Time in nanoseconds and points of that time already read.
+        :type position: tuple.
+        :return: Iterator of lists of positions and points.
+        """
+        time_ns, skip = position
+        while True:
+            query = 'SELECT * FROM "environment" WHERE {} ORDER BY time ASC LIMIT {:d} OFFSET {:d}'.format(
+                ' AND '.join(conditions + ['time >= {:d}'.format(time_ns)]), chunk_size, skip)
+            logging.debug('Scan query: %s', query)
+            points = list(self.db.query(query, epoch='ns').get_points())
+            chunk = []
+            for point in points:
+                point_time = int(point['time'])
+                if point_time == time_ns:
+                    skip += 1
+                else:
+                    time_ns, skip = point_time, 1
+                chunk.append(((time_ns, skip), point))
+            if chunk:
+                yield chunk
+            if len(points) < chunk_size:
+                return
+
+    def device_names(self):
+        """
+        Names of the devices with points in the database.
+        :rtype: list.
+        """
+        result = self.db.query('SHOW TAG VALUES FROM "environment" WITH KEY = "device"')
+        return [point['value'] for point in result.get_points()]
+
+    def export(self, device_name, chunk_size=HISTORY_CHUNK_SIZE):
+        """
+        Get the points of a device with their tags, to write them in another database.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param chunk_size: Points read at once.
+        :type chunk_size: int.
+        :return: Iterator of lists of points, as written by write_points.
+        """
+        conditions = ['"device" = {}'.format(quote_literal(device_name))]
+        for chunk in self._scan(conditions, chunk_size, (0, 0)):
+            points = []
+            for _, point in chunk:
+                tags = {tag: point[tag] for tag in HISTORY_TAGS if point.get(tag)}
+                fields = {name: value for name, value in point.items()
+                          if value is not None and name != 'time' and name not in HISTORY_TAGS}
+                points.append({'measurement': 'environment', 'tags': tags, 'fields': fields, 'time': point['time']})
+            yield points
+
+    def write_points(self, points):
+        """
+        Write points, split in batches of INFLUXDB_BATCH_SIZE points.
+        :param points: Points with their tags and time in nanoseconds.
+        :type points: list.
+        :return: True if they have been written.
+        :rtype: bool.
+        """
+        return self.db.write_points(points, batch_size=INFLUXDB_BATCH_SIZE)
+
+    @staticmethod
+    def _unsent_reading(point):
+        """
+        Reading of a point, with its device and time.
+        :rtype: Reading.
+        """
+        fields = {name: value for name, value in point.items()
+                  if value is not None and name != 'time' and name not in HISTORY_TAGS}
+        return Reading(point.get('device'), fields, point['time'] / 1e9)
+
+    @staticmethod
+    def _history_point(point):
+        """
+        Point of a history: time in epoch seconds and the measures with value.
+        :rtype: dict.
+        """
+        history_point = {'time': point['time'] / 1e9}
+        for name, value in point.items():
+            if value is not None and name != 'time' and name not in HISTORY_TAGS:
+                history_point[name] = value
+        return history_point
+
     def create_database(self):
         """
         Create a database with the current object database name
         """
         self.db.create_database(self.parameters['database'])
 
+    def close(self):
+        """
+        Close the HTTP session with InfluxDB.
+        """
+        self.db.close()
+        logging.info('InfluxDB connection closed')
+
     def insert_data(self, data, device_name, clouds=None):
         """
         Insert data into database
-        :param data: Dictionary of name:values to inserted
-        :type data: dict
+        :param data: Reading or dictionary of name:values to inserted
+        :type data: Reading or dict
         :param device_name: Device name
         :type device_name: str
         :param clouds: List of cloud where this data has been inserted
@@ -176,16 +404,465 @@ class InfluxDB(TSDatabase):
         To read this tags, query with regex should be used:
              SELECT * FROM <measurement_name> WHERE cloud =~ /.*CloudAmazonMQTT.*/
         """
+        tags = self._tags(device_name, tuple(clouds) if clouds else ())
+        point = self._point(data)
+        logging.debug('Data to be inserted in %s: %s, tags: %s', self.parameters['database'], point, tags)
+        if self.db.write_points([point], tags=tags):
+            logging.debug('Data inserted.')
+        else:
+            READINGS_DROPPED.inc('tsdb')
+            logging.info('Data not inserted.')
+
+    def insert_batch(self, rows):
+        """
+        Insert data of many devices with a single write, split in batches of INFLUXDB_BATCH_SIZE points.
+        :param rows: List of data, device name and clouds where data was inserted.
+        :type rows: list.
+        """
+        points = [self._point(data, self._tags(device_name, tuple(clouds) if clouds else ()))
+                  for data, device_name, clouds in rows]
+        logging.debug('%s points to be inserted in %s', len(points), self.parameters['database'])
+        if self.db.write_points(points, batch_size=INFLUXDB_BATCH_SIZE):
+            logging.debug('Data inserted.')
+        else:
+            READINGS_DROPPED.inc('tsdb', amount=len(points))
+            logging.info('Data not inserted.')
+
+    @staticmethod
+    def _point(data, tags=None):
+        """
+        Point of a reading, with its fields and the time it was received in nanoseconds. The reading is used as fields
+        without copying it.
+        :rtype: dict.
+        """
+        point = {'measurement': 'environment'}
+        if tags is not None:
+            point['tags'] = tags
+        point['fields'] = data
+        if isinstance(data, Reading):
+            point['time'] = int(data.timestamp * 1e9)
+        return point
+
+    @staticmethod
+    @lru_cache(maxsize=TAGS_CACHE_SIZE)
+    def _tags(device_name, clouds):
+        """
+        Tags of a point: device and clouds where it was inserted (if any). The same dictionary is returned for the
+        same device and clouds, so it must not be modified.
+        :param clouds: Clouds where it was inserted.
+        :type clouds: tuple.
+        :rtype: dict.
+        """
         if not clouds:
             tags = {}
         else:
             tags = {'cloud': ';'.join(clouds)}
         tags.update({'device': device_name})
-        point = {'measurement': 'environment',
-                 'fields': data}
-        logging.debug('Data to be inserted in {}: {}, tags: {}'.format(self.parameters['database'], point, tags))
-        if self.db.write_points([point], tags=tags):
-            logging.debug('Data inserted.')
+        return tags
+
+
+class ShardWriter(object):
+    """
+    Write the rows of a shard in batches from a background thread. A batch is written when it has batch_size rows or
+    flush_interval seconds after its first row. A batch that can not be written is retried, and given to on_failed
+    when the retries fail.
+    :param shard: TSDB of the shard.
+    :type shard: InfluxDB.
+    :param name: Shard name.
+    :type name: str.
+    :param batch_size: Rows of a batch.
+    :type batch_size: int.
+    :param flush_interval: Seconds to wait for a batch to be full.
+    :type flush_interval: float.
+    :param max_pending: Rows waiting to be written, writes wait when there are more.
+    :type max_pending: int.
+    :param on_written: Function called with the rows once they have been written.
+    :type on_written: callable.
+    :param on_failed: Function called with the rows that could not be written, they are dropped without one.
+    :type on_failed: callable.
+    :param retries: Retries of a batch that can not be written.
+    :type retries: int.
+    """
+
+    def __init__(self, shard, name, batch_size=INFLUXDB_BATCH_SIZE, flush_interval=SHARD_FLUSH_INTERVAL,
+                 max_pending=SHARD_MAX_PENDING, on_written=None, on_failed=None, retries=SHARD_RETRIES):
+        self.shard = shard
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self.retries = retries
+        self.written = 0
+        self._pending = []
+        self._flush_at = None
+        self._writing = False
+        self._closing = False
+        self._aborted = False
+        self._condition = Condition()
+        self._thread = Thread(target=self._run, name='ShardWriter-{}'.format(name), daemon=True)
+        self._thread.start()
+
+    def write(self, rows):
+        """
+        Add rows to be written. When the writer is closed they are written right away.
+        :param rows: List of data, device name and clouds where data was inserted.
+        :type rows: list.
+        """
+        with self._condition:
+            while not self._closing and len(self._pending) >= self.max_pending:
+                self._condition.wait()
+            if not self._closing:
+                if not self._pending:
+                    self._flush_at = time.monotonic() + self.flush_interval
+                self._pending.extend(rows)
+                self._condition.notify_all()
+                return
+        self.shard.insert_batch(rows)
+        if self.on_written:
+            self.on_written(rows)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closing and not self._ready():
+                    self._condition.wait(self._flush_at - time.monotonic() if self._pending else None)
+                rows, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                if self._pending:
+                    self._flush_at = time.monotonic()
+                if not rows:
+                    return
+                self._writing = True
+                self._condition.notify_all()
+            self._write(rows)
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def _ready(self):
+        return len(self._pending) >= self.batch_size or bool(self._pending and time.monotonic() >= self._flush_at)
+
+    # noinspection PyBroadException
+    def _write(self, rows):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                self.shard.insert_batch(rows)
+                break
+            except Exception as e:
+                logging.warning('Unable to write %s rows in shard %s (attempt %s): %s', len(rows), self.name,
+                                attempt + 1, e)
+            # Retried after a wait, unless the writer has been aborted
+            with self._condition:
+                given_up = attempt >= self.retries or \
+                    self._condition.wait_for(lambda: self._aborted, SHARD_RETRY_WAIT * 2 ** attempt)
+            if given_up:
+                self._failed(rows)
+                return
+            attempt += 1
+        TSDB_WRITE_SECONDS.observe(time.perf_counter() - start, 'shard')
+        self.written += len(rows)
+        if self.on_written:
+            self.on_written(rows)
+
+    def _failed(self, rows):
+        if self.on_failed:
+            self.on_failed(rows)
         else:
-            logging.info('Data not inserted.')
+            READINGS_DROPPED.inc('tsdb', amount=len(rows))
+            logging.error('Unable to write %s rows in shard %s, dropped', len(rows), self.name)
+
+    def flush(self, timeout=None):
+        """
+        Wait until the rows added have been written.
+        :param timeout: Seconds to wait, no limit by default.
+        :type timeout: float.
+        :return: False if there are rows not written after the timeout.
+        :rtype: bool.
+        """
+        with self._condition:
+            self._flush_at = time.monotonic()
+            self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+    def close(self, timeout=None):
+        """
+        Write the rows waiting and stop the writer.
+        :param timeout: Seconds to wait, no limit by default.
+        :type timeout: float.
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+
+    def abort(self):
+        """
+        Stop writing: the rows waiting are not written, and the batch being written is not retried, it is given to
+        on_failed if it fails.
+        :return: Rows waiting, not written.
+        :rtype: list.
+        """
+        with self._condition:
+            self._closing = self._aborted = True
+            rows, self._pending = self._pending, []
+            self._condition.notify_all()
+        return rows
 
+
+# noinspection PyShadowingNames
+class ShardedInfluxDB(TSDatabase):
+    """
+    Devices spread between several InfluxDB instances by consistent hashing, each reading is written in the shards of
+    its device by the batched writer of each shard, so rows are written after insert_batch returns: on_written is
+    called with them once written, and on_failed with the rows that could not be written after the retries. When
+    shards are added, the points of the devices that move to them can be copied with rebalance.
+    :param shards: Connection parameters of each InfluxDB (host, port, user, password and database), and optionally its
+        name in the hash ring, host:port/database by default.
+    :type shards: list.
+    :param replicas: Shards where each reading is written.
+    :type replicas: int.
+    :param virtual_nodes: Virtual nodes of each shard in the hash ring.
+    :type virtual_nodes: int.
+    :param batch_size: Rows of a batch written to a shard.
+    :type batch_size: int.
+    :param flush_interval: Seconds to wait for a batch to be full.
+    :type flush_interval: float.
+    :param max_pending: Rows waiting to be written to a shard, writes wait when there are more.
+    :type max_pending: int.
+    :param max_devices: Devices whose shards are cached in the hash ring.
+    :type max_devices: int.
+    :param previous: Sharded TSDB replaced by this one, its connections to the shards whose parameters have not changed
+        are reused. A connection is closed when the last sharded TSDB using it is closed.
+    :type previous: ShardedInfluxDB.
+    """
+
+    # Sharded TSDBs using each shard connection, by connection id
+    _users = {}
+    _users_lock = Lock()
+
+    def __init__(self, shards, replicas=1, virtual_nodes=DEFAULT_VIRTUAL_NODES, batch_size=INFLUXDB_BATCH_SIZE,
+                 flush_interval=SHARD_FLUSH_INTERVAL, max_pending=SHARD_MAX_PENDING, max_devices=DEFAULT_MAX_DEVICES,
+                 previous=None):
+        # Each shard connects to its instance, there is no connection of its own
+        self.shards = OrderedDict()
+        # Connection parameters of each shard
+        self.shard_parameters = {}
+        try:
+            for parameters in shards:
+                parameters = dict(parameters)
+                name = parameters.pop('name', None) or '{}:{}/{}'.format(parameters['host'], parameters['port'],
+                                                                         parameters['database'])
+                if name in self.shards:
+                    raise ValueError('Repeated shard {}'.format(name))
+                if previous is not None and previous.shard_parameters.get(name) == parameters:
+                    self.shards[name] = previous.shards[name]
+                else:
+                    self.shards[name] = InfluxDB(**parameters)
+                self.shard_parameters[name] = parameters
+                self._use(self.shards[name])
+            self.ring = HashRing(list(self.shards), replicas, virtual_nodes, max_devices)
+        except Exception:
+            for shard in self.shards.values():
+                self._release(shard)
+            raise
+        self.parameters = {'database': ', '.join(self.shards)}
+        # Functions called with the rows written to a shard and with the ones that could not be written, set by the
+        # user of the TSDB
+        self.on_written = None
+        self.on_failed = None
+        self.writers = OrderedDict((name, ShardWriter(shard, name, batch_size, flush_interval, max_pending,
+                                                      self._written, self._failed))
+                                   for name, shard in self.shards.items())
+        self.rebalanced = 0
+        self._closing = False
+
+    def connect(self, parameters):
+        raise NotImplementedError('Each shard connects to its InfluxDB')
+
+    @classmethod
+    def _use(cls, shard):
+        with cls._users_lock:
+            cls._users[id(shard)] = cls._users.get(id(shard), 0) + 1
+
+    @classmethod
+    def _release(cls, shard):
+        """
+        Close a shard connection when no other sharded TSDB uses it.
+        """
+        with cls._users_lock:
+            users = cls._users.pop(id(shard), 1) - 1
+            if users:
+                cls._users[id(shard)] = users
+        if not users:
+            shard.close()
+
+    def _written(self, rows):
+        if self.on_written:
+            self.on_written(rows)
+
+    def _failed(self, rows):
+        if self.on_failed:
+            self.on_failed(rows)
+        else:
+            READINGS_DROPPED.inc('tsdb', amount=len(rows))
+            logging.error('Unable to write %s rows in the TSDB, dropped', len(rows))
+
+    @property
+    def db_exists(self):
+        return all(shard.db_exists for shard in self.shards.values())
+
+    def create_database(self):
+        for shard in self.shards.values():
+            shard.create_database()
+
+    def get_current_time(self):
+        return next(iter(self.shards.values())).get_current_time()
+
+    def query(self, query):
+        """
+        Send a query to all the shards.
+        :return: Result of each shard.
+        :rtype: list.
+        """
+        return [shard.query(query) for shard in self.shards.values()]
+
+    def insert_data(self, data, device_name, clouds=None):
+        self.insert_batch([(data, device_name, clouds)])
+
+    def insert_batch(self, rows):
+        """
+        Add the rows to the writers of the shards of their devices.
+        :param rows: List of data, device name and clouds where data was inserted.
+        :type rows: list.
+        """
+        shard_rows = {}
+        for row in rows:
+            for name in self.ring.nodes_of(row[1]):
+                shard_rows.setdefault(name, []).append(row)
+        for name, rows_of_shard in shard_rows.items():
+            self.writers[name].write(rows_of_shard)
+
+    def history(self, device_name, measures=None, start=None, end=None, limit=None, chunk_size=HISTORY_CHUNK_SIZE):
+        """
+        Get the points of a device from its first shard, or from the next one if it can not be reached.
+        """
+        error = None
+        for name in self.ring.nodes_of(device_name):
+            chunks = self.shards[name].history(device_name, measures, start, end, limit, chunk_size)
+            try:
+                first = next(chunks, None)
+            except IOError as e:
+                logging.warning('Unable to read the history of %s from shard %s: %s', device_name, name, e)
+                error = e
+                continue
+            if first is not None:
+                yield first
+                yield from chunks
+            return
+        raise error
+
+    def unsent(self, cloud, start=None, end=None, chunk_size=HISTORY_CHUNK_SIZE, position=None):
+        """
+        Get the readings not sent to a cloud from each shard in turn, only the ones of the devices whose first shard it
+        is, so replicas and points left by a rebalance are not repeated. A position is the index of the shard and the
+        position of the reading in it.
+        """
+        first = position[0] if position else 0
+        for index, (name, shard) in enumerate(self.shards.items()):
+            if index < first:
+                continue
+            shard_position = tuple(position[1:]) if position and index == first else None
+            for chunk in shard.unsent(cloud, start, end, chunk_size, shard_position):
+                chunk = [((index,) + reading_position, reading) for reading_position, reading in chunk
+                         if self.ring.nodes_of(reading.device_name)[0] == name]
+                if chunk:
+                    yield chunk
+
+    def rebalance(self, previous):
+        """
+        Copy in a background thread the points of the devices to the shards they have moved to, from the first of
+        their previous shards that is still configured. Points are not deleted from the previous shards.
+        :param previous: Hash ring of the previous shards.
+        :type previous: HashRing.
+        :return: Rebalance thread.
+        :rtype: Thread.
+        """
+        thread = Thread(target=self._rebalance, args=(previous,), name='Rebalance', daemon=True)
+        thread.start()
+        return thread
+
+    # noinspection PyBroadException
+    def _rebalance(self, previous):
+        for name, shard in self.shards.items():
+            if name not in previous.nodes:
+                continue
+            try:
+                device_names = shard.device_names()
+            except Exception as e:
+                logging.error('Unable to read the devices of shard %s to rebalance: %s', name, e)
+                continue
+            for device_name in device_names:
+                if self._closing:
+                    return
+                previous_shards = previous.nodes_of(device_name)
+                sources = [source for source in previous_shards if source in self.shards]
+                if not sources or sources[0] != name:
+                    continue
+                for target in self.ring.nodes_of(device_name):
+                    if target not in previous_shards:
+                        self._copy(device_name, name, target)
+        logging.info('Rebalance finished, %s devices copied', self.rebalanced)
+
+    # noinspection PyBroadException
+    def _copy(self, device_name, source, target):
+        points = 0
+        try:
+            for chunk in self.shards[source].export(device_name):
+                self.shards[target].write_points(chunk)
+                points += len(chunk)
+        except Exception as e:
+            logging.error('Unable to copy %s from shard %s to %s: %s', device_name, source, target, e)
+            return
+        self.rebalanced += 1
+        logging.info('%s points of %s copied from shard %s to %s', points, device_name, source, target)
+
+    def flush(self, timeout=None):
+        """
+        Wait until the rows added have been written in all the shards.
+        :param timeout: Seconds to wait for all the shards, no limit by default.
+        :type timeout: float.
+        :rtype: bool.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        return all([writer.flush(None if deadline is None else max(deadline - time.monotonic(), 0))
+                    for writer in self.writers.values()])
+
+    def abort(self):
+        """
+        Stop writing in the shards, the batches being written are given to on_failed if they fail.
+        :return: Rows waiting to be written, once each even if they are waiting for several shards.
+        :rtype: list.
+        """
+        rows = OrderedDict()
+        for writer in self.writers.values():
+            for row in writer.abort():
+                rows[id(row)] = row
+        return list(rows.values())
+
+    def close(self):
+        """
+        Write the rows waiting and close the connections with the shards, except the ones used by another sharded TSDB.
+        """
+        if self._closing:
+            return
+        self._closing = True
+        threads = [Thread(target=writer.close, daemon=True) for writer in self.writers.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for shard in self.shards.values():
+            self._release(shard)
@@ -44,10 +44,40 @@ class DeviceBase(object):
         with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
             s.bind(('', 0))
             available_port = s.getsockname()[1]
-            logging.debug('Available port: {}'.format(available_port))
+            logging.debug('Available port: %s', available_port)
             return available_port
 
 
+class FleetBase(DeviceBase):
+    """
+    Factory pattern class to define a source of data of many devices, read all at once.
+    :param name: Fleet name.
+    :type name: str.
+    :param measurements: Type of measures.
+    :type measurements str.
+    """
+
+    def get_data(self):
+        raise NotImplementedError('A fleet returns data of many devices, use get_batch')
+
+    @property
+    def ready(self):
+        """
+        More data can be read right away, the fleet is read again without waiting for its read interval.
+        :rtype: bool.
+        """
+        return False
+
+    @abstractmethod
+    def get_batch(self):
+        """
+        Get data from all the devices of the fleet.
+        :return: The readings of the devices.
+        :rtype: RecordBatch or list.
+        """
+        raise NotImplementedError
+
+
 class SimDevice(DeviceBase):
     """
     Define a simulation device that returns random temperatures from 20 to 25 and humidity for 0.4 to 0.6
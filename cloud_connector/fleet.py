@@ -0,0 +1,161 @@
+"""
+Defines fleets of simulated devices that generate the data of all their devices at once with NumPy arrays.
+"""
+import time
+
+import numpy as np
+
+from cloud_connector.data.model import RecordBatch
+from cloud_connector.devices import FleetBase
+
+
+class ProfileBase(object):
+    """
+    Base class for the profile of a measure in a fleet.
+    :param count: Number of devices.
+    :type count: int.
+    :param rng: Random generator of the fleet.
+    :type rng: numpy.random.Generator.
+    """
+
+    def __init__(self, count, rng):
+        self.count = count
+        self.rng = rng
+
+    def values(self, timestamp):
+        """
+        Get the values of the measure for all devices.
+        :param timestamp: Time of the reading.
+        :type timestamp: float.
+        :rtype: numpy.ndarray.
+        """
+        raise NotImplementedError
+
+
+class RandomWalk(ProfileBase):
+    """
+    Each reading adds a normal step to the previous value, bounded between low and high.
+    :param start: Initial value.
+    :param step: Standard deviation of the steps.
+    :param low: Lower bound (optional).
+    :param high: Higher bound (optional).
+    """
+
+    def __init__(self, count, rng, start=0, step=1, low=None, high=None):
+        super(RandomWalk, self).__init__(count, rng)
+        self.step = step
+        self.low = low
+        self.high = high
+        self._values = np.full(count, float(start))
+
+    def values(self, timestamp):
+        self._values += self.rng.normal(0, self.step, self.count)
+        if self.low is not None or self.high is not None:
+            np.clip(self._values, self.low, self.high, out=self._values)
+        return self._values
+
+
+class Diurnal(ProfileBase):
+    """
+    Sine wave around a mean with a random phase for each device, plus normal noise.
+    :param mean: Mean value.
+    :param amplitude: Amplitude of the wave.
+    :param period: Period of the wave in seconds, one day by default.
+    :param noise: Standard deviation of the noise.
+    :param phase_spread: Maximum phase difference between devices in seconds.
+    """
+
+    def __init__(self, count, rng, mean=0, amplitude=1, period=86400, noise=0, phase_spread=3600):
+        super(Diurnal, self).__init__(count, rng)
+        self.mean = mean
+        self.amplitude = amplitude
+        self.period = period
+        self.noise = noise
+        self._phases = rng.uniform(0, phase_spread, count)
+
+    def values(self, timestamp):
+        values = self.mean + self.amplitude * np.sin(2 * np.pi * (timestamp + self._phases) / self.period)
+        if self.noise:
+            values += self.rng.normal(0, self.noise, self.count)
+        return values
+
+
+class StepEvents(ProfileBase):
+    """
+    Value is low or high, on each reading every device switches with a probability.
+    :param low: Low value.
+    :param high: High value.
+    :param probability: Probability to switch on each reading.
+    """
+
+    def __init__(self, count, rng, low=0, high=1, probability=0.01):
+        super(StepEvents, self).__init__(count, rng)
+        self.low = low
+        self.high = high
+        self.probability = probability
+        self._high = np.zeros(count, dtype=bool)
+
+    def values(self, timestamp):
+        self._high ^= self.rng.random(self.count) < self.probability
+        return np.where(self._high, float(self.high), float(self.low))
+
+
+available_profiles = {'random_walk': RandomWalk,
+                      'diurnal': Diurnal,
+                      'step': StepEvents,
+                      }
+
+
+class SimFleet(FleetBase):
+    """
+    Fleet of simulated devices configured by count and measure profiles. The names of the devices are the fleet name
+    followed by its number.
+    :param name: Fleet name, prefix of the devices names.
+    :type name: str.
+    :param count: Number of devices.
+    :type count: int.
+    :param measures: Profile type and its parameters for each measure.
+    :type measures: dict.
+    :param seed: Seed of the random generator, to reproduce the same data.
+    :type seed: int.
+    :param decimals: Number of decimals of the values.
+    :type decimals: int.
+    """
+
+    def __init__(self, name, count, measures, seed=None, decimals=2):
+        super(SimFleet, self).__init__(name, measurements='sims')
+        self.count = count
+        self.decimals = decimals
+        self.device_names = ['{}{:0{}d}'.format(name, index, len(str(count - 1))) for index in range(count)]
+        rng = np.random.default_rng(seed)
+        self._profiles = {}
+        for measure, profile_config in measures.items():
+            profile_config = dict(profile_config)
+            profile_class = available_profiles[profile_config.pop('profile')]
+            self._profiles[measure] = profile_class(count, rng, **profile_config)
+
+    def get_columns(self, timestamp=None):
+        """
+        Get the values of each measure for all the devices.
+        :param timestamp: Time of the reading, current time by default.
+        :type timestamp: float.
+        :return: An array of values for each measure, in the order of device_names.
+        :rtype: dict.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        return {measure: np.round(profile.values(timestamp), self.decimals)
+                for measure, profile in self._profiles.items()}
+
+    def get_batch(self, timestamp=None):
+        """
+        Get simulated data from all the devices, without creating a dictionary for each device.
+        :param timestamp: Time of the reading, current time by default.
+        :type timestamp: float.
+        :return: The readings of all the devices.
+        :rtype: RecordBatch.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        columns = {measure: values.tolist() for measure, values in self.get_columns(timestamp).items()}
+        return RecordBatch(self.device_names, columns, timestamp)
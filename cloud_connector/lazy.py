@@ -0,0 +1,86 @@
+"""
+Lazy loading of implementations and third party libraries, so only the backends used by the configuration are
+imported. It reduces the startup time and memory of small gateways.
+"""
+from collections.abc import Mapping
+from importlib import import_module
+from threading import Lock
+
+
+def load(path):
+    """
+    Import an object from its path.
+    :param path: module or module:attribute.
+    :type path: str.
+    :return: Module or attribute.
+    """
+    module_name, _, attribute = path.partition(':')
+    module = import_module(module_name)
+    return getattr(module, attribute) if attribute else module
+
+
+class LazyImport(object):
+    """
+    Module or attribute imported the first time it is used, by getting an attribute or calling it. As the proxy is a
+    module global it can still be patched in tests.
+    :param path: module or module:attribute.
+    :type path: str.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._target = None
+        self._lock = Lock()
+
+    def _load(self):
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = load(self._path)
+        return self._target
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return '<lazy {}>'.format(self._path)
+
+
+class LazyRegistry(Mapping):
+    """
+    Registry of implementations by name, each one imported the first time it is looked up.
+    :param implementations: Path (module:attribute) or object of each implementation by name.
+    :type implementations: dict.
+    """
+
+    def __init__(self, implementations):
+        self._implementations = dict(implementations)
+        self._lock = Lock()
+
+    def __getitem__(self, name):
+        implementation = self._implementations[name]
+        if isinstance(implementation, str):
+            with self._lock:
+                implementation = self._implementations[name]
+                if isinstance(implementation, str):
+                    implementation = self._implementations[name] = load(implementation)
+        return implementation
+
+    def __iter__(self):
+        return iter(self._implementations)
+
+    def __len__(self):
+        return len(self._implementations)
+
+    def loaded(self):
+        """
+        Names of the implementations already imported.
+        :rtype: list.
+        """
+        return [name for name, implementation in self._implementations.items() if not isinstance(implementation, str)]
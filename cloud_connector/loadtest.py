@@ -0,0 +1,255 @@
+"""
+Load test of a running cloud connector. Sends synthetic readings of many devices to an ingest endpoint at increasing
+rates, until the latency or error SLOs are broken, and reports the throughput and latency percentiles of each step.
+
+    python -m cloud_connector.loadtest --url http://localhost:8080/sensor/data --devices 1000 --rate 100 --step 100
+
+Readings are sent at a fixed rate whatever the response time, and latency is measured from the time each reading
+should have been sent, so a slow connector does not slow down the load and latency includes the time queued.
+"""
+import argparse
+import json
+import threading
+import time
+from queue import Queue
+from random import Random
+
+import requests
+
+DEFAULT_MEASURES = ('temperature:22:2', 'humidity:50:5', 'light:300:100')
+
+
+def percentile(values, percent):
+    """
+    Percentile of a list of values, the nearest rank.
+    :param values: Values.
+    :type values: list.
+    :param percent: Percent, from 0 to 100.
+    :type percent: float.
+    :rtype: float.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round(percent / 100.0 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+class HTTPTarget(object):
+    """
+    REST API ingest endpoint, PUT /sensor/data. Each thread keeps its own HTTP connection.
+    :param url: Endpoint URL.
+    :type url: str.
+    :param timeout: Seconds to wait for a response.
+    :type timeout: float.
+    """
+
+    def __init__(self, url, timeout=5):
+        self.url = url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def send(self, device_name, data):
+        """
+        Send a reading.
+        :return: True if the reading has been accepted.
+        :rtype: bool.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.put(self.url, json={'device_name': device_name, 'data': data}, timeout=self.timeout)
+        return response.status_code < 300
+
+
+available_targets = {'http': HTTPTarget}
+
+
+class Payloads(object):
+    """
+    Synthetic readings of many devices, each measure with a normal distribution.
+    :param devices: Number of devices.
+    :type devices: int.
+    :param measures: Measures as name:mean:standard deviation.
+    :type measures: list.
+    :param prefix: Prefix of the device names.
+    :type prefix: str.
+    :param seed: Seed of the random values.
+    :type seed: int.
+    """
+
+    def __init__(self, devices, measures=DEFAULT_MEASURES, prefix='load', seed=None):
+        self.device_names = ['{}{:0{}d}'.format(prefix, index, len(str(devices - 1))) for index in range(devices)]
+        self.measures = []
+        for measure in measures:
+            name, mean, deviation = (measure.split(':') + ['0', '1'])[:3]
+            self.measures.append((name, float(mean), float(deviation)))
+        self._random = Random(seed)
+        self._count = 0
+
+    def next(self):
+        """
+        Next reading, devices send in turn.
+        :return: Device name and data.
+        :rtype: tuple.
+        """
+        device_name = self.device_names[self._count % len(self.device_names)]
+        self._count += 1
+        return device_name, {name: round(self._random.gauss(mean, deviation), 2)
+                             for name, mean, deviation in self.measures}
+
+
+class LoadTest(object):
+    """
+    Sends readings to a target at increasing rates.
+    :param target: Ingest target.
+    :type target: HTTPTarget.
+    :param payloads: Readings generator.
+    :type payloads: Payloads.
+    :param concurrency: Number of concurrent senders.
+    :type concurrency: int.
+    """
+
+    def __init__(self, target, payloads, concurrency=32):
+        self.target = target
+        self.payloads = payloads
+        self.concurrency = concurrency
+
+    def run_step(self, rate, seconds):
+        """
+        Send readings at a fixed rate.
+        :param rate: Readings per second.
+        :type rate: float.
+        :param seconds: Duration of the step.
+        :type seconds: float.
+        :return: Readings sent, errors, throughput and latency percentiles in milliseconds.
+        :rtype: dict.
+        """
+        queue = Queue()
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+
+        # noinspection PyBroadException
+        def sender():
+            for scheduled, device_name, data in iter(queue.get, None):
+                try:
+                    accepted = self.target.send(device_name, data)
+                except Exception:
+                    accepted = False
+                latency = time.perf_counter() - scheduled
+                with lock:
+                    latencies.append(latency)
+                    if not accepted:
+                        errors[0] += 1
+
+        threads = [threading.Thread(target=sender, daemon=True) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        readings = int(rate * seconds)
+        start = time.perf_counter()
+        for number in range(readings):
+            scheduled = start + number / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            queue.put((scheduled,) + self.payloads.next())
+        for _ in threads:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        return {'rate': rate,
+                'sent': readings,
+                'errors': errors[0],
+                'error_rate': errors[0] / readings if readings else 0,
+                'throughput': round(readings / elapsed, 1),
+                'p50_ms': round(percentile(latencies, 50) * 1e3, 3) if latencies else None,
+                'p95_ms': round(percentile(latencies, 95) * 1e3, 3) if latencies else None,
+                'p99_ms': round(percentile(latencies, 99) * 1e3, 3) if latencies else None,
+                }
+
+    def ramp(self, start_rate, step, max_rate, seconds, max_p99_ms, max_error_rate, report=None):
+        """
+        Run steps increasing the rate until a SLO is broken or the maximum rate is reached.
+        :param start_rate: Rate of the first step, in readings per second.
+        :param step: Rate increase of each step.
+        :param max_rate: Maximum rate.
+        :param seconds: Duration of each step.
+        :param max_p99_ms: Latency SLO, maximum p99 in milliseconds.
+        :param max_error_rate: Error SLO, maximum fraction of readings not accepted.
+        :param report: Function called with the result of each step.
+        :return: Result of each step, the last one breaks the SLOs if they have been broken.
+        :rtype: list.
+        """
+        results = []
+        rate = start_rate
+        while rate <= max_rate:
+            result = self.run_step(rate, seconds)
+            result['broken'] = slo_broken(result, max_p99_ms, max_error_rate)
+            results.append(result)
+            if report:
+                report(result)
+            if result['broken']:
+                break
+            rate += step
+        return results
+
+
+def slo_broken(result, max_p99_ms, max_error_rate):
+    """
+    Check the SLOs of a step. The throughput must also keep up with the rate, otherwise readings are being queued.
+    :return: SLOs broken, empty if none.
+    :rtype: list.
+    """
+    broken = []
+    if result['p99_ms'] is not None and result['p99_ms'] > max_p99_ms:
+        broken.append('latency')
+    if result['error_rate'] > max_error_rate:
+        broken.append('errors')
+    if result['throughput'] < result['rate'] * 0.9:
+        broken.append('throughput')
+    return broken
+
+
+def print_step(result):
+    print('{rate:>8} readings/s offered  {throughput:>9} readings/s  p50 {p50_ms:>9} ms  p95 {p95_ms:>9} ms  '
+          'p99 {p99_ms:>9} ms  errors {errors:>6}  {slo}'.format(slo=', '.join(result['broken']) or 'ok', **result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test of a running cloud connector.')
+    parser.add_argument('--url', default='http://localhost:8080/sensor/data', help='Ingest endpoint.')
+    parser.add_argument('--target', default='http', choices=list(available_targets), help='Ingest protocol.')
+    parser.add_argument('--devices', type=int, default=100, help='Number of devices.')
+    parser.add_argument('--prefix', default='load', help='Prefix of the device names.')
+    parser.add_argument('--measures', nargs='+', default=list(DEFAULT_MEASURES),
+                        help='Measures of each reading as name:mean:standard_deviation.')
+    parser.add_argument('--rate', type=float, default=50, help='Readings per second of the first step.')
+    parser.add_argument('--step', type=float, default=50, help='Rate increase of each step.')
+    parser.add_argument('--max-rate', type=float, default=10000, help='Maximum readings per second.')
+    parser.add_argument('--step-seconds', type=float, default=10, help='Duration of each step.')
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent senders.')
+    parser.add_argument('--slo-p99', type=float, default=250, help='Maximum p99 latency in milliseconds.')
+    parser.add_argument('--slo-errors', type=float, default=0.01, help='Maximum fraction of errors.')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', help='JSON file to save the results.')
+    args = parser.parse_args()
+
+    load_test = LoadTest(available_targets[args.target](args.url),
+                         Payloads(args.devices, args.measures, args.prefix, args.seed),
+                         args.concurrency)
+    results = load_test.ramp(args.rate, args.step, args.max_rate, args.step_seconds, args.slo_p99, args.slo_errors,
+                             report=print_step)
+    within_slo = [result for result in results if not result['broken']]
+    if within_slo:
+        print('Saturation point: {throughput} readings/s, p99 {p99_ms} ms'.format(**within_slo[-1]))
+    else:
+        print('SLOs broken from the first step')
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'parameters': vars(args), 'steps': results}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Configures the application logging from the logging section of the configuration file.
+In async mode a record is only put in a queue in the thread that logs it, and it is formatted and written by a
+background thread. Repeated messages can be rate limited, so a warning logged for each reading is written once per
+interval with the number of messages suppressed.
+"""
+import atexit
+import logging
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import Queue
+from threading import Lock
+
+import yaml
+
+FORMAT = '%(asctime)s %(levelname)-8s %(threadName)-12s %(name)-12s: %(message)s'
+DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
+DEFAULT_LEVEL = 'DEBUG'
+# Maximum number of different messages tracked by the rate limit
+RATE_LIMIT_MESSAGES = 1000
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets a message through once per interval, the same message logged again within the interval is suppressed. Warnings
+    are the same if they have the same logger and format string, whatever their arguments, so a warning for each device
+    is rate limited as one message. Errors are only the same if their arguments are the same too, so errors of
+    different devices or clouds are not hidden. The next message let through tells how many were suppressed.
+    :param interval: Seconds between the same message.
+    :type interval: float.
+    :param level: Lower level rate limited.
+    :type level: int.
+    :param max_level: Higher level rate limited by format string, higher levels are rate limited by message.
+    :type max_level: int.
+    """
+
+    def __init__(self, interval, level=logging.WARNING, max_level=logging.WARNING):
+        super(RateLimitFilter, self).__init__()
+        self.interval = interval
+        self.level = level
+        self.max_level = max_level
+        # Time last let through and messages suppressed since, by message
+        self._messages = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, record.msg if record.levelno <= self.max_level else record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            last = self._messages.get(key)
+            if last is not None and now - last[0] < self.interval:
+                last[1] += 1
+                return False
+            if last is None and len(self._messages) >= RATE_LIMIT_MESSAGES:
+                self._messages.clear()
+            self._messages[key] = [now, 0]
+        if last is not None and last[1]:
+            record.msg = '{} ({} similar messages suppressed)'.format(record.msg, last[1])
+        return True
+
+
+class AsyncHandler(QueueHandler):
+    """
+    Puts the records in a queue without formatting them, the listener formats and writes them.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure(config=None):
+    """
+    Configure the root logger. Calling it again replaces the previous configuration.
+    :param config: Logging configuration: level, async, rate_limit (seconds, 0 to disable) and levels by logger name.
+    :type config: dict.
+    """
+    global _listener
+    config = config or {}
+    stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(FORMAT, DATE_FORMAT))
+    if config.get('async', False):
+        queue = Queue()
+        _listener = QueueListener(queue, handler)
+        _listener.start()
+        handler = AsyncHandler(queue)
+    if config.get('rate_limit'):
+        handler.addFilter(RateLimitFilter(config['rate_limit']))
+    root.addHandler(handler)
+
+    root.setLevel(str(config.get('level', DEFAULT_LEVEL)).upper())
+    for name, level in config.get('levels', {}).items():
+        logging.getLogger(name).setLevel(str(level).upper())
+
+
+def configure_file(file_name):
+    """
+    Configure the root logger from the logging section of a configuration file.
+    :param file_name: Configuration file name.
+    :type file_name: str.
+    """
+    with open(file_name, 'r') as config_file:
+        configure(yaml.safe_load(config_file).get('logging'))
+
+
+def stop():
+    """
+    Write the records left in the queue and stop the background thread of async mode.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop)
@@ -0,0 +1,259 @@
+"""
+Defines the application metrics and renders them in Prometheus text format.
+Recording a value is a dictionary update under a lock, cheap enough to be always enabled.
+"""
+import logging
+from bisect import bisect_left
+from threading import Lock
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class MetricBase(object):
+    """
+    Base class for metrics, with a value for each combination of label values.
+    :param name: Metric name.
+    :type name: str.
+    :param documentation: Metric description.
+    :type documentation: str.
+    :param labels: Label names.
+    :type labels: tuple.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def snapshot(self):
+        """
+        Copy of the metric, to aggregate metrics from several processes.
+        :rtype: dict.
+        """
+        with self._lock:
+            values = {key: self._copy(value) for key, value in self._values.items()}
+        return {'type': self.type, 'documentation': self.documentation, 'labels': self.labels, 'values': values}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+    def reset(self):
+        """
+        Remove all the values.
+        """
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(MetricBase):
+    """
+    Value that only increases.
+    """
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        """
+        Increase the counter.
+        :param label_values: Values of the labels.
+        :param amount: Amount to add.
+        """
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        """
+        Current value of the counter.
+        :param label_values: Values of the labels.
+        """
+        return self._values.get(label_values, 0)
+
+
+class Histogram(MetricBase):
+    """
+    Distribution of observed values in buckets, with their sum and count.
+    :param buckets: Upper bounds of the buckets.
+    :type buckets: tuple.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        """
+        Observe a value.
+        :param value: Observed value.
+        :type value: float.
+        :param label_values: Values of the labels.
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            try:
+                counts = self._values[label_values]
+            except KeyError:
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, *label_values):
+        """
+        Number of values observed.
+        :param label_values: Values of the labels.
+        """
+        return sum(self._values.get(label_values, [0.0])[:-1])
+
+    def snapshot(self):
+        snapshot = super(Histogram, self).snapshot()
+        snapshot['buckets'] = self.buckets
+        return snapshot
+
+    @staticmethod
+    def _copy(value):
+        return list(value)
+
+
+class Registry(object):
+    """
+    Collection of metrics.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labels=()):
+        """
+        Create and register a counter.
+        :rtype: Counter.
+        """
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Create and register a histogram.
+        :rtype: Histogram.
+        """
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """
+        Copy of all the metrics by name.
+        :rtype: dict.
+        """
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def reset(self):
+        """
+        Remove the values of all the metrics.
+        """
+        for metric in self._metrics:
+            metric.reset()
+
+    def render(self):
+        """
+        Render the metrics in Prometheus text format.
+        :rtype: str.
+        """
+        return render(self.snapshot())
+
+
+def merge(snapshots):
+    """
+    Add up the metrics of several snapshots, for instance from several worker processes.
+    :param snapshots: List of registry snapshots.
+    :type snapshots: list.
+    :return: Registry snapshot.
+    :rtype: dict.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            if name not in merged:
+                merged[name] = dict(metric, values={})
+            values = merged[name]['values']
+            for key, value in metric['values'].items():
+                if key not in values:
+                    values[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    values[key] = [total + partial for total, partial in zip(values[key], value)]
+                else:
+                    values[key] += value
+    return merged
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for name, value in pairs) + '}'
+
+
+def render(snapshot):
+    """
+    Render a registry snapshot in Prometheus text format.
+    :param snapshot: Registry snapshot.
+    :type snapshot: dict.
+    :rtype: str.
+    """
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append('# HELP {} {}'.format(name, metric['documentation']))
+        lines.append('# TYPE {} {}'.format(name, metric['type']))
+        for label_values, value in sorted(metric['values'].items()):
+            if metric['type'] != 'histogram':
+                lines.append('{}{} {}'.format(name, _format_labels(metric['labels'], label_values), value))
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric['buckets']) + ['+Inf'], value[:-1]):
+                cumulative += count
+                labels = _format_labels(metric['labels'], label_values, [('le', bound)])
+                lines.append('{}_bucket{} {}'.format(name, labels, cumulative))
+            labels = _format_labels(metric['labels'], label_values)
+            lines.append('{}_sum{} {}'.format(name, labels, value[-1]))
+            lines.append('{}_count{} {}'.format(name, labels, cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+class RetryCounter(object):
+    """
+    Logger for the retry decorator that counts the retries of a cloud service.
+    :param cloud: Cloud service name.
+    :type cloud: str.
+    """
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+
+    def warning(self, msg, *args):
+        CLOUD_RETRIES.inc(self.cloud)
+        logging.warning(msg, *args)
+
+
+REGISTRY = Registry()
+
+DEVICE_READ_SECONDS = REGISTRY.histogram('iot_device_read_seconds', 'Time to read a device.', ['type'])
+STRATEGY_SECONDS = REGISTRY.histogram('iot_strategy_seconds', 'Time to evaluate the strategy of a cloud.',
+                                      ['cloud'])
+CLOUD_SEND_SECONDS = REGISTRY.histogram('iot_cloud_send_seconds', 'Time to send data to a cloud.', ['cloud'])
+TSDB_WRITE_SECONDS = REGISTRY.histogram('iot_tsdb_write_seconds', 'Time to write data in the TSDB.', ['operation'])
+READINGS_RECEIVED = REGISTRY.counter('iot_readings_received_total', 'Readings received from devices or REST API.')
+READINGS_SENT = REGISTRY.counter('iot_readings_sent_total', 'Readings sent to a cloud.', ['cloud'])
+READINGS_SUPPRESSED = REGISTRY.counter('iot_readings_suppressed_total', 'Readings not sent to a cloud by strategy.',
+                                       ['cloud'])
+CLOUD_RETRIES = REGISTRY.counter('iot_cloud_retries_total', 'Retries to send data to a cloud.', ['cloud'])
+READINGS_DROPPED = REGISTRY.counter('iot_readings_dropped_total', 'Readings dropped.', ['reason'])
+MISSED_DEADLINES = REGISTRY.counter('iot_missed_deadlines_total', 'Device read deadlines missed.')
+ALERTS = REGISTRY.counter('iot_alerts_total', 'Readings matching an alert rule.', ['rule'])
+ALERT_SECONDS = REGISTRY.histogram('iot_alert_seconds', 'Time from the reception of a reading to its alert sent.',
+                                   ['cloud'])
+DEDUP_HITS = REGISTRY.counter('iot_dedup_hits_total', 'Duplicate readings acknowledged without being sent.', ['method'])
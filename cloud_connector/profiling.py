@@ -0,0 +1,161 @@
+"""
+Sampling profiler to find where the running application spends its time, across all its threads.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_INTERVAL = 0.005
+MAX_DURATION = 300
+# Names of the profile files: profile-date-time-pid.txt
+PROFILE_NAME = re.compile(r'^profile-\d{8}-\d{6}-\d+\.txt$')
+
+
+class Profile(object):
+    """
+    Stacks sampled from all the threads, with the number of times each one has been seen.
+    :param duration: Seconds sampled.
+    :type duration: float.
+    """
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.samples = 0
+        self.stacks = Counter()
+
+    def top(self, limit=20):
+        """
+        Functions where more samples have been seen.
+        :param limit: Number of functions.
+        :type limit: int.
+        :return: Function, samples where it was running (self) and samples where it was in the stack (total),
+                 sorted by self samples.
+        :rtype: list.
+        """
+        own, total = Counter(), Counter()
+        for (thread_name, stack), count in self.stacks.items():
+            own[stack[-1]] += count
+            for function in set(stack):
+                total[function] += count
+        return [{'function': function, 'self': count, 'total': total[function]}
+                for function, count in own.most_common(limit)]
+
+    def summary(self, limit=20):
+        """
+        Text table with the top functions.
+        :param limit: Number of functions.
+        :type limit: int.
+        :rtype: str.
+        """
+        stack_samples = sum(self.stacks.values()) or 1
+        lines = ['{} samples in {:.1f} seconds'.format(self.samples, self.duration),
+                 '{:>7} {:>7}  {}'.format('self%', 'total%', 'function')]
+        for row in self.top(limit):
+            lines.append('{:>6.1f}% {:>6.1f}%  {}'.format(100.0 * row['self'] / stack_samples,
+                                                          100.0 * row['total'] / stack_samples,
+                                                          row['function']))
+        return '\n'.join(lines)
+
+    def write(self, path):
+        """
+        Write the stacks in collapsed format (thread;function;...;function count), readable by flame graph tools.
+        :param path: File path.
+        :type path: str.
+        """
+        with open(path, 'w') as profile_file:
+            for (thread_name, stack), count in self.stacks.most_common():
+                profile_file.write('{};{} {}\n'.format(thread_name, ';'.join(stack), count))
+
+
+class SamplingProfiler(object):
+    """
+    Samples periodically the stacks of all the threads of the process. It runs in its own thread and the application
+    code is not instrumented, so the overhead is low and it can be used on the live process.
+    Only one profile can run at the same time.
+    :param directory: Directory to write the profiles.
+    :type directory: str.
+    :param interval: Seconds between samples.
+    :type interval: float.
+    """
+
+    def __init__(self, directory='.', interval=DEFAULT_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._names = {}
+
+    @property
+    def running(self):
+        """
+        A profile is running.
+        :rtype: bool.
+        """
+        return self._lock.locked()
+
+    def profile(self, duration):
+        """
+        Sample all the threads during some time.
+        :param duration: Seconds to sample, up to MAX_DURATION.
+        :type duration: float.
+        :return: Sampled profile or None if a profile is already running.
+        :rtype: Profile.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            return self._sample(min(duration, MAX_DURATION))
+        finally:
+            self._lock.release()
+
+    def _sample(self, duration):
+        profile = Profile(duration)
+        own_thread = threading.get_ident()
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            threads = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_thread:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._function_name(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                profile.stacks[(threads.get(ident, str(ident)), tuple(stack))] += 1
+            profile.samples += 1
+            time.sleep(self.interval)
+        return profile
+
+    def _function_name(self, code):
+        try:
+            return self._names[code]
+        except KeyError:
+            name = self._names[code] = '{}:{}:{}'.format(os.path.basename(code.co_filename), code.co_firstlineno,
+                                                         code.co_name)
+            return name
+
+    def profile_to_file(self, duration, limit=20):
+        """
+        Sample all the threads and write the profile to a file in the profiles directory, which is created if needed.
+        The file name has the process id, so the workers of a supervisor do not overwrite each other.
+        :param duration: Seconds to sample.
+        :type duration: float.
+        :param limit: Number of functions of the summary.
+        :type limit: int.
+        :return: Profile and file name, or None if a profile is already running.
+        :rtype: tuple.
+        """
+        logging.info('Profiling for %s seconds', duration)
+        profile = self.profile(duration)
+        if profile is None:
+            logging.warning('A profile is already running')
+            return None
+        file_name = 'profile-{}-{}.txt'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid())
+        os.makedirs(self.directory, exist_ok=True)
+        profile.write(os.path.join(self.directory, file_name))
+        logging.info('Profile written to %s\n%s', file_name, profile.summary(limit))
+        return profile, file_name
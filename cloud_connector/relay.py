@@ -0,0 +1,455 @@
+"""
+Relay of readings from one cloud connector to another, so site gateways report to a regional aggregator that owns the
+cloud connections and quotas.
+
+The gateway configures a relay cloud that groups the readings in batches, compressed with zlib, and sends them over a
+persistent TCP connection. The aggregator runs a relay listener that sends each batch as if it had read it and
+acknowledges it. Batches are kept until they are acknowledged and sent again after a reconnection, to the spool when
+too many are waiting or on close, so readings are stored and forwarded when the aggregator is not reachable.
+
+Each frame has a header with a batch id and the payload length. The first frame of a connection is a hello (batch id 0)
+with the id of the gateway, answered with the last batch id acknowledged to it, so a batch whose acknowledgment was
+lost is not sent twice. The id of a gateway with a spool is kept next to it, its batch ids continue after the last one
+acknowledged when it is restarted.
+"""
+from collections import deque, OrderedDict
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import time
+from threading import Condition, Lock, Thread
+from uuid import uuid4
+import zlib
+
+from cloud_connector.cc_exceptions import ConnectionException
+from cloud_connector.data.clouds import CloudServiceBase
+from cloud_connector.data.model import Reading
+from cloud_connector.data.spool import Spool
+from cloud_connector.metrics import READINGS_DROPPED
+
+DEFAULT_PORT = 9100
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1
+DEFAULT_MAX_PENDING = 100
+DEFAULT_TIMEOUT = 10
+RETRY_WAIT = 2
+# Maximum size of a decompressed batch
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+# Maximum size of a frame received, rejected before reading it
+DEFAULT_MAX_FRAME = 16 * 1024 * 1024
+MAX_SOURCES = 10000
+
+HEADER = struct.Struct('!QI')
+ACK = struct.Struct('!Q')
+HELLO = 0
+
+
+def encode_batch(readings, level=zlib.Z_DEFAULT_COMPRESSION):
+    """
+    Compress readings in a batch payload.
+    :param readings: Readings.
+    :type readings: list.
+    :param level: zlib compression level.
+    :type level: int.
+    :rtype: bytes.
+    """
+    rows = [[reading.device_name, reading.timestamp, reading.to_dict()] for reading in readings]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'), level)
+
+
+def decode_batch(payload):
+    """
+    Readings of a batch payload.
+    :param payload: Compressed batch.
+    :type payload: bytes.
+    :rtype: list.
+    :raises: ValueError, if the payload is not a batch.
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        content = decompressor.decompress(payload, MAX_BATCH_BYTES)
+    except zlib.error as e:
+        raise ValueError('Wrong batch compression: {}'.format(e))
+    if decompressor.unconsumed_tail:
+        raise ValueError('Batch bigger than {} bytes'.format(MAX_BATCH_BYTES))
+    rows = json.loads(content.decode('utf-8'))
+    return [Reading(device_name, data, timestamp) for device_name, timestamp, data in rows]
+
+
+def read_exactly(connection, size):
+    """
+    Read a number of bytes from a socket into a buffer of that size.
+    :rtype: bytearray.
+    :raises: ConnectionException, if the connection is closed before.
+    """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        read = connection.recv_into(view[received:])
+        if not read:
+            raise ConnectionException('Relay connection closed')
+        received += read
+    return data
+
+
+def load_source(spool):
+    """
+    Id of a relay, kept in a file next to its spool so it is the same after a restart. Without spool a new id is
+    used.
+    :param spool: Path of the spool file.
+    :type spool: str.
+    :rtype: str.
+    """
+    if not spool:
+        return uuid4().hex
+    path = spool + '.source'
+    try:
+        with open(path) as source_file:
+            source = source_file.read().strip()
+        if source:
+            return source
+    except FileNotFoundError:
+        pass
+    source = uuid4().hex
+    with open(path, 'w') as source_file:
+        source_file.write(source)
+    return source
+
+
+class _Batch(object):
+    """
+    Batch waiting for its acknowledgment.
+    """
+    __slots__ = ('id', 'readings', 'payload')
+
+    def __init__(self, batch_id, readings, payload):
+        self.id = batch_id
+        self.readings = readings
+        self.payload = payload
+
+
+class CloudRelay(CloudServiceBase):
+    """
+    Relay the readings to the relay listener of another cloud connector. Readings are grouped in batches sent by a
+    background thread, the cloud strategy applies before as in other clouds.
+    :param host: Host of the relay listener.
+    :type host: str.
+    :param port: Port of the relay listener.
+    :type port: int.
+    :param batch_size: Readings of a batch.
+    :type batch_size: int.
+    :param flush_interval: Seconds to wait for a batch to be full before sending it.
+    :type flush_interval: float.
+    :param max_pending: Batches kept in memory waiting for their acknowledgment, older ones are written to the spool.
+    :type max_pending: int.
+    :param spool: Path of the spool file for readings not acknowledged, they are dropped without one. The id of the
+        relay is kept next to it.
+    :type spool: str.
+    :param level: zlib compression level.
+    :type level: int.
+    :param timeout: Seconds to wait for connections and acknowledgments.
+    :type timeout: float.
+    :param strategy: Strategy object to send data to cloud.
+    :type strategy: StrategyBase.
+    """
+
+    def __init__(self, host, port=DEFAULT_PORT, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_pending=DEFAULT_MAX_PENDING, spool=None, level=zlib.Z_DEFAULT_COMPRESSION,
+                 timeout=DEFAULT_TIMEOUT, strategy=None):
+        super(CloudRelay, self).__init__(strategy)
+        self.name = 'Relay'
+        self.address = (host, port)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spool = Spool(spool) if spool else None
+        self.level = level
+        self.timeout = timeout
+        self.source = load_source(spool)
+        self.acknowledged = 0
+        self._buffer = []
+        self._flush_at = None
+        self._pending = deque()
+        self._ids = 0
+        # Batch ids restart with the process, they continue after the last one acknowledged on the first connection
+        self._renumber = True
+        self._connection = None
+        self._closing = False
+        self._aborted = False
+        self._condition = Condition()
+        # Readings stored by a previous run are sent when connected
+        self._load_spool()
+        self._thread = Thread(target=self._run, name='Relay', daemon=True)
+        self._thread.start()
+
+    def _send_data(self, data, device_name):
+        reading = data if isinstance(data, Reading) else Reading(device_name, data)
+        with self._condition:
+            if self._closing:
+                raise ConnectionException('Relay closed')
+            if not self._buffer:
+                # Wake up the relay thread to wait for the flush interval
+                self._flush_at = time.monotonic() + self.flush_interval
+                self._condition.notify()
+            self._buffer.append(reading)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+
+    def _next_batches(self):
+        """
+        Wait for a full batch, the flush interval or close, and move the buffer to the pending batches.
+        :return: False when closing and everything has been moved.
+        """
+        overflow = []
+        with self._condition:
+            while not self._closing and not self._pending and not self._buffer_ready():
+                self._condition.wait(self._flush_at - time.monotonic() if self._buffer else None)
+            if self._closing or self._buffer_ready():
+                for index in range(0, len(self._buffer), self.batch_size):
+                    overflow += self._add_batch(self._buffer[index:index + self.batch_size])
+                self._buffer = []
+            running = not self._closing
+        self._store(overflow)
+        return running
+
+    def _buffer_ready(self):
+        return len(self._buffer) >= self.batch_size or bool(self._buffer and time.monotonic() >= self._flush_at)
+
+    def _add_batch(self, readings):
+        """
+        Add a pending batch, called with the condition held.
+        :return: Readings of the oldest batches over max_pending, to store once the condition is released.
+        :rtype: list.
+        """
+        self._ids += 1
+        self._pending.append(_Batch(self._ids, readings, encode_batch(readings, self.level)))
+        overflow = []
+        while len(self._pending) > self.max_pending:
+            overflow += self._pending.popleft().readings
+        return overflow
+
+    def _store(self, readings):
+        if not readings:
+            return
+        if self.spool is not None:
+            self.spool.write(readings)
+        else:
+            READINGS_DROPPED.inc('relay', amount=len(readings))
+            logging.error('No relay spool configured, %s readings dropped', len(readings))
+
+    # noinspection PyBroadException
+    def _run(self):
+        """
+        Send the pending batches in order, reconnecting when the connection fails.
+        """
+        running = True
+        while running:
+            running = self._next_batches()
+            try:
+                self._send_pending()
+            except Exception as e:
+                logging.error('Unable to relay data to %s:%s: %s', self.address[0], self.address[1], e)
+                self._disconnect()
+                # Wait to retry, unless closing
+                retry_at = time.monotonic() + RETRY_WAIT
+                with self._condition:
+                    while not self._closing and time.monotonic() < retry_at:
+                        self._condition.wait(retry_at - time.monotonic())
+        self._disconnect()
+
+    def _send_pending(self):
+        if not self._pending or self._aborted:
+            return
+        if self._connection is None:
+            self._connect()
+        while True:
+            with self._condition:
+                if not self._pending or self._aborted:
+                    return
+                batch = self._pending[0]
+            self._connection.sendall(HEADER.pack(batch.id, len(batch.payload)) + batch.payload)
+            self._acknowledge(ACK.unpack(read_exactly(self._connection, ACK.size))[0])
+
+    def _connect(self):
+        self._connection = socket.create_connection(self.address, self.timeout)
+        source = self.source.encode('utf-8')
+        self._connection.sendall(HEADER.pack(HELLO, len(source)) + source)
+        last = ACK.unpack(read_exactly(self._connection, ACK.size))[0]
+        if self._renumber:
+            self._continue_ids(last)
+        self._acknowledge(last)
+        self._load_spool()
+
+    def _continue_ids(self, last):
+        """
+        Renumber the batches of this process after the last batch id acknowledged to a previous one with the same id,
+        so they are not taken as duplicates.
+        """
+        with self._condition:
+            for batch in self._pending:
+                batch.id += last
+            self._ids += last
+            self._renumber = False
+
+    def _load_spool(self):
+        """
+        Add the readings stored in the spool to the pending batches, to send them again.
+        """
+        if self.spool is not None:
+            readings = self.spool.pop_all()
+            if readings:
+                logging.info('Relaying %s readings from spool', len(readings))
+                overflow = []
+                with self._condition:
+                    for index in range(0, len(readings), self.batch_size):
+                        overflow += self._add_batch(readings[index:index + self.batch_size])
+                self._store(overflow)
+
+    def _acknowledge(self, batch_id):
+        with self._condition:
+            while self._pending and self._pending[0].id <= batch_id:
+                self.acknowledged += len(self._pending.popleft().readings)
+
+    # noinspection PyBroadException
+    def _disconnect(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def close(self, timeout=None):
+        """
+        Send the readings waiting until timeout, and write the ones not acknowledged to the spool. When the relay
+        thread is still sending at timeout, its connection is shut down and it is waited for up to the relay timeout,
+        so no batch is acknowledged after being written to the spool.
+        :param timeout: Seconds to wait, the relay timeout by default.
+        :type timeout: float.
+        """
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join(self.timeout if timeout is None else timeout)
+        if self._thread.is_alive():
+            with self._condition:
+                self._aborted = True
+            connection = self._connection
+            if connection is not None:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self._thread.join(self.timeout)
+        with self._condition:
+            readings = [reading for batch in self._pending for reading in batch.readings] + self._buffer
+            self._pending.clear()
+            self._buffer = []
+        if readings:
+            logging.warning('%s readings not relayed before close', len(readings))
+            self._store(readings)
+
+
+class _RelayServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class RelayListener(object):
+    """
+    Receive the batches of relay clouds of other cloud connectors and send them with the data sender. Only the first
+    worker listens when running with workers.
+    :param host: Address to listen.
+    :type host: str.
+    :param port: Port to listen, a free one if 0.
+    :type port: int.
+    :param max_frame: Maximum size in bytes of a frame, the connection is closed when a bigger one is received.
+    :type max_frame: int.
+    """
+
+    def __init__(self, host='0.0.0.0', port=DEFAULT_PORT, max_frame=DEFAULT_MAX_FRAME):
+        self.host = host
+        self.port = port
+        self.max_frame = max_frame
+        self.batches = 0
+        self.readings = 0
+        self.duplicates = 0
+        self._server = None
+        # Last batch id acknowledged by source, the least recently used first
+        self._sources = OrderedDict()
+        self._lock = Lock()
+
+    def start(self, sender):
+        """
+        Listen in a background thread, if it is not listening yet.
+        :param sender: Data sender.
+        :type sender: DataSender.
+        """
+        if self._server:
+            return
+        listener = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                listener._serve(self.request, sender)
+
+        self._server = _RelayServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        Thread(target=self._server.serve_forever, name='RelayListener', daemon=True).start()
+        logging.info('Relay listening on %s:%s', self.host, self.port)
+
+    # noinspection PyBroadException
+    def _serve(self, connection, sender):
+        source = None
+        try:
+            while True:
+                try:
+                    header = read_exactly(connection, HEADER.size)
+                except ConnectionException:
+                    return
+                batch_id, length = HEADER.unpack(header)
+                if length > self.max_frame:
+                    raise ValueError('Frame of {} bytes bigger than {}'.format(length, self.max_frame))
+                payload = read_exactly(connection, length)
+                if batch_id == HELLO:
+                    source = payload.decode('utf-8')
+                    connection.sendall(ACK.pack(self._last(source)))
+                    continue
+                if source is None:
+                    raise ValueError('Batch received before hello')
+                if batch_id <= self._last(source):
+                    self.duplicates += 1
+                else:
+                    readings = decode_batch(payload)
+                    sender.send_batch(readings, source='relay')
+                    self.batches += 1
+                    self.readings += len(readings)
+                    self._set_last(source, batch_id)
+                connection.sendall(ACK.pack(batch_id))
+        except Exception as e:
+            # The batch is not acknowledged, it will be sent again
+            logging.error('Error receiving relayed data: %s', e)
+
+    def _last(self, source):
+        with self._lock:
+            return self._sources.get(source, 0)
+
+    def _set_last(self, source, batch_id):
+        with self._lock:
+            self._sources[source] = batch_id
+            self._sources.move_to_end(source)
+            if len(self._sources) > MAX_SOURCES:
+                self._sources.popitem(last=False)
+
+    def close(self):
+        """
+        Stop listening.
+        """
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
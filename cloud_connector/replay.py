@@ -0,0 +1,187 @@
+"""
+Defines a device that replays recorded data from CSV or InfluxDB line protocol files.
+"""
+import csv
+import logging
+import mmap
+import re
+import time
+
+from dateutil import parser as date_parser
+
+from cloud_connector.data.model import Reading
+from cloud_connector.devices import FleetBase
+
+# Unescaped space or comma of a line protocol line
+LINE_SPACE = re.compile(r'(?<!\\) ')
+LINE_COMMA = re.compile(r'(?<!\\),')
+LINE_UNESCAPE = re.compile(r'\\(.)')
+
+
+def parse_timestamp(value):
+    """
+    Parse a timestamp in epoch (seconds, milliseconds, microseconds or nanoseconds) or ISO 8601.
+    :param value: Timestamp.
+    :type value: str.
+    :return: Epoch in seconds.
+    :rtype: float.
+    """
+    try:
+        epoch = float(value)
+    except ValueError:
+        return date_parser.parse(value).timestamp()
+    for scale in (1e9, 1e6, 1e3):
+        if epoch > scale * 1e8:
+            return epoch / scale
+    return epoch
+
+
+def parse_line_protocol(line):
+    """
+    Parse a line of InfluxDB line protocol: measurement,tag=value field=value timestamp
+    Only numeric and boolean fields are kept, the device name is read from device tag.
+    :param line: Line to parse.
+    :type line: str.
+    :return: Timestamp in seconds (None if the line has no timestamp), device name and data.
+    :rtype: tuple.
+    """
+    parts = LINE_SPACE.split(line.strip())
+    series, fields = parts[0], parts[1]
+    tags = dict(LINE_UNESCAPE.sub(r'\1', tag).split('=', 1) for tag in LINE_COMMA.split(series)[1:])
+    data = {}
+    for field in LINE_COMMA.split(fields):
+        key, value = field.split('=', 1)
+        key = LINE_UNESCAPE.sub(r'\1', key)
+        if value.startswith('"'):
+            continue
+        if value in ('t', 'T', 'true', 'True', 'TRUE', 'f', 'F', 'false', 'False', 'FALSE'):
+            data[key] = float(value[0] in 'tT')
+        else:
+            data[key] = float(value.rstrip('iu'))
+    timestamp = int(parts[2]) / 1e9 if len(parts) > 2 else None
+    return timestamp, tags.get('device'), data
+
+
+class ReplayDevice(FleetBase):
+    """
+    Replays recorded data of many devices from a CSV or InfluxDB line protocol file. The file is memory mapped and read
+    line by line, so it is not fully loaded in memory. Data must be ordered by timestamp.
+    CSV files need a header with timestamp (or time) and device (or device_name) columns, the other columns are
+    measures. Line protocol files take the device name from the device tag. Readings without device are replayed
+    with the name of the replay device, and keep the time they were recorded.
+    :param name: Device name.
+    :type name: str.
+    :param path: File to replay.
+    :type path: str.
+    :param speed: Replay speed: 1 is real time, N is N times faster, 0 is as fast as possible.
+    :type speed: float.
+    :param file_format: csv or line, by default it is guessed by the file extension.
+    :type file_format: str.
+    :param batch_size: Maximum number of readings returned each time.
+    :type batch_size: int.
+    :param loop: Start again when the end of the file is reached.
+    :type loop: bool.
+    """
+
+    def __init__(self, name, path, speed=1, file_format=None, batch_size=1000, loop=False):
+        super(ReplayDevice, self).__init__(name, measurements='replay')
+        self.path = path
+        self.speed = speed
+        self.file_format = file_format or ('csv' if path.endswith('.csv') else 'line')
+        self.batch_size = batch_size
+        self.loop = loop
+        self.replayed = 0
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._columns = None
+        self._next = None
+        self._origin = None
+        self._rewind()
+
+    def _rewind(self):
+        """
+        Go to the start of the file.
+        """
+        self._map.seek(0)
+        if self.file_format == 'csv':
+            header = next(csv.reader([self._map.readline().decode('utf-8')]))
+            self._columns = [column.strip() for column in header]
+        self._origin = None
+        self._next = self._read_reading()
+
+    def _read_reading(self):
+        """
+        Read the next reading of the file.
+        :return: Timestamp, device name and data or None at the end of the file.
+        :rtype: tuple.
+        """
+        while True:
+            line = self._map.readline()
+            if not line:
+                return None
+            line = line.decode('utf-8').strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                if self.file_format == 'csv':
+                    timestamp, device_name, data = self._parse_csv(line)
+                else:
+                    timestamp, device_name, data = parse_line_protocol(line)
+            except (ValueError, IndexError) as e:
+                logging.warning('Discarding line of %s: %s (%s)', self.path, line, e)
+                continue
+            return timestamp, device_name or self.name, data
+
+    def _parse_csv(self, line):
+        row = dict(zip(self._columns, next(csv.reader([line]))))
+        timestamp = parse_timestamp(row.pop('timestamp', None) or row.pop('time'))
+        device_name = row.pop('device', None) or row.pop('device_name', None)
+        data = {measure: float(value) for measure, value in row.items() if value not in ('', None)}
+        return timestamp, device_name, data
+
+    def get_batch(self):
+        """
+        Get the recorded data whose time has come according to the replay speed.
+        :return: A list of readings.
+        :rtype: list.
+        """
+        if self._next is None and self.loop:
+            self._rewind()
+        if self._next is None:
+            return []
+
+        now = time.time()
+        if self._origin is None:
+            self._origin = (self._next[0] or now, now)
+        replay_time = self._origin[0] + (now - self._origin[1]) * self.speed if self.speed else None
+
+        batch = []
+        while self._next is not None and len(batch) < self.batch_size:
+            timestamp, device_name, data = self._next
+            if replay_time is not None and timestamp is not None and timestamp > replay_time:
+                break
+            batch.append(Reading(device_name, data, timestamp))
+            self._next = self._read_reading()
+        self.replayed += len(batch)
+        if self._next is None:
+            logging.info('Replay of %s finished, %s readings replayed', self.path, self.replayed)
+        return batch
+
+    @property
+    def ready(self):
+        """
+        There are recorded readings whose time has already come, always when replaying as fast as possible.
+        :rtype: bool.
+        """
+        if self._next is None or self._origin is None:
+            return False
+        if not self.speed or self._next[0] is None:
+            return True
+        return self._next[0] <= self._origin[0] + (time.time() - self._origin[1]) * self.speed
+
+    def close(self):
+        """
+        Close the replayed file.
+        """
+        self._map.close()
+        self._file.close()
@@ -1,8 +1,13 @@
 """
 Makes the setup of the classes through configuration and run.
 """
+import copy
+import itertools
+import json
 import logging
-from threading import Thread
+import os
+import signal
+from threading import Thread, Lock, current_thread
 import sys
 import yaml
 from sched import scheduler
@@ -11,80 +16,281 @@ import traceback
 import socket
 from http import HTTPStatus
 
-from flask import Flask, request
+from flask import Flask, Response, request, jsonify, send_from_directory
 
+from cloud_connector.data.alerts import AlertEngine
+from cloud_connector.data.dedup import Deduplicator
+from cloud_connector.data.history import History
+from cloud_connector.data.latest import LatestCache
+from cloud_connector.data.model import DEFAULT_MAX_DEVICES
+from cloud_connector.data.routing import RoutingTable
 from cloud_connector.data.sender import DataSender
-from cloud_connector.devices import SimDevice
-from cloud_connector.data.tsdb import InfluxDB
-from cloud_connector.data.clouds import CloudAmazonMQTT, CloudThingsIO, CloudPubNub
+from cloud_connector.data.stats import WindowStats
+from cloud_connector.data.spool import Spool
+from cloud_connector.devices import SimDevice, FleetBase
+from cloud_connector.data.tsdb import InfluxDB, ShardedInfluxDB
 from cloud_connector.cc_exceptions import ConnectionTimeout, ConfigurationError, InputDataError
-from cloud_connector.data.strategies import All, Variation, MessageLimit, TimeLimit
+from cloud_connector.lazy import LazyImport, LazyRegistry
+from cloud_connector.scheduling import DeviceSchedule, AdaptiveInterval, OVERRUN_POLICIES, SKIP
+from cloud_connector.sharding import aggregate_status, load_ring, save_ring, shard_of
+from cloud_connector.profiling import SamplingProfiler, PROFILE_NAME
+from cloud_connector.tracing import Tracer
+from cloud_connector import logs, metrics
 
 
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s %(levelname)-8s %(threadName)-12s %(name)-12s: %(message)s',
-                    datefmt='%d/%m/%Y %H:%M:%S')
+SHUTDOWN_TIMEOUT = 10
+# Seconds to wait for another worker to reload its configuration
+RELOAD_TIMEOUT = 60
+RING_FILE = 'tsdb-ring.json'
 
-available_strategies = {'All': All,
-                        'Variation': Variation,
-                        'MessageLimit': MessageLimit,
-                        'TimeLimit': TimeLimit,
-                        }
+parse_timestamp = LazyImport('cloud_connector.replay:parse_timestamp')
+
+# Implementations are imported the first time they are configured, so unused backends are not loaded
+available_strategies = LazyRegistry({'All': 'cloud_connector.data.strategies:All',
+                                     'Variation': 'cloud_connector.data.strategies:Variation',
+                                     'MessageLimit': 'cloud_connector.data.strategies:MessageLimit',
+                                     'TimeLimit': 'cloud_connector.data.strategies:TimeLimit',
+                                     'Deviation': 'cloud_connector.data.strategies:Deviation',
+                                     })
+
+available_devices = LazyRegistry({'sim': SimDevice,
+                                  'fleet': 'cloud_connector.fleet:SimFleet',
+                                  'replay': 'cloud_connector.replay:ReplayDevice',
+                                  })
 
-available_clouds = {'aws': CloudAmazonMQTT,
-                    'thethingsio': CloudThingsIO,
-                    'pubnub': CloudPubNub,
-                    }
+available_clouds = LazyRegistry({'aws': 'cloud_connector.data.clouds:CloudAmazonMQTT',
+                                 'thethingsio': 'cloud_connector.data.clouds:CloudThingsIO',
+                                 'pubnub': 'cloud_connector.data.clouds:CloudPubNub',
+                                 'relay': 'cloud_connector.relay:CloudRelay',
+                                 })
+
+# Clouds whose messages can be bytes, the others send JSON objects
+CODEC_CLOUDS = ('aws',)
+
+RelayListener = LazyImport('cloud_connector.relay:RelayListener')
 
 
 app = Flask(__name__)
 
+# Set on start, they are used by the REST API
+config = None
+runner = None
+# Set when running as a worker of a Supervisor, see cloud_connector.supervisor
+shard = None
+# Profiles are written to their own directory, the only files that can be downloaded from the REST API
+profiler = SamplingProfiler(os.path.join(os.getcwd(), 'profiles'))
+PROFILE_SECONDS = 30
+
 
 class ConfiguratorYaml(object):
     """
     Reads YAML file and config the application with it content. There will be three sections: devices, tsdb and cloud.
-    devices: Configure n OpenMotes with name and ipv6.
-    tsdb: Configure an InfluxDB with host, port, user, password and database.
+    devices: Configure n OpenMotes with name and ipv6, read interval (global, per device or adaptive) and overrun
+    policy.
+    tsdb: Configure an InfluxDB with host, port, user, password and database, or a list of them to shard the devices.
     cloud: Configure n cloud systems with its own parameters and strategy.
+    shutdown: Optional, configure the time to drain data on shutdown and a spool file for data not sent.
+    When a shard is given, only the devices owned by the shard are configured.
+    The configuration can be reloaded, only the elements whose configuration has changed are built again.
     """
 
-    def __init__(self, file_name=None):
+    def __init__(self, file_name=None, shard=None):
+        self.shard = shard
         if file_name:
             self._file_name = file_name
         else:
             self._file_name = 'config.yml'
 
-        with open(file_name, 'r') as ymlfile:
+        # Elements built from the configuration by key, with the configuration used to build them
+        self._built = {}
+        self.changes = {}
+        self._configure()
+
+    def _configure(self):
+        """
+        Read the configuration file and configure all the sections, reusing the elements already built if their
+        configuration has not changed.
+        :return: Elements built before that are not used by the new configuration.
+        :rtype: list.
+        """
+        with open(self._file_name, 'r') as ymlfile:
             self._config = yaml.safe_load(ymlfile)
 
-        # Initialize read_interval, it will be set in _configure_devices
-        self.read_interval = None
+        # Read intervals (one per device, in the same order) and schedule options, set in _configure_devices
+        schedule = {'read_interval': None, 'read_intervals': [], 'overrun_policy': SKIP, 'phase_jitter': True,
+                    'adaptive': None}
+        built = {}
         try:
-            self.db = self._configure_influxdb()
-            self.devices = self._configure_devices()
-            self.clouds = self._configure_cloud()
+            db = self._configure_influxdb(built)
+            devices = self._configure_devices(built, schedule)
+            clouds = self._configure_cloud(built)
+            shutdown_timeout, spool = self._configure_shutdown()
+            tracer = self._configure_tracing(built)
+            latest = self._configure_latest(built)
+            stats = self._configure_stats(built)
+            history = self._configure_history(built)
+            # Clouds by the names of the cloud section, for alerts and routes
+            named_clouds = dict(zip(self._config.get('cloud') or {}, clouds or []))
+            alerts = self._configure_alerts(built, named_clouds)
+            dedup = self._configure_dedup(built)
+            routing = self._configure_routing(built, named_clouds)
+            if alerts:
+                alerts.routing = routing
+            relay = self._configure_relay(built)
+            strategies = [cloud.strategy for cloud in clouds or []] + (routing.strategies if routing else [])
+            for strategy in strategies:
+                strategy.stats = stats
         except Exception as exception:
             msg = '{}: {}'.format(exception.__class__.__name__, exception)
-            logging.critical('Configuration Error: {}'.format(msg))
+            logging.critical('Configuration Error: %s', msg)
             traceback.print_exc(file=sys.stdout)
+            self._close_unused(built)
             raise ConfigurationError(msg)
+        self.read_interval, self.read_intervals = schedule['read_interval'], schedule['read_intervals']
+        self.overrun_policy, self.phase_jitter = schedule['overrun_policy'], schedule['phase_jitter']
+        self.adaptive = schedule['adaptive']
+        previous_db = getattr(self, 'db', None)
+        self.db, self.devices, self.clouds = db, devices, clouds
+        self.shutdown_timeout, self.spool, self.tracer, self.latest = shutdown_timeout, spool, tracer, latest
+        self.stats, self.history, self.alerts, self.dedup = stats, history, alerts, dedup
+        self.routing, self.relay = routing, relay
+        self._rebalance_tsdb(previous_db)
+
+        in_use = [id(element) for _, element in built.values()]
+        retired = [element for key, (_, element) in self._built.items() if id(element) not in in_use]
+        self.changes = {'built': sorted(key for key in built if self._built.get(key) is not built[key]),
+                        'kept': sorted(key for key in built if self._built.get(key) is built[key]),
+                        'removed': sorted(key for key in self._built if key not in built),
+                        }
+        self._built = built
+        return retired
 
-    def _configure_influxdb(self):
+    def reload(self):
+        """
+        Read again the configuration file. The configuration in use is kept if the new one is wrong.
+        :return: Elements built before that are not used by the new configuration, they should be closed.
+        :rtype: list.
+        """
+        retired = self._configure()
+        logging.info('Configuration reloaded: %s', self.changes)
+        return retired
+
+    def _close_unused(self, built):
+        """
+        Close the elements built for a configuration that could not be applied, the elements in use are kept.
+        :param built: Elements built for the configuration that could not be applied.
+        :type built: dict.
+        """
+        in_use = [id(element) for _, element in self._built.values()]
+        for _, element in built.values():
+            if id(element) not in in_use and hasattr(element, 'close'):
+                try:
+                    element.close()
+                except Exception as e:
+                    logging.error('Error closing %s: %s', type(element).__name__, e)
+
+    def _build(self, built, key, parameters, factory):
+        """
+        Build an element, or reuse the element built before if its configuration has not changed.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :param key: Key of the element.
+        :type key: str.
+        :param parameters: Configuration of the element.
+        :param factory: Function to build the element from its parameters.
+        :return: Element.
+        """
+        if key in self._built and self._built[key][0] == parameters:
+            built[key] = self._built[key]
+        else:
+            built[key] = (copy.deepcopy(parameters), factory(copy.deepcopy(parameters)))
+        return built[key][1]
+
+    def _bounded(self, parameters):
+        """
+        Parameters of an element that keeps state of each device, with the max_devices of the configuration file
+        (DEFAULT_MAX_DEVICES if not set) unless the element sets its own.
+        :param parameters: Configuration of the element.
+        :type parameters: dict.
+        :rtype: dict.
+        """
+        return dict({'max_devices': self._config.get('max_devices') or DEFAULT_MAX_DEVICES}, **(parameters or {}))
+
+    def _configure_influxdb(self, built):
         """
         Configure InfluxDB object
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
         :return: InfluxDB object
         :rtype: InfluxDB
         """
         db_config = self._config['tsdb']
         influx = db_config['influxdb']
         try:
-            return InfluxDB(**influx)
+            if isinstance(influx, list):
+                return self._configure_sharded_influxdb(built, influx, dict(db_config.get('sharding') or {}))
+            return self._build(built, 'tsdb', influx, lambda parameters: InfluxDB(**parameters))
         except ConnectionTimeout:
+            if self._built:
+                # Reloading, the running configuration is kept
+                raise
             sys.exit('Exiting application.')
 
-    def _configure_devices(self):
+    def _configure_sharded_influxdb(self, built, shards, sharding):
+        """
+        Configure several InfluxDB instances, with devices spread by consistent hashing.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :param shards: Connection parameters of each instance.
+        :type shards: list.
+        :param sharding: Sharding options: replicas, virtual_nodes, batch_size, flush_interval and max_pending.
+        :type sharding: dict.
+        :rtype: ShardedInfluxDB.
+        """
+        sharding.pop('rebalance', None)
+        sharding.pop('ring_file', None)
+        # The connections to the shards that have not changed are reused
+        previous = self._built['tsdb'][1] if 'tsdb' in self._built else None
+        if not isinstance(previous, ShardedInfluxDB):
+            previous = None
+        return self._build(built, 'tsdb', self._bounded(dict(sharding, shards=shards)),
+                           lambda parameters: ShardedInfluxDB(previous=previous, **parameters))
+
+    # noinspection PyBroadException
+    def _rebalance_tsdb(self, previous):
+        """
+        When the hash ring of the TSDB shards has changed, copy the points of the devices that move to their new
+        shards, unless rebalance is false in the sharding section. The ring is saved in the ring_file of the sharding
+        section (tsdb-ring.json next to the configuration file by default), so the shards changed while stopped are
+        rebalanced on start. Only the first worker copies them when running with workers.
+        :param previous: TSDB of the previous configuration.
+        :type previous: TSDatabase.
+        """
+        if not isinstance(self.db, ShardedInfluxDB) or self.db is previous or (self.shard and self.shard.index != 0):
+            return
+        sharding = self._config['tsdb'].get('sharding') or {}
+        ring_path = sharding.get('ring_file') or os.path.join(os.path.dirname(os.path.abspath(self._file_name)),
+                                                              RING_FILE)
+        try:
+            previous_ring = previous.ring if isinstance(previous, ShardedInfluxDB) else load_ring(ring_path)
+        except Exception as e:
+            logging.error('Unable to read the TSDB ring from %s: %s', ring_path, e)
+            previous_ring = None
+        if sharding.get('rebalance', True) and previous_ring and previous_ring.layout != self.db.ring.layout:
+            logging.info('TSDB shards changed, rebalancing')
+            self.db.rebalance(previous_ring)
+        try:
+            save_ring(self.db.ring, ring_path)
+        except OSError as e:
+            logging.error('Unable to save the TSDB ring to %s: %s', ring_path, e)
+
+    def _configure_devices(self, built, schedule):
         """
         Configure devices
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :param schedule: Schedule options of the configuration being applied, set from the devices section.
+        :type schedule: dict.
         :return: A list of devices objects initialized
         :rtype: list.
         """
@@ -92,15 +298,39 @@ class ConfiguratorYaml(object):
             devices_config = self._config['devices']
         except KeyError:
             return None
-        self.read_interval = devices_config.pop('read_interval')
+        schedule['read_interval'] = devices_config.pop('read_interval')
+        schedule['overrun_policy'] = devices_config.pop('overrun', SKIP)
+        if schedule['overrun_policy'] not in OVERRUN_POLICIES:
+            raise ValueError('Overrun policy must be one of {}'.format(OVERRUN_POLICIES))
+        schedule['phase_jitter'] = devices_config.pop('phase_jitter', True)
+        if 'adaptive' in devices_config:
+            schedule['adaptive'] = AdaptiveInterval(**devices_config.pop('adaptive'))
         devices = []
         for device in devices_config.values():
-            devices.append(SimDevice(**device))
+            if self.shard and not self.shard.owns(device['name']):
+                continue
+            schedule['read_intervals'].append(device.pop('read_interval', schedule['read_interval']))
+            devices.append(self._build(built, 'device:{}'.format(device['name']), device, self._device_factory))
         return devices
 
-    def _configure_cloud(self):
+    @staticmethod
+    def _device_factory(device_config):
         """
-        Configure cloud services
+        Build a device of the configured type, simulated device by default.
+        :param device_config: Device type and parameters.
+        :type device_config: dict.
+        :rtype: DeviceBase.
+        """
+        if 'type' in device_config:
+            return available_devices[device_config.pop('type')](**device_config)
+        return SimDevice(**device_config)
+
+    def _configure_cloud(self, built):
+        """
+        Configure cloud services. A cloud service whose connection parameters have not changed is kept, if only its
+        strategy has changed the new strategy is set to it. Only the clouds in CODEC_CLOUDS accept a codec.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
         :return: A list of cloud services objects initialized
         :rtype: list.
         """
@@ -111,14 +341,144 @@ class ConfiguratorYaml(object):
 
         clouds_list = []
         for cloud, parameters in cloud_config.items():
-            if 'strategy' in parameters:
-                strategy_config = parameters.pop('strategy')
-                strategy_class = available_strategies[strategy_config['type']]
-                if 'parameters' in strategy_config:
-                    parameters['strategy'] = strategy_class(**strategy_config['parameters'])
-            clouds_list.append(available_clouds[cloud](**parameters))
+            if 'codec' in parameters and cloud not in CODEC_CLOUDS:
+                raise ValueError('Cloud {} does not support codec, only {}'.format(cloud, ', '.join(CODEC_CLOUDS)))
+            strategy_config = parameters.pop('strategy', None)
+            codec = parameters.get('codec') or {}
+            if codec.get('type') == 'binary':
+                parameters['codec'] = dict(codec, parameters=self._bounded(codec.get('parameters')))
+            strategy = self._build(built, 'strategy:{}'.format(cloud), strategy_config, self._strategy_factory)
+            cloud_service = self._build(built, 'cloud:{}'.format(cloud), parameters,
+                                        lambda cloud_parameters: available_clouds[cloud](strategy=strategy,
+                                                                                         **cloud_parameters))
+            if cloud_service.strategy is not strategy:
+                cloud_service.strategy = strategy
+            clouds_list.append(cloud_service)
         return clouds_list
 
+    @staticmethod
+    def _strategy_factory(strategy_config):
+        """
+        Build a strategy, All by default.
+        :param strategy_config: Strategy type and parameters.
+        :type strategy_config: dict.
+        :rtype: StrategyBase.
+        """
+        if strategy_config and 'parameters' in strategy_config:
+            strategy_class = available_strategies[strategy_config['type']]
+            return strategy_class(**strategy_config['parameters'])
+        return available_strategies['All']()
+
+    def _configure_shutdown(self):
+        """
+        Configure shutdown
+        :return: Seconds to drain data on shutdown and the spool for data not sent (if any).
+        :rtype: tuple.
+        """
+        shutdown_config = self._config.get('shutdown', {})
+        spool_path = shutdown_config.get('spool')
+        return shutdown_config.get('timeout', SHUTDOWN_TIMEOUT), Spool(spool_path) if spool_path else None
+
+    def _configure_tracing(self, built):
+        """
+        Configure the tracing of readings, no reading is sampled by default.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :rtype: Tracer.
+        """
+        return self._build(built, 'tracing', self._config.get('tracing', {}),
+                           lambda parameters: Tracer(**parameters))
+
+    def _configure_latest(self, built):
+        """
+        Configure the cache of the latest value of each device and measure.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :rtype: LatestCache.
+        """
+        return self._build(built, 'latest', self._bounded(self._config.get('latest')),
+                           lambda parameters: LatestCache(**parameters))
+
+    def _configure_history(self, built):
+        """
+        Configure the cache of the history queries.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :rtype: History.
+        """
+        return self._build(built, 'history', self._config.get('history', {}),
+                           lambda parameters: History(**parameters))
+
+    def _configure_alerts(self, built, clouds):
+        """
+        Configure the alert rules, only evaluated when the alerts section is present. Alerts are sent to the clouds
+        configured, by the names of the cloud section.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :param clouds: Cloud services by the names of the cloud section.
+        :type clouds: dict.
+        :rtype: AlertEngine.
+        """
+        if 'alerts' not in self._config:
+            return None
+        alerts = self._build(built, 'alerts', self._config['alerts'], lambda parameters: AlertEngine(**parameters))
+        alerts.clouds = clouds
+        return alerts
+
+    def _configure_routing(self, built, clouds):
+        """
+        Configure the routes of the devices to the clouds, all the devices are sent to all the clouds when the routing
+        section is not present.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :param clouds: Cloud services by the names of the cloud section.
+        :type clouds: dict.
+        :rtype: RoutingTable.
+        """
+        if 'routing' not in self._config:
+            return None
+        routing = self._build(built, 'routing', self._bounded(self._config['routing']),
+                              lambda parameters: RoutingTable(strategy_factory=self._strategy_factory, **parameters))
+        routing.clouds = clouds
+        return routing
+
+    def _configure_dedup(self, built):
+        """
+        Configure the detection of duplicate readings, only done when the dedup section is present.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :rtype: Deduplicator.
+        """
+        if 'dedup' not in self._config:
+            return None
+        return self._build(built, 'dedup', self._bounded(self._config['dedup']),
+                           lambda parameters: Deduplicator(**parameters))
+
+    def _configure_relay(self, built):
+        """
+        Configure the listener of data relayed by other cloud connectors, only when the relay section is present. When
+        running with workers, only the first worker listens.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :rtype: RelayListener.
+        """
+        if 'relay' not in self._config or (self.shard and self.shard.index != 0):
+            return None
+        return self._build(built, 'relay', self._config['relay'] or {},
+                           lambda parameters: RelayListener(**parameters))
+
+    def _configure_stats(self, built):
+        """
+        Configure the rolling window statistics, only kept when the stats section is present.
+        :param built: Elements built for the configuration being applied.
+        :type built: dict.
+        :rtype: WindowStats.
+        """
+        if 'stats' not in self._config:
+            return None
+        return self._build(built, 'stats', self._bounded(self._config['stats']),
+                           lambda parameters: WindowStats(**parameters))
+
 
 class Runner(object):
     """
@@ -132,74 +492,234 @@ class Runner(object):
         :type configurator: ConfiguratorYaml
         """
         self._scheduler = scheduler(time.time, time.sleep)
+        self._configurator = configurator
         self._devices = configurator.devices
         self._sender = DataSender(configurator)
+        self._reload_lock = Lock()
         self.read_interval = configurator.read_interval
+        self.overrun_policy = configurator.overrun_policy
+        self.phase_jitter = configurator.phase_jitter
+        self.adaptive = configurator.adaptive
+        self.shutdown_timeout = configurator.shutdown_timeout
+        self._relay = configurator.relay
+        self._thread = None
+        self._schedules = []
+        if self._devices:
+            self._schedules = [DeviceSchedule(device, interval)
+                               for device, interval in zip(self._devices, configurator.read_intervals)]
+            if self.adaptive:
+                for schedule in self._schedules:
+                    schedule.interval = self.adaptive.clip(schedule.interval)
         self._running = False
 
+    @property
+    def sender(self):
+        """
+        Data sender used to store and send the data read.
+        :rtype: DataSender.
+        """
+        return self._sender
+
+    @property
+    def missed_deadlines(self):
+        """
+        Number of read deadlines missed by all devices since the start.
+        :rtype: int.
+        """
+        return sum(schedule.missed for schedule in self._schedules)
+
+    def status(self):
+        """
+        Status of the runner with its counters.
+        :rtype: dict.
+        """
+        return {'pid': os.getpid(),
+                'running': self._running,
+                'devices': len(self._schedules),
+                'runs': sum(schedule.runs for schedule in self._schedules),
+                'missed_deadlines': self.missed_deadlines,
+                'skipped_reads': sum(schedule.skipped for schedule in self._schedules),
+                'timestamp': time.time(),
+                }
+
     def start(self):
         """
-        Start running the scheduler
+        Start running the scheduler, sending first the data left in the spool by a previous shutdown
         """
+        Thread(target=self._sender.replay_spool, name='Spool', daemon=True).start()
+        self._running = True
+        if self._relay:
+            self._relay.start(self._sender)
         if self._devices:
             logging.info('Starting runners to read devices')
-            self._running = True
-            self._periodic(self.run)
-            Thread(target=self._scheduler.run).start()
+            now = time.time()
+            for schedule in self._schedules:
+                self._scheduler.enterabs(schedule.first_deadline(now, self.phase_jitter), 1,
+                                         self._periodic, (schedule,))
+            self._start_scheduler()
         else:
             logging.info('No devices detected, scheduler not executing.')
 
-    def stop(self):
+    def _start_scheduler(self):
+        """
+        Run the scheduler in a thread, if it is not running yet.
+        """
+        if not (self._thread and self._thread.is_alive()):
+            self._thread = Thread(target=self._scheduler.run, name='Scheduler', daemon=True)
+            self._thread.start()
+
+    def reload(self):
         """
-        Stop scheduler
+        Reload the configuration, building again only the devices, TSDB, strategies and clouds that have changed.
+        New data is sent with the new configuration, the connections no longer used are closed when the data being
+        sent with them has been sent.
+        :return: Keys of the elements built, kept and removed.
+        :rtype: dict.
+        :raises: ConfigurationError, the running configuration is kept.
         """
+        with self._reload_lock:
+            retired = self._configurator.reload()
+            self._sender.update(self._configurator)
+            self._update_schedules()
+            self._update_relay()
+        Thread(target=self._sender.retire, args=(retired, self.shutdown_timeout), name='Retire', daemon=True).start()
+        return self._configurator.changes
+
+    def _update_schedules(self):
+        """
+        Update the schedules with the reloaded devices. Kept devices keep their schedule, new devices are scheduled and
+        the schedules of removed devices are deactivated.
+        """
+        configurator = self._configurator
+        self._devices = configurator.devices
+        self.read_interval = configurator.read_interval
+        self.overrun_policy = configurator.overrun_policy
+        self.phase_jitter = configurator.phase_jitter
+        self.adaptive = configurator.adaptive
+        self.shutdown_timeout = configurator.shutdown_timeout
+
+        previous = {id(schedule.device): schedule for schedule in self._schedules}
+        schedules = []
+        now = time.time()
+        for device, interval in zip(self._devices or [], configurator.read_intervals):
+            schedule = previous.pop(id(device), None)
+            if schedule is None:
+                schedule = DeviceSchedule(device, interval)
+                if self._running:
+                    self._scheduler.enterabs(schedule.first_deadline(now, self.phase_jitter), 1,
+                                             self._periodic, (schedule,))
+            if self.adaptive:
+                schedule.interval = self.adaptive.clip(schedule.interval)
+            else:
+                schedule.interval = float(interval)
+            schedules.append(schedule)
+        for schedule in previous.values():
+            schedule.active = False
+        self._schedules = schedules
+        if self._running and self._schedules:
+            self._start_scheduler()
+
+    def _update_relay(self):
+        """
+        Replace the relay listener if its configuration has changed, the previous one is closed first to free its port.
+        """
+        relay = self._configurator.relay
+        if relay is not self._relay:
+            if self._relay:
+                self._relay.close()
+            self._relay = relay
+        if self._running and self._relay:
+            self._relay.start(self._sender)
+
+    def stop(self, timeout=None):
+        """
+        Stop scheduler and data intake, wait for the data being sent, spool the data that has not been sent before
+        timeout and close the connections.
+        :param timeout: Seconds to wait for the data being sent, shutdown timeout by default.
+        :type timeout: float.
+        """
+        deadline = time.time() + (self.shutdown_timeout if timeout is None else timeout)
         self._running = False
+        self._sender.accepting = False
+        if self._relay:
+            self._relay.close()
         if self._devices:
             for event in self._scheduler.queue:
                 self._scheduler.cancel(event)
+            if self._thread and self._thread is not current_thread():
+                self._thread.join(max(deadline - time.time(), 0))
+        self._sender.close(max(deadline - time.time(), 0))
+        if self._devices:
             self.close_devices_connection()
         logging.info('Scheduler closed.')
 
-    def _periodic(self, action, action_args=()):
+    def _periodic(self, schedule):
         """
-        Make a scheduler periodic
-        :param action: Function to be run
-        :param action_args: Arguments of the function
-        :return:
+        Read a device and schedule its next read at the next absolute deadline, or right away for a fleet with more
+        data ready.
+        :param schedule: Schedule of the device to read.
+        :type schedule: DeviceSchedule.
         """
-        if self._running:
-            self._scheduler.enter(self.read_interval, 1, self._periodic, (action, action_args))
-            action(*action_args)
+        if self._running and schedule.active:
+            readings = self._read([schedule.device])
+            if readings and self.adaptive and not isinstance(schedule.device, FleetBase):
+                self.adaptive.adapt(schedule, readings[0])
+            if self._running:
+                if isinstance(schedule.device, FleetBase) and schedule.device.ready:
+                    schedule.deadline = deadline = time.time()
+                else:
+                    deadline = schedule.next_deadline(time.time(), self.overrun_policy)
+                self._scheduler.enterabs(deadline, 1, self._periodic, (schedule,))
 
-    # noinspection PyBroadException
     def run(self):
+        """
+        Reads data from all devices, inserting in TSDB and cloud service
+        """
+        self._read(self._devices)
+
+    # noinspection PyBroadException
+    def _read(self, devices):
         """
         The action that should be schedule. It reads data from devices, inserting in TSDB and cloud service
+        :param devices: Devices to read.
+        :type devices: list.
+        :return: Data read from each device, except fleets.
+        :rtype: list.
         """
         start = time.time()
+        readings = []
         try:
             logging.debug('Starting new run ...')
             logging.debug('Sending data to cloud services')
-            for device in self._devices:
-                logging.debug('Connecting to device: {}'.format(device.name))
-                self._sender.send_data(device.get_data(), device.name)
+            for device in devices:
+                logging.debug('Connecting to device: %s', device.name)
+                read_start = time.perf_counter()
+                if isinstance(device, FleetBase):
+                    batch = device.get_batch()
+                    metrics.DEVICE_READ_SECONDS.observe(time.perf_counter() - read_start, type(device).__name__)
+                    self._sender.send_batch(batch)
+                    continue
+                data = device.get_data()
+                metrics.DEVICE_READ_SECONDS.observe(time.perf_counter() - read_start, type(device).__name__)
+                readings.append(data)
+                self._sender.send_data(data, device.name, source='poll')
 
         except KeyboardInterrupt:
             self.stop()
         except InputDataError as e:
-            logging.error('Unable to read input data. {}'.format(e))
+            logging.error('Unable to read input data. %s', e)
         except Exception as e:
-            logging.error('Unexpected error: {0} \n{1}'.format(e, traceback.print_exc()))
+            logging.error('Unexpected error: %s', e, exc_info=True)
         finally:
             logging.debug('Run complete, waiting for next run.')
-        logging.info('Run tooks {0:.3f} seconds'.format(time.time() - start))
+        logging.info('Run tooks %.3f seconds', time.time() - start)
+        return readings
 
     def close_devices_connection(self):
         """
         Close devices connection
         """
         logging.info('Closing device connection')
-        time.sleep(5)
         if self._devices:
             for device in self._devices:
                 device.close()
@@ -212,7 +732,9 @@ def insert_data():
     Get the data to the sensor and save it
     :return: HTTP response
     """
-    data_sender = DataSender(config)
+    data_sender = runner.sender
+    if not data_sender.accepting:
+        return 'Shutting down', HTTPStatus.SERVICE_UNAVAILABLE
     if not request.is_json:
         logging.debug('Input data is not a json')
         return 'Input data must be a json', HTTPStatus.BAD_REQUEST
@@ -221,19 +743,282 @@ def insert_data():
             request_data = request.get_json()
             device_name = request_data['device_name']
             data = request_data['data']
-            logging.debug('Received data: \{}'.format(request_data))
+            sequence = request_data.get('sequence')
+            timestamp = request_data.get('timestamp')
+            logging.debug('Received data: %s', request_data)
         except KeyError:
             return 'Wrong input data', HTTPStatus.BAD_REQUEST
-        data_sender.send_data(data, device_name)
+        if sequence is not None and (not isinstance(sequence, int) or isinstance(sequence, bool)):
+            return 'Sequence must be an integer', HTTPStatus.BAD_REQUEST
+        if timestamp is not None and (not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool)):
+            return 'Timestamp must be a number', HTTPStatus.BAD_REQUEST
+        if shard and not shard.owns(device_name):
+            shard.forward(data, device_name, sequence, timestamp)
+        elif not data_sender.send_data(data, device_name, trace_id=request.headers.get('X-Trace-Id'),
+                                       sequence=sequence, timestamp=timestamp):
+            # Acknowledged, so the client does not retry it again
+            return '', HTTPStatus.NO_CONTENT, {'X-Duplicate': 'true'}
         return '', HTTPStatus.NO_CONTENT
 
 
+# Queries answered to other workers when running with a supervisor, the data of a device is kept by its owner
+shard_queries = {'latest': lambda device_name: runner.sender.latest.get(device_name),
+                 'all_latest': lambda: runner.sender.latest.get_all(),
+                 'stats': lambda device_name, window: runner.sender.stats.get(device_name, window),
+                 'reload': lambda: reload_worker(),
+                 }
+
+
+@app.route('/sensor/<device_name>/latest', methods=['GET'])
+def get_latest(device_name):
+    """
+    Get the latest value of each measure of a device, from memory of the worker that owns it
+    :return: HTTP response with value and timestamp by measure
+    """
+    try:
+        if shard and not shard.owns(device_name):
+            latest = shard.ask(shard_of(device_name, shard.count), 'latest', device_name)
+        else:
+            latest = runner.sender.latest.get(device_name)
+    except ConnectionTimeout as e:
+        return str(e), HTTPStatus.GATEWAY_TIMEOUT
+    if latest is None:
+        return 'Device {} not found'.format(device_name), HTTPStatus.NOT_FOUND
+    return jsonify(latest)
+
+
+@app.route('/sensor/<device_name>/stats', methods=['GET'])
+def get_stats(device_name):
+    """
+    Get the rolling window statistics of each measure of a device, from memory of the worker that owns it
+    :return: HTTP response with count, min, max, mean and std by window (query parameter window, all by default)
+    """
+    stats = runner.sender.stats
+    if stats is None:
+        return 'Statistics are not configured', HTTPStatus.NOT_FOUND
+    try:
+        window = request.args.get('window')
+        window = int(window) if window is not None else None
+        if window is not None and window not in stats.windows:
+            raise ValueError(window)
+    except ValueError:
+        return 'Query parameter window must be one of {}'.format(list(stats.windows)), HTTPStatus.BAD_REQUEST
+    try:
+        if shard and not shard.owns(device_name):
+            device_stats = shard.ask(shard_of(device_name, shard.count), 'stats', device_name, window)
+        else:
+            device_stats = stats.get(device_name, window)
+    except ConnectionTimeout as e:
+        return str(e), HTTPStatus.GATEWAY_TIMEOUT
+    if device_stats is None:
+        return 'Device {} not found'.format(device_name), HTTPStatus.NOT_FOUND
+    return jsonify(device_stats)
+
+
+@app.route('/sensor/<device_name>/history', methods=['GET'])
+def get_history(device_name):
+    """
+    Get the points of a device from the TSDB (or the history cache), oldest first, streamed in chunks. Query parameters:
+    measures (comma separated, all by default), start and end (epoch or ISO 8601) and limit
+    :return: HTTP response with a JSON array of points with time (epoch seconds) and the measures
+    """
+    try:
+        measures = [measure for measure in request.args.get('measures', '').split(',') if measure] or None
+        start = parse_timestamp(request.args['start']) if 'start' in request.args else None
+        end = parse_timestamp(request.args['end']) if 'end' in request.args else None
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+        if limit is not None and limit < 1:
+            raise ValueError(limit)
+    except (ValueError, OverflowError):
+        return 'Query parameters start and end must be timestamps and limit a positive number', HTTPStatus.BAD_REQUEST
+    chunks = runner.sender.history(device_name, measures, start, end, limit)
+    # Read the first chunk before answering, to report TSDB errors
+    try:
+        first = next(chunks, [])
+    except Exception as e:
+        logging.error('Unable to read history of %s: %s', device_name, e)
+        return 'Unable to read history from TSDB', HTTPStatus.BAD_GATEWAY
+    return Response(json_array(itertools.chain([first], chunks)), mimetype='application/json')
+
+
+def json_array(chunks):
+    """
+    Encode a JSON array chunk by chunk, without building the whole document.
+    :param chunks: Iterator of lists of elements.
+    :return: Iterator of parts of the JSON array.
+    """
+    yield '['
+    separator = ''
+    for chunk in chunks:
+        if chunk:
+            yield separator + json.dumps(chunk)[1:-1]
+            separator = ','
+    yield ']'
+
+
+@app.route('/sensor/latest', methods=['GET'])
+def get_all_latest():
+    """
+    Get the latest value of each measure of all the devices, from memory of all the workers when running with a
+    supervisor
+    :return: HTTP response with value and timestamp by measure, by device name
+    """
+    latest = runner.sender.latest.get_all()
+    if shard:
+        try:
+            for index in range(shard.count):
+                if index != shard.index:
+                    latest.update(shard.ask(index, 'all_latest') or {})
+        except ConnectionTimeout as e:
+            return str(e), HTTPStatus.GATEWAY_TIMEOUT
+    return jsonify(latest)
+
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_config():
+    """
+    Reload the configuration file, in all the workers when running with a supervisor so they run the same
+    configuration
+    :return: HTTP response with the elements built, kept and removed, by worker when running with a supervisor
+    """
+    if not shard:
+        try:
+            return jsonify(runner.reload())
+        except ConfigurationError as e:
+            return 'Configuration error, running configuration kept. {}'.format(e), HTTPStatus.BAD_REQUEST
+    workers = {}
+    for index in range(shard.count):
+        try:
+            result = reload_worker() if index == shard.index else shard.ask(index, 'reload', timeout=RELOAD_TIMEOUT)
+        except ConnectionTimeout as e:
+            result = {'error': str(e)}
+        workers[str(index)] = result or {'error': 'Worker {} unable to reload'.format(index)}
+    failed = any('error' in result for result in workers.values())
+    return jsonify({'workers': workers}), HTTPStatus.BAD_REQUEST if failed else HTTPStatus.OK
+
+
+def reload_worker():
+    """
+    Reload the configuration file of this worker
+    :return: Elements built, kept and removed, or the configuration error
+    :rtype: dict
+    """
+    try:
+        return {'changes': runner.reload()}
+    except ConfigurationError as e:
+        return {'error': 'Configuration error, running configuration kept. {}'.format(e)}
+
+
+def reload_on_signal(signum, frame):
+    """
+    Reload the configuration file on SIGHUP, without blocking the signal handler
+    """
+    def reload():
+        try:
+            runner.reload()
+        except ConfigurationError:
+            logging.error('Configuration error, running configuration kept.')
+    Thread(target=reload, name='Reload').start()
+
+
+@app.route('/admin/profile', methods=['POST'])
+def profile():
+    """
+    Profile all the threads of the process during some seconds (query parameter seconds, 30 by default), and write
+    the profile to a file
+    :return: HTTP response with the profile file name and the top functions (query parameter top, 20 by default)
+    """
+    try:
+        seconds = float(request.args.get('seconds', PROFILE_SECONDS))
+        top = int(request.args.get('top', 20))
+    except ValueError:
+        return 'Query parameters seconds and top must be numbers', HTTPStatus.BAD_REQUEST
+    result = profiler.profile_to_file(seconds, top)
+    if result is None:
+        return 'A profile is already running', HTTPStatus.CONFLICT
+    profile_result, file_name = result
+    return jsonify({'file': file_name,
+                    'pid': os.getpid(),
+                    'samples': profile_result.samples,
+                    'seconds': profile_result.duration,
+                    'top': profile_result.top(top),
+                    })
+
+
+@app.route('/admin/profile/<file_name>', methods=['GET'])
+def get_profile(file_name):
+    """
+    Download a profile file, only the files written by the profiler can be downloaded
+    :return: HTTP response
+    """
+    if not PROFILE_NAME.match(file_name):
+        return 'Profile not found', HTTPStatus.NOT_FOUND
+    return send_from_directory(profiler.directory, file_name, mimetype='text/plain', as_attachment=True)
+
+
+def profile_on_signal(signum, frame):
+    """
+    Profile the process on SIGUSR1, without blocking the signal handler. The summary is logged.
+    """
+    Thread(target=profiler.profile_to_file, args=(PROFILE_SECONDS,), name='Profile', daemon=True).start()
+
+
+@app.route('/traces', methods=['GET'])
+def get_traces():
+    """
+    Get the last traces of readings, newest first, filtered by the query parameters device and id
+    :return: HTTP response with at most limit traces (query parameter, 100 by default)
+    """
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return 'Query parameter limit must be a number', HTTPStatus.BAD_REQUEST
+    return jsonify(runner.sender.tracer.traces(request.args.get('device'), request.args.get('id'), limit))
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Get the metrics in Prometheus text format, added up for all the workers when running with a supervisor
+    :return: HTTP response
+    """
+    if shard:
+        text = metrics.render(metrics.merge(dict(shard.metrics).values()))
+    else:
+        text = metrics.REGISTRY.render()
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Get the status of the runner, or the aggregated status of all the workers when running with a supervisor
+    :return: HTTP response
+    """
+    if shard:
+        return jsonify(aggregate_status(dict(shard.statuses)))
+    return jsonify(runner.status())
+
+
 if __name__ == '__main__':
+    with open('config.yml', 'r') as config_file:
+        main_config = yaml.safe_load(config_file)
+    logs.configure(main_config.get('logging'))
+    if main_config.get('workers', 1) > 1:
+        from cloud_connector.supervisor import Supervisor
+        Supervisor('config.yml', main_config['workers']).run()
+        sys.exit()
     try:
         config = ConfiguratorYaml('config.yml')
     except ConfigurationError as e:
         sys.exit('Configuration error, exiting application.')
     runner = Runner(config)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGHUP, reload_on_signal)
+    signal.signal(signal.SIGUSR1, profile_on_signal)
     try:
         runner.start()
         app.run(host='0.0.0.0', port=8080, debug=False)
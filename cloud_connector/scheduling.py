@@ -0,0 +1,152 @@
+"""
+Defines the schedule of device reads based on absolute deadlines.
+"""
+import logging
+from random import uniform
+
+from cloud_connector.metrics import MISSED_DEADLINES
+
+SKIP = 'skip'
+COALESCE = 'coalesce'
+OVERRUN_POLICIES = (SKIP, COALESCE)
+
+
+class DeviceSchedule(object):
+    """
+    Keeps the absolute deadlines to read a device, so the reads do not drift with the run time.
+    :param device: Device to be read.
+    :type device: DeviceBase.
+    :param interval: Seconds between two reads.
+    :type interval: float.
+    """
+
+    def __init__(self, device, interval):
+        self.device = device
+        self.interval = float(interval)
+        self.deadline = None
+        # A schedule is deactivated when its device is removed
+        self.active = True
+        # Reading used to check stability on adaptive intervals
+        self.reference = None
+        self.runs = 0
+        self.missed = 0
+        self.skipped = 0
+
+    def first_deadline(self, now, jitter=True):
+        """
+        Set the first deadline, spreading devices across the interval with a random phase.
+        :param now: Current time.
+        :type now: float.
+        :param jitter: Add a random phase in [0, interval) to the deadline.
+        :type jitter: bool.
+        :return: First deadline.
+        :rtype: float.
+        """
+        self.deadline = now + (uniform(0, self.interval) if jitter else 0)
+        return self.deadline
+
+    def next_deadline(self, now, policy=SKIP):
+        """
+        Move the deadline to the next slot after a run, applying the overrun policy if the run took longer than the
+        interval.
+        skip: the missed slots are dropped and the next read waits for the next slot in the future.
+        coalesce: the missed slots are merged into a single read that is done as soon as possible.
+        :param now: Time when the run has finished.
+        :type now: float.
+        :param policy: Overrun policy, skip or coalesce.
+        :type policy: str.
+        :return: Next deadline.
+        :rtype: float.
+        """
+        self.runs += 1
+        deadline = self.deadline + self.interval
+        if deadline >= now:
+            self.deadline = deadline
+            return self.deadline
+
+        missed = int((now - deadline) // self.interval) + 1
+        self.missed += missed
+        MISSED_DEADLINES.inc(amount=missed)
+        if policy == COALESCE:
+            self.deadline = deadline + (missed - 1) * self.interval
+            self.skipped += missed - 1
+        else:
+            self.deadline = deadline + missed * self.interval
+            self.skipped += missed
+        logging.warning('Device %s missed %s deadlines, next read policy: %s', self.device.name, missed, policy)
+        return self.deadline
+
+
+class AdaptiveInterval(object):
+    """
+    Adapts the read interval of a device to the stability of its measures. While all the measures stay within the
+    stability band around the reference reading the interval grows by factor up to max_interval, when a measure goes
+    out of the band the interval goes back to min_interval.
+    :param min_interval: Lower read interval in seconds.
+    :type min_interval: float.
+    :param max_interval: Higher read interval in seconds.
+    :type max_interval: float.
+    :param band: Stability band for each measure.
+    :type band: dict.
+    :param factor: Factor to increase the interval while measures are stable.
+    :type factor: float.
+    :param default_band: Stability band for measures not defined in band.
+    :type default_band: float.
+    """
+
+    def __init__(self, min_interval, max_interval, band=None, factor=2, default_band=0):
+        if not 0 < min_interval <= max_interval:
+            raise ValueError('Adaptive intervals must be 0 < min_interval <= max_interval')
+        if factor <= 1:
+            raise ValueError('Adaptive factor must be greater than 1')
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max_interval)
+        self.band = band or {}
+        self.factor = factor
+        self.default_band = default_band
+
+    def clip(self, interval):
+        """
+        Fit an interval between the minimum and maximum intervals.
+        :param interval: Interval in seconds.
+        :type interval: float.
+        :rtype: float.
+        """
+        return min(max(float(interval), self.min_interval), self.max_interval)
+
+    def is_stable(self, data, reference):
+        """
+        Check if all the measures are within the stability band around the reference reading.
+        :param data: New reading.
+        :type data: dict.
+        :param reference: Reference reading.
+        :type reference: dict.
+        :rtype: bool.
+        """
+        for measure, value in data.items():
+            try:
+                if abs(value - reference[measure]) > self.band.get(measure, self.default_band):
+                    return False
+            except KeyError:
+                return False
+        return True
+
+    def adapt(self, schedule, data):
+        """
+        Update the schedule interval with a new reading.
+        :param schedule: Schedule of the device that has been read.
+        :type schedule: DeviceSchedule.
+        :param data: Reading of the device.
+        :type data: dict.
+        :return: New interval.
+        :rtype: float.
+        """
+        if schedule.reference is not None and self.is_stable(data, schedule.reference):
+            schedule.interval = min(schedule.interval * self.factor, self.max_interval)
+        else:
+            if schedule.reference is not None and schedule.interval != self.min_interval:
+                logging.debug('Device %s is not stable, read interval set to %s', schedule.device.name,
+                              self.min_interval)
+            schedule.reference = dict(data)
+            schedule.interval = self.min_interval
+        return schedule.interval
@@ -0,0 +1,306 @@
+"""
+Partitions devices and ingest traffic between several worker processes, and devices between several TSDB instances.
+"""
+from bisect import bisect
+from collections import OrderedDict
+from hashlib import blake2b
+import itertools
+import json
+import logging
+import os
+from threading import Event, Lock
+import zlib
+
+from cloud_connector.cc_exceptions import ConnectionTimeout
+from cloud_connector.data.model import DEFAULT_MAX_DEVICES
+
+DEFAULT_VIRTUAL_NODES = 100
+QUERY_TIMEOUT = 5
+
+
+def shard_of(device_name, shards):
+    """
+    Get the shard that owns a device. It uses CRC32 instead of hash() because it must be the same in all processes.
+    :param device_name: Device name.
+    :type device_name: str.
+    :param shards: Number of shards.
+    :type shards: int.
+    :return: Shard index.
+    :rtype: int.
+    """
+    return zlib.crc32(device_name.encode('utf-8')) % shards
+
+
+def ring_hash(key):
+    """
+    Position of a key in a hash ring, the same in all processes.
+    :type key: str.
+    :rtype: int.
+    """
+    return int.from_bytes(blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing(object):
+    """
+    Consistent hashing of devices to nodes. Each node has many virtual nodes in the ring, and a device belongs to the
+    first nodes found after its position. When a node is added, only the devices that it takes move to it. The nodes
+    of a device are cached, so they are found in constant time.
+    :param nodes: Node names.
+    :type nodes: list.
+    :param replicas: Nodes of each device.
+    :type replicas: int.
+    :param virtual_nodes: Virtual nodes of each node.
+    :type virtual_nodes: int.
+    :param max_devices: Devices whose nodes are cached, the least recently used are removed.
+    :type max_devices: int.
+    :raises: ValueError, if there are less nodes than replicas.
+    """
+
+    def __init__(self, nodes, replicas=1, virtual_nodes=DEFAULT_VIRTUAL_NODES, max_devices=DEFAULT_MAX_DEVICES):
+        self.nodes = list(nodes)
+        if len(set(self.nodes)) != len(self.nodes):
+            raise ValueError('Repeated nodes in {}'.format(self.nodes))
+        if not 1 <= replicas <= len(self.nodes):
+            raise ValueError('{} replicas for {} nodes'.format(replicas, len(self.nodes)))
+        self.replicas = replicas
+        self.virtual_nodes = virtual_nodes
+        self.max_devices = max_devices
+        points = sorted((ring_hash('{}#{}'.format(node, index)), node)
+                        for node in self.nodes for index in range(virtual_nodes))
+        self._positions = [position for position, _ in points]
+        self._owners = [node for _, node in points]
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def nodes_of(self, device_name):
+        """
+        Nodes of a device, the first one is its primary node.
+        :param device_name: Device name.
+        :type device_name: str.
+        :rtype: tuple.
+        """
+        with self._lock:
+            nodes = self._cache.get(device_name)
+            if nodes is not None:
+                self._cache.move_to_end(device_name)
+                return nodes
+        nodes = self._find(device_name)
+        with self._lock:
+            self._cache[device_name] = nodes
+            if len(self._cache) > self.max_devices:
+                self._cache.popitem(last=False)
+        return nodes
+
+    def _find(self, device_name):
+        nodes = []
+        index = bisect(self._positions, ring_hash(device_name))
+        while len(nodes) < self.replicas:
+            node = self._owners[index % len(self._owners)]
+            if node not in nodes:
+                nodes.append(node)
+            index += 1
+        return tuple(nodes)
+
+    @property
+    def layout(self):
+        """
+        Nodes, replicas and virtual nodes, which give the nodes of each device.
+        :rtype: dict.
+        """
+        return {'nodes': self.nodes, 'replicas': self.replicas, 'virtual_nodes': self.virtual_nodes}
+
+
+def save_ring(ring, path):
+    """
+    Save the layout of a hash ring in a JSON file, written to a temporary file first.
+    :param ring: Hash ring.
+    :type ring: HashRing.
+    :param path: File path.
+    :type path: str.
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as ring_file:
+        json.dump(ring.layout, ring_file)
+    os.replace(temporary, path)
+
+
+def load_ring(path):
+    """
+    Hash ring saved in a JSON file.
+    :param path: File path.
+    :type path: str.
+    :return: Hash ring, or None if it has not been saved.
+    :rtype: HashRing.
+    """
+    try:
+        with open(path) as ring_file:
+            return HashRing(**json.load(ring_file))
+    except FileNotFoundError:
+        return None
+
+
+def aggregate_status(statuses):
+    """
+    Aggregate the status reported by each worker, adding up the numeric values.
+    :param statuses: Status of each worker by shard index.
+    :type statuses: dict.
+    :return: Status of each worker and the totals.
+    :rtype: dict.
+    """
+    total = {}
+    for status in statuses.values():
+        for key, value in status.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and key not in ('pid', 'timestamp'):
+                total[key] = total.get(key, 0) + value
+    return {'workers': {str(index): status for index, status in sorted(statuses.items())},
+            'total': total,
+            }
+
+
+class Shard(object):
+    """
+    Shard of devices owned by a worker process.
+    :param index: Shard index of the worker.
+    :type index: int.
+    :param count: Number of shards.
+    :type count: int.
+    :param inboxes: Queue of each shard, to forward ingested data to the worker that owns the device.
+    :type inboxes: list.
+    :param statuses: Shared mapping where each worker reports its status.
+    :type statuses: dict.
+    :param metrics: Shared mapping where each worker reports its metrics.
+    :type metrics: dict.
+    :param queries: Queue of each shard, to ask the worker for the data it keeps in memory.
+    :type queries: list.
+    :param answers: Queue of each shard, where the other workers answer its queries.
+    :type answers: list.
+    """
+
+    def __init__(self, index, count, inboxes=None, statuses=None, metrics=None, queries=None, answers=None):
+        self.index = index
+        self.count = count
+        self.inboxes = inboxes
+        self.statuses = statuses if statuses is not None else {}
+        self.metrics = metrics if metrics is not None else {}
+        self.queries = queries
+        self.answers = answers
+        self.forwarded = 0
+        self.received = 0
+        # Queries waiting for an answer by id, the process id is part of the id so the answers of the queries of a
+        # crashed worker are not taken by the worker restarted
+        self._waiting = {}
+        self._query_ids = itertools.count()
+        self._lock = Lock()
+
+    def owns(self, device_name):
+        """
+        Check if a device belongs to this shard.
+        :param device_name: Device name.
+        :type device_name: str.
+        :rtype: bool.
+        """
+        return shard_of(device_name, self.count) == self.index
+
+    def forward(self, data, device_name, sequence=None, timestamp=None):
+        """
+        Forward data to the worker that owns the device.
+        :param data: Data to be sent.
+        :type data: dict.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param sequence: Sequence number of the reading, to detect duplicates in the worker.
+        :type sequence: int.
+        :param timestamp: Time of the reading given by the client.
+        :type timestamp: float.
+        """
+        self.inboxes[shard_of(device_name, self.count)].put((data, device_name, sequence, timestamp))
+        self.forwarded += 1
+
+    # noinspection PyBroadException
+    def consume(self, sender):
+        """
+        Send the data forwarded by other workers until None is received.
+        :param sender: Data sender of this worker.
+        :type sender: DataSender.
+        """
+        for data, device_name, sequence, timestamp in iter(self.inboxes[self.index].get, None):
+            self.received += 1
+            try:
+                sender.send_data(data, device_name, source='forward', sequence=sequence, timestamp=timestamp)
+            except Exception as e:
+                logging.error('Unable to send forwarded data from %s: %s', device_name, e)
+
+    def ask(self, index, name, *args, timeout=None):
+        """
+        Ask a worker for data it keeps in memory, like the latest values of the devices it owns.
+        :param index: Shard index of the worker.
+        :type index: int.
+        :param name: Query name, one of the handlers of the worker.
+        :type name: str.
+        :param timeout: Seconds to wait for the answer, QUERY_TIMEOUT by default.
+        :type timeout: float.
+        :return: Answer of the worker.
+        :raises: ConnectionTimeout, if the worker does not answer.
+        """
+        query_id = (os.getpid(), next(self._query_ids))
+        answer = [Event(), None]
+        with self._lock:
+            self._waiting[query_id] = answer
+        try:
+            self.queries[index].put((self.index, query_id, name, args))
+            if not answer[0].wait(QUERY_TIMEOUT if timeout is None else timeout):
+                raise ConnectionTimeout('Worker {} did not answer {}'.format(index, name))
+        finally:
+            with self._lock:
+                self._waiting.pop(query_id, None)
+        return answer[1]
+
+    # noinspection PyBroadException
+    def answer(self, handlers):
+        """
+        Answer the queries of other workers until None is received.
+        :param handlers: Function to answer each query, by query name.
+        :type handlers: dict.
+        """
+        for index, query_id, name, args in iter(self.queries[self.index].get, None):
+            try:
+                result = handlers[name](*args)
+            except Exception as e:
+                logging.error('Unable to answer query %s%s: %s', name, args, e)
+                result = None
+            self.answers[index].put((query_id, result))
+
+    def receive_answers(self):
+        """
+        Pass the answers of other workers to the queries waiting for them until None is received.
+        """
+        for query_id, result in iter(self.answers[self.index].get, None):
+            with self._lock:
+                answer = self._waiting.get(query_id)
+            if answer is not None:
+                answer[1] = result
+                answer[0].set()
+
+    def close(self):
+        """
+        Stop consuming forwarded data and answering queries.
+        """
+        self.inboxes[self.index].put(None)
+        if self.queries:
+            self.queries[self.index].put(None)
+            self.answers[self.index].put(None)
+
+    def report(self, status, metrics=None):
+        """
+        Publish the status and metrics of this worker.
+        :param status: Worker status.
+        :type status: dict.
+        :param metrics: Worker metrics snapshot.
+        :type metrics: dict.
+        """
+        status.update({'forwarded': self.forwarded,
+                       'received': self.received,
+                       })
+        self.statuses[self.index] = status
+        if metrics is not None:
+            self.metrics[self.index] = metrics
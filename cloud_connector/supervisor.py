@@ -0,0 +1,228 @@
+"""
+Runs the cloud connector in several worker processes to use all the cores of a fog node.
+Each worker owns a hash-partitioned shard of the devices with its own TSDB and cloud connections. All the workers share
+the same listening socket, the ingested data of a device owned by another worker is forwarded to it, and the data kept
+in memory for a device is asked to the worker that owns it.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from threading import Thread
+
+from werkzeug.serving import make_server
+
+from cloud_connector import logs
+from cloud_connector.metrics import REGISTRY
+from cloud_connector.sharding import Shard, aggregate_status
+
+REPORT_INTERVAL = 5
+CHECK_INTERVAL = 1
+MAX_RESTART_DELAY = 60
+
+
+def run_worker(file_name, shard, address, fd, restarts=0):
+    """
+    Run a worker process: configure its shard, read its devices and serve the REST API on the shared socket.
+    :param file_name: Configuration file name.
+    :type file_name: str.
+    :param shard: Shard owned by the worker.
+    :type shard: Shard.
+    :param address: Host and port of the shared listening socket.
+    :type address: tuple.
+    :param fd: File descriptor of the shared listening socket.
+    :type fd: int.
+    :param restarts: Number of times the worker has been restarted.
+    :type restarts: int.
+    """
+    from cloud_connector import runner as runner_module
+
+    # The async logging thread of the supervisor does not exist in the forked process
+    logs.configure_file(file_name)
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, runner_module.reload_on_signal)
+    signal.signal(signal.SIGUSR1, runner_module.profile_on_signal)
+
+    config = runner_module.ConfiguratorYaml(file_name, shard=shard)
+    runner = runner_module.Runner(config)
+    runner_module.config = config
+    runner_module.runner = runner
+    runner_module.shard = shard
+
+    def report():
+        while True:
+            shard.report(dict(runner.status(), restarts=restarts), REGISTRY.snapshot())
+            time.sleep(REPORT_INTERVAL)
+
+    Thread(target=shard.consume, args=(runner.sender,), name='Inbox-{}'.format(shard.index), daemon=True).start()
+    Thread(target=shard.answer, args=(runner_module.shard_queries,), name='Queries-{}'.format(shard.index),
+           daemon=True).start()
+    Thread(target=shard.receive_answers, name='Answers-{}'.format(shard.index), daemon=True).start()
+    Thread(target=report, name='Report-{}'.format(shard.index), daemon=True).start()
+    logging.info('Worker %s started with %s devices', shard.index, len(config.devices or []))
+    server = make_server(address[0], address[1], runner_module.app, threaded=True, fd=fd)
+    try:
+        runner.start()
+        server.serve_forever()
+    finally:
+        runner.stop()
+        shard.close()
+
+
+class Supervisor(object):
+    """
+    Starts the worker processes and restarts any worker that crashes.
+    :param file_name: Configuration file name.
+    :type file_name: str.
+    :param workers: Number of worker processes.
+    :type workers: int.
+    :param host: Host to listen for the REST API.
+    :type host: str.
+    :param port: Port to listen for the REST API.
+    :type port: int.
+    """
+
+    def __init__(self, file_name, workers, host='0.0.0.0', port=8080):
+        self._file_name = file_name
+        self.workers = workers
+        self._context = multiprocessing.get_context('fork')
+        self._manager = None
+        self._socket = None
+        self._address = (host, port)
+        self._inboxes = []
+        self._queries = []
+        self._answers = []
+        self._statuses = None
+        self._metrics = None
+        self._processes = []
+        self.restarts = [0] * workers
+        self._restart_at = [None] * workers
+        self._running = False
+
+    def start(self):
+        """
+        Open the shared socket and start the workers.
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(self._address)
+        self._socket.listen(128)
+        self._socket.set_inheritable(True)
+
+        self._manager = self._context.Manager()
+        self._statuses = self._manager.dict()
+        self._metrics = self._manager.dict()
+        self._inboxes = [self._context.Queue() for _ in range(self.workers)]
+        self._queries = [self._context.Queue() for _ in range(self.workers)]
+        self._answers = [self._context.Queue() for _ in range(self.workers)]
+        self._running = True
+        self._processes = [self._start_worker(index) for index in range(self.workers)]
+        logging.info('Supervisor started %s workers on %s:%s', self.workers, *self._address)
+
+    def _start_worker(self, index):
+        """
+        Start a worker process.
+        :param index: Shard index of the worker.
+        :type index: int.
+        :return: Worker process.
+        :rtype: multiprocessing.Process.
+        """
+        shard = Shard(index, self.workers, self._inboxes, self._statuses, self._metrics, self._queries, self._answers)
+        process = self._context.Process(target=run_worker,
+                                        args=(self._file_name, shard, self._address, self._socket.fileno(),
+                                              self.restarts[index]),
+                                        name='Worker-{}'.format(index))
+        process.start()
+        return process
+
+    def check_workers(self):
+        """
+        Restart the workers that are not alive, waiting longer for workers that keep crashing.
+        """
+        now = time.time()
+        for index, process in enumerate(self._processes):
+            if not self._running or process.is_alive():
+                continue
+            if self._restart_at[index] is None:
+                delay = min(2 ** self.restarts[index] - 1, MAX_RESTART_DELAY)
+                logging.error('Worker %s exited with code %s, restarting in %s seconds', index, process.exitcode, delay)
+                self._restart_at[index] = now + delay
+            if now >= self._restart_at[index]:
+                self.restarts[index] += 1
+                self._restart_at[index] = None
+                self._processes[index] = self._start_worker(index)
+
+    def status(self):
+        """
+        Aggregated status of all the workers.
+        :rtype: dict.
+        """
+        return aggregate_status(dict(self._statuses))
+
+    def reload(self):
+        """
+        Ask all the workers to reload the configuration.
+        """
+        self._signal_workers(signal.SIGHUP)
+
+    def profile(self):
+        """
+        Ask all the workers to profile themselves, each one writes its own profile file.
+        """
+        self._signal_workers(signal.SIGUSR1)
+
+    def _signal_workers(self, signum):
+        for process in self._processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def run(self):
+        """
+        Start the workers and supervise them until SIGTERM or SIGINT is received. SIGHUP reloads the configuration
+        and SIGUSR1 profiles the workers.
+        """
+        def terminate(signum, frame):
+            self._running = False
+        signal.signal(signal.SIGTERM, terminate)
+        signal.signal(signal.SIGINT, terminate)
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.reload())
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.profile())
+
+        self.start()
+        while self._running:
+            self.check_workers()
+            time.sleep(CHECK_INTERVAL)
+        self.stop()
+
+    def stop(self, timeout=30):
+        """
+        Stop the workers, killing the ones that do not stop before the timeout.
+        :param timeout: Seconds to wait for the workers.
+        :type timeout: float.
+        """
+        self._running = False
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.time() + timeout
+        for process in self._processes:
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                logging.error('Worker %s did not stop, killing it', process.name)
+                os.kill(process.pid, signal.SIGKILL)
+        self._socket.close()
+        self._manager.shutdown()
+        logging.info('Supervisor stopped.')
+
+
+if __name__ == '__main__':
+    config_file_name = sys.argv[1] if len(sys.argv) > 1 else 'config.yml'
+    logs.configure_file(config_file_name)
+    Supervisor(config_file_name, multiprocessing.cpu_count()).run()
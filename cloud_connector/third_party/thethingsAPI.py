@@ -25,7 +25,10 @@ class thethingsiO(object): # pragma: no cover
 
     _data = []
 
-    def __init__(self, token=None):
+    def __init__(self, token=None, url_root=None):
+        if url_root is not None:
+            self.URLROOT = url_root
+        self._data = []
         if (token is not None):
             self.__initData(token)
         self._urlAct = self.URLROOT
@@ -102,7 +105,7 @@ class thethingsiO(object): # pragma: no cover
         """
 
         localData = {'values': self._data}
-        localData = json.dumps(localData)
+        localData = json.dumps(localData).encode('utf-8')
         ret = None
         try:
             req = urllib.request.Request(self._urlWrite, localData, self.HEADERS_WRITE)
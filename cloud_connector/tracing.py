@@ -0,0 +1,169 @@
+"""
+Traces readings through the pipeline, recording the time when each stage is passed: strategy and send of each cloud and
+TSDB write. Only a sample of the readings is traced, an unsampled reading costs a random number and a comparison.
+Finished traces are kept in a ring buffer and can be written to a JSON lines file.
+"""
+import json
+import time
+from collections import deque
+from math import log
+from random import random, getrandbits
+from threading import Lock
+
+DEFAULT_BUFFER_SIZE = 1000
+
+
+def new_trace_id():
+    """
+    Random trace id.
+    :rtype: str.
+    """
+    return '{:016x}'.format(getrandbits(64))
+
+
+class Trace(object):
+    """
+    Stages passed by a reading, with the seconds since the reading was received.
+    :param trace_id: Trace id.
+    :type trace_id: str.
+    :param device_name: Device name.
+    :type device_name: str.
+    :param source: Where the reading comes from: rest, poll, fleet, forward or spool.
+    :type source: str.
+    """
+    __slots__ = ('id', 'device_name', 'source', 'timestamp', 'stages', '_start')
+
+    def __init__(self, trace_id, device_name, source):
+        self.id = trace_id
+        self.device_name = device_name
+        self.source = source
+        self.timestamp = time.time()
+        self.stages = []
+        self._start = time.perf_counter()
+
+    def mark(self, stage):
+        """
+        Record that a stage has been passed now.
+        :param stage: Stage name.
+        :type stage: str.
+        """
+        self.stages.append((stage, time.perf_counter() - self._start))
+
+    def to_dict(self):
+        """
+        Trace with the stage times in milliseconds.
+        :rtype: dict.
+        """
+        return {'id': self.id,
+                'device_name': self.device_name,
+                'source': self.source,
+                'timestamp': self.timestamp,
+                'stages': [{'stage': stage, 'ms': round(offset * 1e3, 3)} for stage, offset in self.stages],
+                }
+
+
+class Tracer(object):
+    """
+    Samples readings to trace and keeps the finished traces.
+    :param sample_rate: Fraction of the readings traced, from 0 to 1.
+    :type sample_rate: float.
+    :param buffer_size: Number of finished traces kept in memory.
+    :type buffer_size: int.
+    :param file: JSON lines file where finished traces are appended.
+    :type file: str.
+    """
+
+    def __init__(self, sample_rate=0, buffer_size=DEFAULT_BUFFER_SIZE, file=None):
+        self.sample_rate = sample_rate
+        self._buffer = deque(maxlen=buffer_size)
+        self._file = open(file, 'a') if file else None
+        self._lock = Lock()
+
+    def start(self, device_name, source, trace_id=None):
+        """
+        Start the trace of a reading if it is sampled. A reading with a trace id is always traced.
+        :param device_name: Device name.
+        :type device_name: str.
+        :param source: Where the reading comes from.
+        :type source: str.
+        :param trace_id: Trace id given by the client.
+        :type trace_id: str.
+        :return: Trace, or None if the reading is not sampled.
+        :rtype: Trace.
+        """
+        if trace_id is None:
+            if not self.sample_rate or random() >= self.sample_rate:
+                return None
+            trace_id = new_trace_id()
+        return Trace(trace_id, device_name, source)
+
+    def start_batch(self, readings, source):
+        """
+        Start the traces of the sampled readings of a batch. The gaps between sampled readings are drawn from a
+        geometric distribution, so the cost depends on the number of readings sampled, not on the batch size.
+        :param readings: Readings of the batch.
+        :type readings: RecordBatch or list.
+        :param source: Where the readings come from.
+        :type source: str.
+        :return: Traces by index of the reading, or None if no reading is sampled.
+        :rtype: dict.
+        """
+        if not self.sample_rate:
+            return None
+        traces = {}
+        index = self._gap()
+        while index < len(readings):
+            traces[index] = Trace(new_trace_id(), readings[index].device_name, source)
+            index += 1 + self._gap()
+        return traces or None
+
+    def _gap(self):
+        if self.sample_rate >= 1:
+            return 0
+        return int(log(1.0 - random()) / log(1.0 - self.sample_rate))
+
+    def finish(self, trace):
+        """
+        Keep a finished trace and write it to the file.
+        :param trace: Finished trace.
+        :type trace: Trace.
+        """
+        record = trace.to_dict()
+        with self._lock:
+            self._buffer.append(record)
+            if self._file:
+                self._file.write(json.dumps(record) + '\n')
+                self._file.flush()
+
+    def traces(self, device_name=None, trace_id=None, limit=100):
+        """
+        Finished traces kept in memory, newest first.
+        :param device_name: Only traces of this device.
+        :type device_name: str.
+        :param trace_id: Only the trace with this id.
+        :type trace_id: str.
+        :param limit: Maximum number of traces.
+        :type limit: int.
+        :rtype: list.
+        """
+        with self._lock:
+            records = list(self._buffer)
+        selected = []
+        for record in reversed(records):
+            if device_name is not None and record['device_name'] != device_name:
+                continue
+            if trace_id is not None and record['id'] != trace_id:
+                continue
+            selected.append(record)
+            if len(selected) >= limit:
+                break
+        return selected
+
+    def close(self):
+        """
+        Close the traces file.
+        """
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,125 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from cloud_connector.cc_exceptions import ConfigurationError
+from cloud_connector.data.alerts import AlertEngine
+from cloud_connector.data.model import Reading, RecordBatch
+from cloud_connector.data.routing import RoutingTable
+
+
+class TestAlertEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = threading.Semaphore(0)
+        self.aws = mock.MagicMock()
+        self.aws.send_now.side_effect = lambda data, device_name: self.sent.release()
+        self.pubnub = mock.MagicMock()
+        self.pubnub.send_now.side_effect = lambda data, device_name: self.sent.release()
+
+    def engine(self, rules, **kwargs):
+        engine = AlertEngine(rules, **kwargs)
+        engine.clouds = {'aws': self.aws, 'pubnub': self.pubnub}
+        self.addCleanup(engine.close)
+        return engine
+
+    def wait_sent(self, number):
+        for _ in range(number):
+            self.assertTrue(self.sent.acquire(timeout=5))
+
+    def test_threshold(self):
+        engine = self.engine({'hot': {'measure': 'temperature', 'above': 40, 'clouds': ['aws']}})
+
+        alerted = engine.check([Reading('mote01', {'temperature': 25, 'humidity': 50}),
+                                Reading('mote02', {'temperature': 41, 'humidity': 50})])
+
+        self.assertListEqual(list(alerted), [1])
+        self.assertTupleEqual(alerted[1].clouds, (self.aws,))
+        self.assertListEqual(alerted[1].wait(5), [self.aws])
+        self.wait_sent(1)
+        reading, device_name = self.aws.send_now.call_args[0]
+        self.assertEqual(device_name, 'mote02')
+        self.assertEqual(reading['temperature'], 41.0)
+        self.pubnub.send_now.assert_not_called()
+
+    def test_rate(self):
+        engine = self.engine({'rise': {'measure': 'temperature', 'rate_above': 0.5}})
+
+        self.assertDictEqual(engine.check([Reading('mote01', {'temperature': 20.0}, 100)]), {})
+        self.assertDictEqual(engine.check([Reading('mote01', {'temperature': 24.0}, 110)]), {})
+        # 5 degrees in 5 seconds
+        self.assertEqual(len(engine.check([Reading('mote01', {'temperature': 29.0}, 115)])), 1)
+
+        # All the clouds by default
+        self.wait_sent(2)
+
+    def test_record_batch(self):
+        engine = self.engine({'cold': {'measure': 'temperature', 'below': 0, 'devices': ['mote0*']},
+                              'dry': {'measure': 'humidity', 'below': 10, 'clouds': ['pubnub']}})
+        batch = RecordBatch(['mote01', 'mote02', 'other'], {'temperature': [-1.0, 5.0, -1.0],
+                                                            'humidity': [50.0, 5.0, 5.0]}, 100)
+
+        self.assertEqual(len(engine.check(batch)), 3)
+
+        self.wait_sent(4)
+        self.assertListEqual(sorted(call[0][1] for call in self.aws.send_now.call_args_list), ['mote01'])
+        self.assertListEqual(sorted(call[0][1] for call in self.pubnub.send_now.call_args_list),
+                             ['mote01', 'mote02', 'other'])
+
+    def test_rule_without_limits(self):
+        with self.assertRaises(ConfigurationError):
+            AlertEngine({'hot': {'measure': 'temperature'}}, threads=0)
+
+    def test_send_error(self):
+        self.aws.send_now.side_effect = ConnectionError
+        engine = self.engine({'hot': {'measure': 'temperature', 'above': 40}})
+
+        alert, = engine.check([Reading('mote01', {'temperature': 41})]).values()
+
+        # The other clouds are still sent, only they are delivered
+        self.wait_sent(1)
+        self.pubnub.send_now.assert_called_once()
+        self.assertListEqual(alert.wait(5), [self.pubnub])
+
+    def test_routes_apply(self):
+        engine = self.engine({'hot': {'measure': 'temperature', 'above': 40}})
+        engine.routing = RoutingTable([{'devices': ['mote*'], 'clouds': ['aws'], 'measures': ['temperature']}])
+        engine.routing.clouds = engine.clouds
+
+        alert, = engine.check([Reading('mote01', {'temperature': 41, 'humidity': 50})]).values()
+        # Not routed to any cloud
+        self.assertDictEqual(engine.check([Reading('other', {'temperature': 41})]), {})
+
+        self.wait_sent(1)
+        self.assertTupleEqual(alert.clouds, (self.aws,))
+        self.assertDictEqual(self.aws.send_now.call_args[0][0].to_dict(), {'temperature': 41.0})
+        self.pubnub.send_now.assert_not_called()
+
+    def test_dropped_alert_not_reported(self):
+        engine = self.engine({'hot': {'measure': 'temperature', 'above': 40}}, threads=0, queue_size=1)
+
+        self.assertEqual(len(engine.check([Reading('mote01', {'temperature': 41})])), 1)
+        self.assertDictEqual(engine.check([Reading('mote02', {'temperature': 41})]), {})
+
+    def test_close_with_lane_full(self):
+        engine = AlertEngine({'hot': {'measure': 'temperature', 'above': 40}}, threads=1, queue_size=1)
+        engine.clouds = {'aws': self.aws}
+        sending = threading.Event()
+        self.aws.send_now.side_effect = lambda data, device_name: sending.set() or time.sleep(0.2)
+        engine.check([Reading('mote01', {'temperature': 41})])
+        self.assertTrue(sending.wait(5))
+        # The lane is full while the first alert is being sent
+        engine.check([Reading('mote02', {'temperature': 41})])
+
+        engine.close(5)
+
+        self.assertEqual(self.aws.send_now.call_count, 2)
+
+    def test_rate_series_bounded(self):
+        engine = self.engine({'rise': {'measure': 'temperature', 'rate_above': 1}}, max_series=2)
+
+        for name in ('mote01', 'mote02', 'mote03'):
+            engine.check([Reading(name, {'temperature': 20.0})])
+
+        self.assertListEqual([key[0] for key in engine._last], ['mote02', 'mote03'])
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from cloud_connector.backfill import Backfill, Checkpoint, RateLimiter, quota_rate
+from cloud_connector.data.model import Reading
+from cloud_connector.data.strategies import MessageLimit, Variation
+
+
+class FakeTSDB(object):
+    """
+    Unsent readings of a list, the position is the index of the reading.
+    """
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.calls = []
+
+    def unsent(self, cloud, start=None, end=None, chunk_size=100, position=None):
+        self.calls.append((cloud, start, end, position))
+        first = position[0] + 1 if position else 0
+        for index in range(first, len(self.readings), chunk_size):
+            yield [((number, 1), self.readings[number])
+                   for number in range(index, min(index + chunk_size, len(self.readings)))]
+
+
+class CloudFake(object):
+
+    def __init__(self, fail_at=None):
+        self.sent = []
+        self.fail_at = fail_at
+
+    def send_now(self, data, device_name):
+        if len(self.sent) == self.fail_at:
+            raise ConnectionError('Uplink down')
+        self.sent.append((device_name, data['temp']))
+
+
+class TestBackfill(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.checkpoint = os.path.join(directory, 'checkpoint.json')
+        self.tsdb = FakeTSDB([Reading('mote{:02d}'.format(number % 3), {'temp': float(number)}, 100 + number)
+                              for number in range(25)])
+
+    @mock.patch('cloud_connector.backfill.time')
+    def test_rate_limiter(self, mocked_time):
+        mocked_time.monotonic.return_value = 100.0
+        limiter = RateLimiter(2, burst=2)
+
+        waits = [limiter.acquire() for _ in range(4)]
+
+        self.assertListEqual(waits, [0.0, 0.0, 0.5, 0.5])
+        # Tokens are refilled while idle, up to the burst
+        mocked_time.monotonic.return_value = 110.0
+        self.assertListEqual([limiter.acquire() for _ in range(3)], [0.0, 0.0, 0.5])
+
+    def test_backfill(self):
+        cloud = CloudFake()
+
+        progress = Backfill(self.tsdb, cloud, rate=1000, start=50, end=200, checkpoint=self.checkpoint,
+                            chunk_size=10).run()
+
+        self.assertEqual(len(cloud.sent), 25)
+        self.assertEqual(cloud.sent[4], ('mote01', 4.0))
+        self.assertEqual(self.tsdb.calls, [('CloudFake', 50, 200, None)])
+        self.assertDictEqual(Checkpoint(self.checkpoint).load(), progress)
+        self.assertTrue(progress['done'])
+        self.assertListEqual(progress['position'], [24, 1])
+
+    def test_resume(self):
+        with self.assertRaises(ConnectionError):
+            Backfill(self.tsdb, CloudFake(fail_at=13), rate=1000, end=200, checkpoint=self.checkpoint,
+                     chunk_size=10).run()
+        self.assertEqual(Checkpoint(self.checkpoint).load()['sent'], 13)
+
+        cloud = CloudFake()
+        progress = Backfill(self.tsdb, cloud, rate=1000, checkpoint=self.checkpoint, chunk_size=10).run()
+
+        # Resumed after the last reading sent, with the range of the first run
+        self.assertEqual(cloud.sent[0], ('mote01', 13.0))
+        self.assertEqual(len(cloud.sent), 12)
+        self.assertEqual(progress['sent'], 25)
+        self.assertEqual(self.tsdb.calls[-1], ('CloudFake', None, 200, (12, 1)))
+
+        # Done, nothing is sent again
+        self.assertEqual(Backfill(self.tsdb, cloud, rate=1000, checkpoint=self.checkpoint).run()['sent'], 25)
+        self.assertEqual(len(cloud.sent), 12)
+
+        # Another range starts again
+        progress = Backfill(self.tsdb, cloud, rate=1000, start=110, checkpoint=self.checkpoint).run()
+        self.assertEqual(progress['sent'], 25)
+        self.assertEqual(self.tsdb.calls[-1][1:], (110, progress['end'], None))
+
+    def test_quota_rate(self):
+        cloud = mock.MagicMock()
+        cloud.strategy = MessageLimit(messages_per_day=8640)
+        # Half of the quota is left to the connector by default
+        self.assertAlmostEqual(quota_rate(cloud), 0.05)
+        self.assertAlmostEqual(quota_rate(cloud, share=1), 0.1)
+
+        cloud.strategy = Variation(10, 60, {'temp': 0.1})
+        self.assertIsNone(quota_rate(cloud))
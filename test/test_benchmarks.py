@@ -0,0 +1,74 @@
+import unittest
+
+import paho.mqtt.client as mqttc
+from influxdb import InfluxDBClient
+
+from benchmarks.e2e import summarize
+from benchmarks.payloads import CODECS, check, fleet_series, measure
+from benchmarks.stand_ins import StandIns
+from cloud_connector.third_party.thethingsAPI import thethingsiO
+
+
+class TestStandIns(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stand_ins = StandIns()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stand_ins.close()
+
+    def test_influxdb(self):
+        client = InfluxDBClient(self.stand_ins.influxdb.host, self.stand_ins.influxdb.port, database='benchmark')
+
+        self.assertIn({'name': 'benchmark'}, client.get_list_database())
+        client.write_points([{'measurement': 'environment', 'fields': {'temperature': 22.5}},
+                             {'measurement': 'environment', 'fields': {'temperature': 23.0}}])
+        client.close()
+
+        self.assertEqual(self.stand_ins.influxdb.readings, 2)
+
+    def test_mqtt(self):
+        client = mqttc.Client()
+        client.connect(self.stand_ins.mqtt.host, self.stand_ins.mqtt.port)
+        client.loop_start()
+
+        message = client.publish('motes/mote01', '{"temperature": 22.5}', qos=1)
+        message.wait_for_publish()
+        client.disconnect()
+        client.loop_stop()
+
+        self.assertTrue(message.is_published())
+        self.assertEqual(self.stand_ins.mqtt.readings, 1)
+
+    def test_thethingsio(self):
+        thing = thethingsiO('token', url_root=self.stand_ins.thethingsio.things_url)
+        thing.addVar('temperature', 22.5)
+
+        self.assertEqual(thing.write(), 201)
+        self.assertEqual(self.stand_ins.thethingsio.readings, 1)
+
+
+class TestSummary(unittest.TestCase):
+
+    def test_summarize(self):
+        summary = summarize(100, 2, 0.01, [0.001, 0.002, 0.003])
+
+        self.assertEqual(summary['readings_per_second'], 50)
+        self.assertEqual(summary['p50_ms'], 2)
+        self.assertEqual(summary['cpu_us_per_reading'], 100)
+
+
+class TestPayloads(unittest.TestCase):
+
+    def test_codecs(self):
+        series = fleet_series(3, 5)
+        results = {}
+        for name, codec_factory in CODECS:
+            results[name], payloads = measure(codec_factory(), series)
+            if name != 'json':
+                check(series, payloads)
+
+        self.assertEqual(len(series), 15)
+        self.assertLess(results['binary delta']['bytes_per_reading'], results['json']['bytes_per_reading'] / 2)
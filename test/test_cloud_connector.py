@@ -1,10 +1,19 @@
 from __future__ import print_function
+import os
+import shutil
+import tempfile
+import time
 import unittest
 from datetime import timedelta
 from cloud_connector.runner import ConfiguratorYaml, Runner
+from cloud_connector.cc_exceptions import ConfigurationError
 from unittest import mock
 from cloud_connector.data.clouds import CloudAmazonMQTT
+from cloud_connector.data.model import DEFAULT_MAX_DEVICES
 from cloud_connector.data.strategies import Variation
+from cloud_connector.data.tsdb import ShardedInfluxDB
+from cloud_connector.sharding import Shard, shard_of
+from cloud_connector.fleet import SimFleet
 
 
 class TestConfiguratorYaml(unittest.TestCase):
@@ -29,12 +38,201 @@ class TestConfiguratorYaml(unittest.TestCase):
                                      any_order=True)
 
         self.aws_should_be_configured(conf)
+        self.assertEqual(conf.read_intervals, [5, 10])
+        self.assertEqual(conf.overrun_policy, 'coalesce')
+
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
+    def test_configure_shard(self, mock_influxdb, mock_device, mock_cloud):
+        conf = ConfiguratorYaml('test/resources/config.yml', shard=Shard(shard_of('sim02', 3), 3))
+
+        mock_device.assert_called_once_with(**self.config_devices['sim02'])
+        self.assertEqual(conf.read_intervals, [10])
 
     @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
     def test_configure_without_devices(self, mock_influxdb):
         ConfiguratorYaml('test/resources/config_tsdb_only.yml')
         self.influxdb_should_be_configured(mock_influxdb)
 
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
+    def test_reload_only_strategy(self, mock_influxdb, mock_device, mock_cloud):
+        conf = ConfiguratorYaml(self.copy_config())
+        aws = conf.clouds[0]
+        self.replace_in_config('time_low: 60', 'time_low: 120')
+
+        retired = conf.reload()
+
+        self.assertIs(conf.clouds[0], aws)
+        self.assertEqual(aws.strategy.time_low, timedelta(minutes=2))
+        self.assertListEqual(conf.changes['built'], ['strategy:aws'])
+        self.assertEqual(len(retired), 1)
+        aws._mqtt_client.connect.assert_called_once_with('A2KYAWFNYZU0I0.iot.eu-west-1.amazonaws.com', 8883,
+                                                         keepalive=60)
+        mock_influxdb.assert_called_once_with(**self.config_db)
+
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
+    def test_reload_cloud_connection(self, mock_influxdb, mock_device, mock_cloud):
+        conf = ConfiguratorYaml(self.copy_config())
+        aws = conf.clouds[0]
+        self.replace_in_config('port: 8883', 'port: 443')
+
+        retired = conf.reload()
+
+        self.assertIsNot(conf.clouds[0], aws)
+        self.assertIs(conf.clouds[0].strategy, aws.strategy)
+        self.assertListEqual(retired, [aws])
+
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
+    def test_reload_wrong_configuration(self, mock_influxdb, mock_device, mock_cloud):
+        conf = ConfiguratorYaml(self.copy_config())
+        clouds = conf.clouds
+        self.replace_in_config('overrun: coalesce', 'overrun: wrong')
+
+        with self.assertRaises(ConfigurationError):
+            conf.reload()
+        self.assertIs(conf.clouds, clouds)
+
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
+    def test_reload_wrong_configuration_keeps_state(self, mock_influxdb, mock_device, mock_cloud):
+        conf = ConfiguratorYaml(self.copy_config())
+        aws = conf.clouds[0]
+        self.replace_in_config('read_interval: 5', 'read_interval: 7')
+        self.replace_in_config('port: 8883', 'port: 443')
+        with open(self.config_file, 'a') as config_file:
+            config_file.write('alerts:\n  wrong: 1\n')
+
+        with self.assertRaises(ConfigurationError):
+            conf.reload()
+
+        self.assertEqual(conf.read_intervals, [5, 10])
+        self.assertEqual(conf.overrun_policy, 'coalesce')
+        self.assertIs(conf.clouds[0], aws)
+        # The cloud built for the wrong configuration is closed, the one in use is not
+        mock_cloud.Client.return_value.disconnect.assert_called_once_with()
+
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
+    def test_codec_only_for_aws(self, mock_influxdb, mock_device, mock_cloud):
+        self.copy_config()
+        with open(self.config_file, 'a') as config_file:
+            config_file.write('  pubnub:\n    publish_key: pub\n    subscribe_key: sub\n'
+                              '    codec:\n      type: binary\n')
+
+        with self.assertRaises(ConfigurationError):
+            ConfiguratorYaml(self.config_file)
+
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
+    def test_configure_alerts(self, mock_influxdb, mock_device, mock_cloud):
+        conf = ConfiguratorYaml(self.copy_config())
+        self.assertIsNone(conf.alerts)
+        with open(self.config_file, 'a') as config_file:
+            config_file.write('alerts:\n  threads: 1\n  rules:\n    hot:\n      measure: temperature\n'
+                              '      above: 40\n')
+
+        retired = conf.reload()
+        self.addCleanup(conf.alerts.close)
+
+        self.assertDictEqual(conf.alerts.clouds, {'aws': conf.clouds[0]})
+        self.assertListEqual(conf.changes['built'], ['alerts'])
+        self.assertListEqual(retired, [])
+
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
+    def test_configure_routing(self, mock_influxdb, mock_device, mock_cloud):
+        conf = ConfiguratorYaml(self.copy_config())
+        self.assertIsNone(conf.routing)
+        with open(self.config_file, 'a') as config_file:
+            config_file.write('routing:\n  routes:\n    - devices: [sim01]\n      clouds: [aws]\n'
+                              '      strategy: {type: MessageLimit, parameters: {messages_per_day: 100}}\n')
+
+        conf.reload()
+
+        route, = conf.routing.lookup('sim01')
+        self.assertIs(route.cloud, conf.clouds[0])
+        self.assertIsNot(route.strategy, conf.clouds[0].strategy)
+        self.assertEqual(conf.routing.lookup('sim02'), ())
+
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.runner.InfluxDB', spec=True)
+    def test_configure_max_devices(self, mock_influxdb, mock_device, mock_cloud):
+        conf = ConfiguratorYaml(self.copy_config())
+        self.assertEqual(conf.latest.max_devices, DEFAULT_MAX_DEVICES)
+        with open(self.config_file, 'a') as config_file:
+            config_file.write('max_devices: 500\nstats:\n  max_devices: 20\n')
+
+        conf.reload()
+
+        self.assertEqual(conf.latest.max_devices, 500)
+        self.assertEqual(conf.stats.max_devices, 20)
+        self.assertListEqual(conf.changes['built'], ['latest', 'stats'])
+
+    @mock.patch('cloud_connector.data.clouds.mqttc', spec=True)
+    @mock.patch('cloud_connector.runner.SimDevice', spec=True)
+    @mock.patch('cloud_connector.data.tsdb.InfluxDBClient', spec=True)
+    @mock.patch.object(ShardedInfluxDB, 'rebalance')
+    def test_configure_sharded_tsdb(self, mock_rebalance, mock_client, mock_device, mock_cloud):
+        mock_client.side_effect = lambda **parameters: mock.MagicMock()
+        self.copy_config()
+        shard = '\n    - {{host: {}, port: 8086, user: root, password: root, database: new_values}}'
+        self.replace_in_config('  influxdb:\n    host: localhost\n    port: 8086\n    user: root\n'
+                               '    password: root\n    database: new_values\n',
+                               '  influxdb:' + shard.format('influx-a') + shard.format('influx-b') +
+                               '\n  sharding:\n    replicas: 2\n')
+        conf = ConfiguratorYaml(self.config_file)
+        self.addCleanup(conf.db.close)
+
+        self.assertIsInstance(conf.db, ShardedInfluxDB)
+        self.assertListEqual(list(conf.db.shards), ['influx-a:8086/new_values', 'influx-b:8086/new_values'])
+        self.assertEqual(conf.db.ring.replicas, 2)
+        mock_rebalance.assert_not_called()
+
+        previous = conf.db
+        self.replace_in_config('\n  sharding:', shard.format('influx-c') + '\n  sharding:')
+        retired = conf.reload()
+        self.addCleanup(conf.db.close)
+
+        self.assertListEqual(retired, [previous])
+        self.assertEqual(len(conf.db.shards), 3)
+        mock_rebalance.assert_called_once_with(previous.ring)
+        # Only the connection of the new shard is built
+        self.assertIs(conf.db.shards['influx-a:8086/new_values'], previous.shards['influx-a:8086/new_values'])
+        self.assertEqual(mock_client.call_count, 3)
+
+        # Shards changed while stopped are rebalanced on start from the saved ring
+        mock_rebalance.reset_mock()
+        self.replace_in_config(shard.format('influx-c'), '')
+        restarted = ConfiguratorYaml(self.config_file)
+        self.addCleanup(restarted.db.close)
+
+        mock_rebalance.assert_called_once_with(mock.ANY)
+        self.assertEqual(len(mock_rebalance.call_args[0][0].nodes), 3)
+        self.assertEqual(len(restarted.db.shards), 2)
+
+    def copy_config(self):
+        self.config_file = os.path.join(tempfile.mkdtemp(), 'config.yml')
+        shutil.copy('test/resources/config.yml', self.config_file)
+        return self.config_file
+
+    def replace_in_config(self, old, new):
+        with open(self.config_file, 'r') as config_file:
+            content = config_file.read()
+        with open(self.config_file, 'w') as config_file:
+            config_file.write(content.replace(old, new))
+
     def influxdb_should_be_configured(self, mock_influxdb):
         return mock_influxdb.assert_called_once_with(**self.config_db)
 
@@ -95,6 +293,100 @@ class TestRunner(unittest.TestCase):
         # TODO - Fix the verify call to insert_data
         # self.assertTrue(runner._cloud_list[0]._mqtt_client.called)
 
+    def test_stop_closes_connections(self, mock_influxdb, mock_device, mock_cloud):
+        config = ConfiguratorYaml('test/resources/config.yml')
+        runner = Runner(config)
+
+        runner.stop()
+
+        self.assertFalse(runner.sender.accepting)
+        config.db.close.assert_called_once_with()
+        config.clouds[0]._mqtt_client.disconnect.assert_called_once_with()
+        self.assertTrue(config.devices[0].close.called)
+
+    @staticmethod
+    def device(name):
+        device = mock.MagicMock()
+        device.configure_mock(name=name)
+        return device
+
+    def test_reload_devices(self, mock_influxdb, mock_device, mock_cloud):
+        mock_device.side_effect = self.device
+        config_file = os.path.join(tempfile.mkdtemp(), 'config.yml')
+        shutil.copy('test/resources/config.yml', config_file)
+        runner = Runner(ConfiguratorYaml(config_file))
+        sim01, sim02 = runner._schedules
+        with open(config_file, 'r') as yml_file:
+            content = yml_file.read()
+        with open(config_file, 'w') as yml_file:
+            yml_file.write(content.replace('  sim01:\n    name: sim01\n', '  sim03:\n    name: sim03\n'))
+
+        runner.reload()
+
+        self.assertFalse(sim01.active)
+        self.assertIn(sim02, runner._schedules)
+        self.assertListEqual([schedule.device.name for schedule in runner._schedules], ['sim03', 'sim02'])
+
+    def test_periodic_reschedules_device(self, mock_influxdb, mock_device, mock_cloud):
+        config = ConfiguratorYaml('test/resources/config.yml')
+        runner = Runner(config)
+        runner._running = True
+        runner._read = mock.MagicMock()
+        schedule = runner._schedules[0]
+        schedule.device.name = 'sim01'
+        schedule.first_deadline(0, jitter=False)
+
+        runner._periodic(schedule)
+
+        runner._read.assert_called_once_with([schedule.device])
+        self.assertEqual(len(runner._scheduler.queue), 1)
+        self.assertGreater(runner.missed_deadlines, 0)
+
+    def test_periodic_reads_ready_fleet_right_away(self, mock_influxdb, mock_device, mock_cloud):
+        config = ConfiguratorYaml('test/resources/config.yml')
+        runner = Runner(config)
+        runner._running = True
+        runner._read = mock.MagicMock()
+        fleet = mock.MagicMock(spec=SimFleet)
+        fleet.ready = True
+        schedule = runner._schedules[0]
+        schedule.device = fleet
+        schedule.first_deadline(0, jitter=False)
+
+        runner._periodic(schedule)
+
+        self.assertEqual(runner.missed_deadlines, 0)
+        self.assertLessEqual(runner._scheduler.queue[0].time, time.time())
+
+    def test_run_fleet(self, mock_influxdb, mock_device, mock_cloud):
+        config = ConfiguratorYaml('test/resources/config.yml')
+        fleet = SimFleet('fleet', 10, {'temperature': {'profile': 'random_walk', 'start': 20}})
+        config.devices = [fleet]
+        config.read_intervals = [5]
+        runner = Runner(config)
+        runner._sender.send_batch = mock.MagicMock()
+
+        runner.run()
+
+        readings = runner._sender.send_batch.call_args[0][0]
+        self.assertEqual(len(readings), 10)
+        self.assertEqual(readings[0].device_name, 'fleet0')
+        self.assertIn('temperature', readings[0])
+
+    def test_run_fleet_to_tsdb(self, mock_influxdb, mock_device, mock_cloud):
+        config = ConfiguratorYaml('test/resources/config.yml')
+        config.clouds[0]._conn_flag = True
+        fleet = SimFleet('fleet', 3, {'temperature': {'profile': 'random_walk', 'start': 20}})
+        config.devices = [fleet]
+        config.read_intervals = [5]
+        runner = Runner(config)
+
+        runner.run()
+
+        rows = config.db.insert_batch.call_args[0][0]
+        self.assertListEqual([device_name for _, device_name, _ in rows], ['fleet0', 'fleet1', 'fleet2'])
+        self.assertIsInstance(rows[0][0]['temperature'], float)
+
     def test_run_keyboard_error(self, mock_influxdb, mock_device, mock_cloud):
         mock_device.get_data.return_value = {'temperature': 24.05,
                                              'humidity': 52.31,
@@ -3,6 +3,11 @@ import unittest
 from cloud_connector.data.clouds import CloudAmazonMQTT, QOS_LEVEL, CloudThingsIO, thethingsiO, CloudPubNub
 from unittest import mock
 from cloud_connector.cc_exceptions import ConnectionException
+from cloud_connector.metrics import READINGS_SENT, READINGS_SUPPRESSED
+from cloud_connector.data.model import Reading
+from cloud_connector.data.payloads import BinaryDecoder, KEYFRAME
+from cloud_connector.data.strategies import TimeLimit
+from cloud_connector.tracing import Trace
 import ssl
 
 
@@ -53,6 +58,34 @@ class TestAWSMQTT(unittest.TestCase):
         with self.assertRaises(ConnectionException):
             cloud.insert_data(json.dumps(data), 'device_name')
 
+    @mock.patch('paho.mqtt.client.Client', spec=True)
+    def test_insert_data_binary(self, mocked_mqttc):
+        cloud = CloudAmazonMQTT(self.aws_host, self.aws_port, codec={'type': 'binary'})
+        cloud._conn_flag = True
+        decoder = BinaryDecoder()
+        reading = Reading('device_name', {'temperature': 22.5}, 1534000000.0)
+
+        cloud.insert_data(reading, 'device_name')
+        cloud._mqtt_client.publish.side_effect = ValueError('Not published')
+        with self.assertRaises(ValueError):
+            cloud.insert_data(Reading('device_name', {'temperature': 22.6}), 'device_name')
+
+        topic, payload = cloud._mqtt_client.publish.call_args_list[0][0]
+        self.assertEqual(topic, 'motes/device_name')
+        self.assertEqual(decoder.decode(payload, 'device_name'), reading)
+        # The message not published is not coded against
+        self.assertTrue(cloud.codec.encode(reading, 'device_name')[0] & KEYFRAME)
+
+    @mock.patch('paho.mqtt.client.Client', spec=True)
+    def test_close(self, mocked_mqttc):
+        cloud = CloudAmazonMQTT(self.aws_host, self.aws_port, self.ca_path,
+                                self.cert_path, self.key_path)
+
+        cloud.close()
+
+        cloud._mqtt_client.disconnect.assert_called_once_with()
+        cloud._mqtt_client.loop_stop.assert_called_once_with()
+
 
 # noinspection PyUnusedLocal
 class TestCloudThingsIO(unittest.TestCase):
@@ -76,6 +109,20 @@ class TestCloudThingsIO(unittest.TestCase):
         self.assertDictEqual(cloud._tokens, self.tokens)
         self.assertEqual(len(cloud._thethings_connector), 2)
 
+    @mock.patch('cloud_connector.data.clouds.thethingsiO', spec=True)
+    def test_data_not_sent(self, mocked_thethingsiO):
+        data = {'temperature': 22}
+        cloud = CloudThingsIO(self.tokens)
+        sent = READINGS_SENT.value('thethings.io')
+
+        # Device without token
+        self.assertIsNone(cloud.insert_data(data, 'mote03'))
+        mocked_thethingsiO.return_value.write.side_effect = IOError
+        self.assertIsNone(cloud.insert_data(data, 'mote01'))
+        with self.assertRaises(ConnectionException):
+            cloud.send_now(data, 'mote01')
+        self.assertEqual(READINGS_SENT.value('thethings.io'), sent)
+
 
 class TestPubNub(unittest.TestCase):
     def setUp(self):
@@ -90,4 +137,30 @@ class TestPubNub(unittest.TestCase):
         cloud.insert_data(data, 'mote01')
         mocked_pubnub.assert_called_once_with(subscribe_key=self.subscriber_key, publish_key=self.publisher_key)
         cloud.pubnub.subscribe.assert_called_once()
-        self.assertDictEqual(cloud.pubnub.publish.call_args[0][1], data)
\ No newline at end of file
+        self.assertDictEqual(cloud.pubnub.publish.call_args[0][1], data)
+
+    @mock.patch('cloud_connector.data.clouds.Pubnub', spec=True)
+    def test_insert_data_metrics(self, mocked_pubnub):
+        data = {'temperature': 22,
+                'humidity': 0.5}
+        sent, suppressed = READINGS_SENT.value('pubnub'), READINGS_SUPPRESSED.value('pubnub')
+        cloud = CloudPubNub(self.publisher_key, self.subscriber_key, strategy=TimeLimit(60))
+
+        cloud.insert_data(data, 'mote01')
+        cloud.insert_data(data, 'mote01')
+
+        self.assertEqual(READINGS_SENT.value('pubnub'), sent + 1)
+        self.assertEqual(READINGS_SUPPRESSED.value('pubnub'), suppressed + 1)
+
+    @mock.patch('cloud_connector.data.clouds.Pubnub', spec=True)
+    def test_insert_data_traced(self, mocked_pubnub):
+        data = {'temperature': 22,
+                'humidity': 0.5}
+        cloud = CloudPubNub(self.publisher_key, self.subscriber_key, strategy=TimeLimit(60))
+        traces = [Trace('a', 'mote01', 'rest'), Trace('b', 'mote01', 'rest')]
+
+        for trace in traces:
+            cloud.insert_data(data, 'mote01', trace)
+
+        self.assertListEqual([stage for stage, _ in traces[0].stages], ['strategy:pubnub', 'sent:pubnub'])
+        self.assertListEqual([stage for stage, _ in traces[1].stages], ['strategy:pubnub', 'suppressed:pubnub'])
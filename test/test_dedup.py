@@ -0,0 +1,122 @@
+import unittest
+from unittest import mock
+
+from cloud_connector.data.dedup import BloomFilter, Deduplicator, content_hash
+
+
+class TestDeduplicator(unittest.TestCase):
+
+    def test_sequence(self):
+        dedup = Deduplicator(window=8)
+
+        self.assertListEqual([dedup.seen({}, 'mote01', sequence) for sequence in (1, 2, 4, 2, 3, 4, 10)],
+                             [False, False, False, True, False, True, False])
+        # Each device has its own window
+        self.assertFalse(dedup.seen({}, 'mote02', 2))
+        self.assertEqual(dedup.hits, 2)
+
+    def test_sequence_forgotten(self):
+        dedup = Deduplicator(window=8)
+        for sequence in (1, 2, 3):
+            dedup.seen({}, 'mote01', sequence)
+
+        dedup.forget({}, 'mote01', 2)
+        dedup.forget({}, 'mote01', 3)
+
+        self.assertFalse(dedup.seen({}, 'mote01', 2))
+        self.assertFalse(dedup.seen({}, 'mote01', 3))
+        self.assertTrue(dedup.seen({}, 'mote01', 1))
+        self.assertTrue(dedup.seen({}, 'mote01', 2))
+
+    def test_sequence_out_of_window_restarts(self):
+        dedup = Deduplicator(window=8)
+        dedup.seen({}, 'mote01', 100)
+
+        self.assertFalse(dedup.seen({}, 'mote01', 92))
+        self.assertFalse(dedup.seen({}, 'mote01', 93))
+        self.assertTrue(dedup.seen({}, 'mote01', 92))
+
+    def test_sequence_large_jump(self):
+        dedup = Deduplicator(window=8)
+        dedup.seen({}, 'mote01', 1)
+
+        self.assertFalse(dedup.seen({}, 'mote01', 10 ** 12))
+        self.assertEqual(dedup._sequences['mote01'][:2], (10 ** 12, 1))
+
+    @mock.patch('cloud_connector.data.dedup.time')
+    def test_sequence_counter_reset(self, mocked_time):
+        mocked_time.monotonic.return_value = 0
+        dedup = Deduplicator(restart_gap=10)
+        for sequence in range(1, 501):
+            dedup.seen({}, 'mote01', sequence)
+
+        # A retry comes before the gap, a rebooted device after it
+        mocked_time.monotonic.return_value = 5
+        self.assertTrue(dedup.seen({}, 'mote01', 499))
+        mocked_time.monotonic.return_value = 20
+        self.assertListEqual([dedup.seen({}, 'mote01', sequence) for sequence in range(1, 6)], [False] * 5)
+        self.assertTrue(dedup.seen({}, 'mote01', 5))
+
+    def test_devices_bounded(self):
+        dedup = Deduplicator(max_devices=2)
+        for name in ('mote01', 'mote02', 'mote01', 'mote03'):
+            dedup.seen({}, name, 1)
+
+        self.assertListEqual(list(dedup._sequences), ['mote01', 'mote03'])
+
+    def test_without_identification(self):
+        dedup = Deduplicator()
+
+        self.assertFalse(dedup.seen({'temp': 25}, 'mote01'))
+        self.assertFalse(dedup.seen({'temp': 25}, 'mote01'))
+
+    def test_hash(self):
+        dedup = Deduplicator(hash=True)
+
+        self.assertFalse(dedup.seen({'temp': 25, 'hum': 50}, 'mote01', timestamp=100))
+        self.assertTrue(dedup.seen({'hum': 50, 'temp': 25}, 'mote01', timestamp=100))
+        self.assertFalse(dedup.seen({'temp': 25, 'hum': 50}, 'mote02', timestamp=100))
+        self.assertFalse(dedup.seen({'temp': 26, 'hum': 50}, 'mote01', timestamp=100))
+        # A stable measure sends the same data at another time
+        self.assertFalse(dedup.seen({'temp': 25, 'hum': 50}, 'mote01', timestamp=110))
+        self.assertEqual(dedup.hits, 1)
+
+    def test_hash_needs_timestamp(self):
+        dedup = Deduplicator(hash=True)
+
+        self.assertFalse(dedup.seen({'temp': 25}, 'mote01'))
+        self.assertFalse(dedup.seen({'temp': 25}, 'mote01'))
+
+    def test_hash_forgotten(self):
+        dedup = Deduplicator(hash=True)
+        dedup.seen({'temp': 25}, 'mote01', timestamp=100)
+
+        dedup.forget({'temp': 25}, 'mote01', timestamp=100)
+
+        self.assertFalse(dedup.seen({'temp': 25}, 'mote01', timestamp=100))
+        self.assertTrue(dedup.seen({'temp': 25}, 'mote01', timestamp=100))
+
+    @mock.patch('cloud_connector.data.dedup.time')
+    def test_hash_expires(self, mocked_time):
+        mocked_time.monotonic.return_value = 0
+        dedup = Deduplicator(hash=True, ttl=60)
+        dedup.seen({'temp': 25}, 'mote01', timestamp=100)
+
+        # Remembered for at least ttl seconds, in the previous filter after a rotation
+        mocked_time.monotonic.return_value = 90
+        self.assertTrue(dedup.seen({'temp': 25}, 'mote01', timestamp=100))
+        mocked_time.monotonic.return_value = 160
+        self.assertFalse(dedup.seen({'temp': 25}, 'mote01', timestamp=100))
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_error_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        for number in range(1000):
+            bloom.add(content_hash({'number': number}, 'mote01'))
+
+        self.assertTrue(all(content_hash({'number': number}, 'mote01') in bloom for number in range(1000)))
+        false_positives = sum(content_hash({'number': number}, 'mote01') in bloom for number in range(1000, 11000))
+        self.assertLess(false_positives, 200)
+        self.assertEqual(len(bloom._array), 1199)
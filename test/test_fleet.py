@@ -0,0 +1,51 @@
+import unittest
+
+from cloud_connector.fleet import SimFleet
+
+
+class TestSimFleet(unittest.TestCase):
+
+    def setUp(self):
+        self.measures = {'temperature': {'profile': 'random_walk', 'start': 22, 'step': 0.1, 'low': 15, 'high': 30},
+                         'humidity': {'profile': 'diurnal', 'mean': 50, 'amplitude': 10, 'noise': 1},
+                         'light': {'profile': 'step', 'low': 0, 'high': 500, 'probability': 0.5},
+                         }
+
+    def test_device_names(self):
+        fleet = SimFleet('sim', 100, self.measures)
+
+        self.assertEqual(len(fleet.device_names), 100)
+        self.assertEqual(fleet.device_names[0], 'sim00')
+        self.assertEqual(fleet.device_names[99], 'sim99')
+
+    def test_columns(self):
+        fleet = SimFleet('sim', 1000, self.measures, seed=1)
+
+        columns = fleet.get_columns(0)
+
+        self.assertSetEqual(set(columns), {'temperature', 'humidity', 'light'})
+        self.assertEqual(columns['temperature'].shape, (1000,))
+        self.assertTrue(((15 <= columns['temperature']) & (columns['temperature'] <= 30)).all())
+        self.assertTrue(((35 <= columns['humidity']) & (columns['humidity'] <= 65)).all())
+        self.assertSetEqual(set(columns['light'].tolist()), {0.0, 500.0})
+
+    def test_seed_reproduces_data(self):
+        batches = [SimFleet('sim', 10, self.measures, seed=7).get_batch(0) for _ in range(2)]
+
+        self.assertListEqual(list(batches[0]), list(batches[1]))
+
+    def test_batch(self):
+        fleet = SimFleet('sim', 10, self.measures, seed=7)
+
+        batch = fleet.get_batch(0)
+
+        self.assertEqual(len(batch), 10)
+        reading = batch[3]
+        self.assertEqual(reading.device_name, 'sim3')
+        self.assertEqual(reading.timestamp, 0)
+        self.assertIsInstance(reading['temperature'], float)
+        self.assertListEqual(batch.column('temperature')[3:4], [reading['temperature']])
+
+    def test_get_data_not_allowed(self):
+        with self.assertRaises(NotImplementedError):
+            SimFleet('sim', 10, self.measures).get_data()
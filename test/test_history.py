@@ -0,0 +1,76 @@
+import unittest
+from unittest import mock
+
+from cloud_connector.data.history import History
+from cloud_connector.data.model import Reading, RecordBatch
+
+
+class FakeTSDB(object):
+
+    def __init__(self, points):
+        self.points = points
+        self.queries = 0
+
+    def history(self, device_name, measures=None, start=None, end=None, limit=None, chunk_size=1000):
+        self.queries += 1
+        points = [point for point in self.points if (start is None or point['time'] >= start) and
+                  (end is None or point['time'] <= end)][:limit]
+        for index in range(0, len(points), chunk_size):
+            yield points[index:index + chunk_size]
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tsdb = FakeTSDB([{'time': float(second), 'temp': 20.0 + second} for second in range(10)])
+        self.history = History(chunk_size=4)
+
+    def read(self, **kwargs):
+        return [point for chunk in self.history.query(self.tsdb, 'mote01', **kwargs) for point in chunk]
+
+    def test_cached(self):
+        first = self.read(start=2)
+        second = self.read(start=2)
+
+        self.assertEqual(len(first), 8)
+        self.assertListEqual(first, second)
+        self.assertEqual(self.tsdb.queries, 1)
+        self.assertEqual(self.history.hits, 1)
+        self.assertListEqual([len(chunk) for chunk in self.history.query(self.tsdb, 'mote01', start=2)], [4, 4])
+
+    def test_invalidated_by_data_in_range(self):
+        self.read(end=5)
+        self.read(start=6)
+
+        self.history.invalidate([Reading('mote01', {'temp': 30.0}, 100), Reading('mote02', {'temp': 30.0}, 3)])
+        self.read(end=5)
+        self.history.invalidate(RecordBatch(['mote01'], {'temp': [30.0]}, 101))
+        self.read(start=6)
+
+        self.assertEqual(self.tsdb.queries, 3)
+
+    def test_not_cached_if_data_arrives_while_reading(self):
+        chunks = self.history.query(self.tsdb, 'mote01', start=2)
+        next(chunks)
+        self.history.invalidate([Reading('mote01', {'temp': 30.0}, 100)])
+        list(chunks)
+
+        self.assertEqual(len(self.history), 0)
+
+    def test_large_result_not_cached(self):
+        self.history = History(max_points=5, chunk_size=4)
+
+        self.assertEqual(len(self.read()), 10)
+        self.assertEqual(len(self.history), 0)
+
+    @mock.patch('cloud_connector.data.history.time')
+    def test_expired(self, mocked_time):
+        self.history = History(ttl=60, max_entries=1)
+        mocked_time.monotonic.return_value = 0
+        self.read(end=5)
+        mocked_time.monotonic.return_value = 61
+        self.read(end=5)
+        self.read(end=6)
+
+        self.assertEqual(self.tsdb.queries, 3)
+        self.assertEqual(len(self.history), 1)
@@ -0,0 +1,46 @@
+import unittest
+
+from cloud_connector.data.latest import LatestCache
+from cloud_connector.data.model import Reading, RecordBatch
+
+
+class TestLatestCache(unittest.TestCase):
+
+    def test_latest_by_measure(self):
+        cache = LatestCache()
+
+        cache.update([Reading('mote01', {'temperature': 22.0, 'humidity': 50.0}, 10),
+                      Reading('mote01', {'temperature': 23.0}, 11)])
+
+        self.assertDictEqual(cache.get('mote01'), {'temperature': {'value': 23.0, 'timestamp': 11},
+                                                   'humidity': {'value': 50.0, 'timestamp': 10}})
+        self.assertIsNone(cache.get('mote02'))
+
+    def test_older_reading_ignored(self):
+        cache = LatestCache()
+
+        cache.update([Reading('mote01', {'temperature': 23.0}, 11), Reading('mote01', {'temperature': 22.0}, 10)])
+
+        self.assertEqual(cache.get('mote01')['temperature']['value'], 23.0)
+
+    def test_record_batch(self):
+        cache = LatestCache()
+
+        cache.update(RecordBatch(['mote01', 'mote02'], {'temperature': [22.0, 23.0]}, 10))
+
+        self.assertDictEqual(cache.get_all(), {'mote01': {'temperature': {'value': 22.0, 'timestamp': 10}},
+                                               'mote02': {'temperature': {'value': 23.0, 'timestamp': 10}}})
+
+    def test_bounded(self):
+        cache = LatestCache(max_devices=2, max_measures=1)
+
+        cache.update([Reading('mote01', {'temperature': 22.0}, 10),
+                      Reading('mote02', {'temperature': 22.0, 'humidity': 50.0}, 10),
+                      Reading('mote01', {'temperature': 23.0}, 11),
+                      Reading('mote03', {'temperature': 24.0}, 11)])
+
+        self.assertListEqual(sorted(cache.get_all()), ['mote01', 'mote03'])
+        self.assertEqual(cache.evicted, 1)
+        self.assertEqual(len(cache), 2)
+        cache.update([Reading('mote03', {'humidity': 50.0}, 12)])
+        self.assertListEqual(list(cache.get('mote03')), ['temperature'])
@@ -0,0 +1,36 @@
+import subprocess
+import sys
+import unittest
+
+from cloud_connector.lazy import LazyImport, LazyRegistry, load
+
+
+class TestLazy(unittest.TestCase):
+
+    def test_load(self):
+        self.assertIs(load('os.path:join'), __import__('os').path.join)
+        self.assertIs(load('json'), __import__('json'))
+
+    def test_lazy_import(self):
+        dumps = LazyImport('json:dumps')
+
+        self.assertEqual(dumps({'a': 1}), '{"a": 1}')
+        self.assertEqual(LazyImport('os.path').basename('/tmp/file'), 'file')
+
+    def test_lazy_registry(self):
+        registry = LazyRegistry({'dumps': 'json:dumps', 'loads': 'json:loads', 'len': len})
+
+        self.assertListEqual(registry.loaded(), ['len'])
+        self.assertIs(registry['dumps'], __import__('json').dumps)
+        self.assertListEqual(sorted(registry.loaded()), ['dumps', 'len'])
+        self.assertListEqual(list(registry), ['dumps', 'loads', 'len'])
+        with self.assertRaises(KeyError):
+            registry['unknown']
+
+    def test_runner_does_not_import_backends(self):
+        modules = ('cloud_connector.data.clouds', 'paho.mqtt.client', 'pubnub', 'influxdb', 'numpy', 'retry')
+        code = 'import sys, cloud_connector.runner; print([m for m in {} if m in sys.modules])'.format(modules)
+
+        output = subprocess.check_output([sys.executable, '-c', code]).decode('utf-8')
+
+        self.assertEqual(output.strip(), '[]')
@@ -0,0 +1,65 @@
+import time
+import unittest
+
+from cloud_connector.loadtest import LoadTest, Payloads, percentile, slo_broken
+
+
+class FakeTarget(object):
+
+    def __init__(self, capacity):
+        # Seconds to process a reading
+        self.delay = 1.0 / capacity
+        self.readings = []
+
+    def send(self, device_name, data):
+        time.sleep(self.delay)
+        self.readings.append((device_name, data))
+        return True
+
+
+class TestPayloads(unittest.TestCase):
+
+    def test_next(self):
+        payloads = Payloads(12, ['temperature:22:0', 'humidity'], seed=1)
+
+        readings = [payloads.next() for _ in range(13)]
+
+        self.assertListEqual([device_name for device_name, _ in readings[:2]], ['load00', 'load01'])
+        self.assertEqual(readings[12][0], 'load00')
+        self.assertEqual(readings[0][1]['temperature'], 22)
+        self.assertSetEqual(set(readings[0][1]), {'temperature', 'humidity'})
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 50), 51)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertIsNone(percentile([], 50))
+
+    def test_run_step(self):
+        target = FakeTarget(capacity=10000)
+
+        result = LoadTest(target, Payloads(10), concurrency=4).run_step(100, 0.5)
+
+        self.assertEqual(result['sent'], 50)
+        self.assertEqual(len(target.readings), 50)
+        self.assertEqual(result['errors'], 0)
+        self.assertListEqual(slo_broken(result, 250, 0.01), [])
+
+    def test_ramp_until_slo_broken(self):
+        # One sender processing 100 readings per second saturates between 50 and 200 readings per second
+        load_test = LoadTest(FakeTarget(capacity=100), Payloads(10), concurrency=1)
+
+        results = load_test.ramp(50, 150, 1000, 0.5, max_p99_ms=50, max_error_rate=0.01)
+
+        self.assertEqual(len(results), 2)
+        self.assertListEqual(results[0]['broken'], [])
+        self.assertIn('latency', results[1]['broken'])
+
+    def test_slo_broken(self):
+        result = {'rate': 100, 'throughput': 50, 'p99_ms': 10, 'error_rate': 0.5}
+
+        self.assertListEqual(slo_broken(result, 250, 0.01), ['errors', 'throughput'])
@@ -0,0 +1,83 @@
+import logging
+import unittest
+from unittest import mock
+
+from cloud_connector import logs
+from cloud_connector.logs import RateLimitFilter, AsyncHandler
+
+
+def record(msg, *args, level=logging.WARNING):
+    return logging.LogRecord('root', level, __file__, 1, msg, args, None)
+
+
+class TestRateLimitFilter(unittest.TestCase):
+
+    @mock.patch('cloud_connector.logs.time')
+    def test_filter(self, mocked_time):
+        mocked_time.monotonic.return_value = 100
+        rate_limit = RateLimitFilter(60)
+
+        self.assertTrue(rate_limit.filter(record('Device <%s> not found', 'mote01')))
+        self.assertFalse(rate_limit.filter(record('Device <%s> not found', 'mote02')))
+        self.assertFalse(rate_limit.filter(record('Device <%s> not found', 'mote03')))
+        self.assertTrue(rate_limit.filter(record('Other warning')))
+        mocked_time.monotonic.return_value = 161
+        passed = record('Device <%s> not found', 'mote04')
+        self.assertTrue(rate_limit.filter(passed))
+
+        self.assertEqual(passed.getMessage(), 'Device <mote04> not found (2 similar messages suppressed)')
+
+    @mock.patch('cloud_connector.logs.time')
+    def test_errors_limited_by_message(self, mocked_time):
+        mocked_time.monotonic.return_value = 100
+        rate_limit = RateLimitFilter(60)
+
+        self.assertTrue(rate_limit.filter(record('Unable to send %s', 'mote01', level=logging.ERROR)))
+        self.assertTrue(rate_limit.filter(record('Unable to send %s', 'mote02', level=logging.ERROR)))
+        self.assertFalse(rate_limit.filter(record('Unable to send %s', 'mote01', level=logging.ERROR)))
+
+    def test_filter_lower_level(self):
+        rate_limit = RateLimitFilter(60)
+
+        self.assertTrue(rate_limit.filter(record('Sent', level=logging.INFO)))
+        self.assertTrue(rate_limit.filter(record('Sent', level=logging.INFO)))
+
+
+class TestConfigure(unittest.TestCase):
+
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.handlers, self.level = list(self.root.handlers), self.root.level
+
+    def tearDown(self):
+        logs.stop()
+        self.root.handlers = self.handlers
+        self.root.setLevel(self.level)
+        logging.getLogger('werkzeug').setLevel(logging.NOTSET)
+
+    def test_configure_async(self):
+        logs.configure({'level': 'info', 'async': True, 'rate_limit': 10, 'levels': {'werkzeug': 'WARNING'}})
+
+        handler, = self.root.handlers
+        self.assertIsInstance(handler, AsyncHandler)
+        self.assertIsInstance(handler.filters[0], RateLimitFilter)
+        self.assertEqual(self.root.level, logging.INFO)
+        self.assertEqual(logging.getLogger('werkzeug').level, logging.WARNING)
+
+    def test_configure_default(self):
+        logs.configure()
+
+        handler, = self.root.handlers
+        self.assertIsInstance(handler, logging.StreamHandler)
+        self.assertListEqual(handler.filters, [])
+        self.assertEqual(self.root.level, logging.DEBUG)
+
+    def test_async_handler_does_not_format(self):
+        queue = mock.MagicMock()
+        handler = AsyncHandler(queue)
+        log_record = record('Device <%s> not found', 'mote01')
+
+        handler.emit(log_record)
+
+        queue.put_nowait.assert_called_once_with(log_record)
+        self.assertEqual(log_record.args, ('mote01',))
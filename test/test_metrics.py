@@ -0,0 +1,54 @@
+import unittest
+from unittest import mock
+
+from cloud_connector.metrics import Registry, merge, render, RetryCounter, CLOUD_RETRIES
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+        self.counter = self.registry.counter('sent_total', 'Readings sent.', ['cloud'])
+        self.histogram = self.registry.histogram('send_seconds', 'Time to send.', buckets=(0.1, 1))
+
+    def test_counter(self):
+        self.counter.inc('aws')
+        self.counter.inc('aws', amount=2)
+
+        self.assertEqual(self.counter.value('aws'), 3)
+        self.assertEqual(self.counter.value('pubnub'), 0)
+
+    def test_render(self):
+        self.counter.inc('aws')
+        self.histogram.observe(0.05)
+        self.histogram.observe(0.5)
+        self.histogram.observe(5)
+
+        text = self.registry.render()
+
+        self.assertIn('# TYPE sent_total counter\nsent_total{cloud="aws"} 1\n', text)
+        self.assertIn('send_seconds_bucket{le="0.1"} 1\n'
+                      'send_seconds_bucket{le="1"} 2\n'
+                      'send_seconds_bucket{le="+Inf"} 3\n'
+                      'send_seconds_sum 5.55\n'
+                      'send_seconds_count 3\n', text)
+        self.assertEqual(self.histogram.count(), 3)
+
+    def test_merge(self):
+        self.counter.inc('aws')
+        self.histogram.observe(0.5)
+        snapshot = self.registry.snapshot()
+
+        merged = merge([snapshot, snapshot])
+
+        self.assertEqual(merged['sent_total']['values'][('aws',)], 2)
+        self.assertIn('send_seconds_count 2\n', render(merged))
+
+    @mock.patch('cloud_connector.metrics.logging')
+    def test_retry_counter(self, mocked_logging):
+        retries = CLOUD_RETRIES.value('test')
+
+        RetryCounter('test').warning('%s, retrying in %s seconds...', 'error', 2)
+
+        self.assertEqual(CLOUD_RETRIES.value('test'), retries + 1)
+        mocked_logging.warning.assert_called_once_with('%s, retrying in %s seconds...', 'error', 2)
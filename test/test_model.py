@@ -0,0 +1,69 @@
+import pickle
+import unittest
+
+from cloud_connector.data.model import Reading, RecordBatch, to_reading
+
+
+class TestReading(unittest.TestCase):
+
+    def test_reading(self):
+        data = {'temperature': 22, 'humidity': 0.5}
+
+        reading = Reading('mote01', data, 1534000000)
+
+        self.assertEqual(reading.device_name, 'mote01')
+        self.assertEqual(reading.timestamp, 1534000000)
+        self.assertEqual(reading['temperature'], 22.0)
+        self.assertIsInstance(reading['temperature'], float)
+        self.assertIsInstance(data['temperature'], int)
+        self.assertListEqual(list(reading), ['temperature', 'humidity'])
+        self.assertListEqual(list(reading.items()), [('temperature', 22.0), ('humidity', 0.5)])
+        self.assertDictEqual(reading.to_dict(), {'temperature': 22.0, 'humidity': 0.5})
+        self.assertEqual(reading, data)
+        self.assertIn('humidity', reading)
+        with self.assertRaises(KeyError):
+            reading['light']
+
+    def test_immutable(self):
+        reading = Reading('mote01', {'temperature': 22.0})
+
+        with self.assertRaises(AttributeError):
+            reading.device_name = 'mote02'
+        with self.assertRaises(TypeError):
+            reading['temperature'] = 23.0
+
+    def test_pickle(self):
+        reading = Reading('mote01', {'temperature': 22.0}, 1534000000)
+
+        self.assertEqual(pickle.loads(pickle.dumps(reading)), reading)
+
+    def test_to_reading(self):
+        reading = Reading('mote01', {'temperature': 22.0})
+
+        self.assertIs(to_reading(reading, 'mote01'), reading)
+        self.assertEqual(to_reading({'temperature': 22.0}, 'mote02').device_name, 'mote02')
+
+
+class TestRecordBatch(unittest.TestCase):
+
+    def test_batch(self):
+        batch = RecordBatch(['mote01', 'mote02'], {'temperature': [22.0, 23.0], 'humidity': [0.5, 0.6]}, 1534000000)
+
+        self.assertEqual(len(batch), 2)
+        self.assertTupleEqual(batch.measures, ('temperature', 'humidity'))
+        self.assertEqual(batch[1], Reading('mote02', {'temperature': 23.0, 'humidity': 0.6}, 1534000000))
+        self.assertListEqual(list(batch), [batch[0], batch[1]])
+        self.assertListEqual(list(batch[1:]), [batch[1]])
+        self.assertListEqual(batch.column('humidity'), [0.5, 0.6])
+
+    def test_from_pairs(self):
+        batch = RecordBatch.from_pairs([({'temperature': 22}, 'mote01'), ({'temperature': 23.0}, 'mote02')])
+
+        self.assertListEqual(batch.device_names, ['mote01', 'mote02'])
+        self.assertListEqual(batch.column('temperature'), [22.0, 23.0])
+        with self.assertRaises(ValueError):
+            RecordBatch.from_pairs([({'temperature': 22.0}, 'mote01'), ({'humidity': 0.5}, 'mote02')])
+
+    def test_column_length(self):
+        with self.assertRaises(ValueError):
+            RecordBatch(['mote01', 'mote02'], {'temperature': [22.0]})
@@ -0,0 +1,111 @@
+import unittest
+import zlib
+
+from cloud_connector.cc_exceptions import ConfigurationError
+from cloud_connector.data.model import Reading
+from cloud_connector.data.payloads import (BinaryCodec, BinaryDecoder, JsonCodec, build_codec, read_varint,
+                                           write_varint, zigzag, unzigzag, decimals, COMPRESSED, KEYFRAME)
+
+
+class TestBinaryCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.decoder = BinaryDecoder()
+
+    def round_trip(self, codec, readings):
+        payloads = [codec.encode(reading, reading.device_name) for reading in readings]
+        self.assertListEqual([self.decoder.decode(payload, reading.device_name)
+                              for payload, reading in zip(payloads, readings)], readings)
+        return payloads
+
+    def test_varint(self):
+        buffer = bytearray()
+        for number in (0, 127, 128, 300, 2 ** 64):
+            write_varint(buffer, number)
+        position, numbers = 0, []
+        while position < len(buffer):
+            number, position = read_varint(buffer, position)
+            numbers.append(number)
+
+        self.assertListEqual(numbers, [0, 127, 128, 300, 2 ** 64])
+        self.assertListEqual([unzigzag(zigzag(number)) for number in (0, -1, 1, -64, 64)], [0, -1, 1, -64, 64])
+        self.assertListEqual([decimals(value) for value in (22.0, 22.5, 0.1, 1013.25, 1 / 3, float('nan'))],
+                             [0, 1, 1, 2, None, None])
+
+    def test_values_not_rounded(self):
+        values = [22.5, 0.1, 1 / 3, -0.0, 1e300, float('inf'), 123456789.123, 5, None, 'ok', 0.3, -7.25]
+        readings = [Reading('mote01', {'value': value}, 1534000000 + index) for index, value in enumerate(values)]
+
+        self.round_trip(BinaryCodec(), readings)
+        decoded = [BinaryDecoder().decode(BinaryCodec(delta=False).encode(reading, 'mote01'), 'mote01')['value']
+                   for reading in readings[2:4]]
+        self.assertEqual(repr(decoded), repr([1 / 3, -0.0]))
+
+    def test_delta_and_dictionary(self):
+        codec = BinaryCodec()
+        readings = [Reading('mote01', {'temperature': 22.5, 'humidity': 50.0}, 1534000000.0),
+                    Reading('mote01', {'temperature': 22.6, 'humidity': 50.0}, 1534000060.0),
+                    Reading('mote02', {'temperature': 19.0}, 1534000060.5),
+                    Reading('mote01', {'temperature': 22.55, 'pressure': 1013.25}, 1534000120.0)]
+
+        keyframe, delta, other, new_measure = self.round_trip(codec, readings)
+
+        self.assertTrue(keyframe[0] & KEYFRAME)
+        self.assertFalse(delta[0] & KEYFRAME)
+        self.assertIn(b'temperature', keyframe)
+        # Names are not sent again, an unchanged value is only its measure number
+        self.assertEqual(len(delta), 10)
+        self.assertIn(b'temperature', other)
+        self.assertNotIn(b'temperature', new_measure)
+        self.assertIn(b'pressure', new_measure)
+        self.assertLess(len(delta), len(JsonCodec().encode(readings[1], 'mote01')) / 3)
+
+    def test_keyframes(self):
+        codec = BinaryCodec(keyframe_interval=3)
+        readings = [Reading('mote01', {'temperature': 20.0 + index}, 1534000000.0 + index) for index in range(7)]
+        payloads = [codec.encode(reading, 'mote01') for reading in readings]
+
+        self.assertListEqual([bool(payload[0] & KEYFRAME) for payload in payloads],
+                             [True, False, False, True, False, False, True])
+        # A decoder that starts late or misses a message waits for the next keyframe
+        with self.assertRaises(ValueError):
+            self.decoder.decode(payloads[1], 'mote01')
+        self.assertEqual(self.decoder.decode(payloads[3], 'mote01'), readings[3])
+        self.assertIsNone(self.decoder.decode(payloads[3], 'mote01'))
+        with self.assertRaises(ValueError):
+            self.decoder.decode(payloads[5], 'mote01')
+        with self.assertRaises(ValueError):
+            self.decoder.decode(payloads[4], 'mote01')
+        self.assertEqual(self.decoder.decode(payloads[6], 'mote01'), readings[6])
+
+    def test_reset(self):
+        codec = BinaryCodec()
+        codec.encode(Reading('mote01', {'temperature': 20.0}), 'mote01')
+        codec.reset('mote01')
+
+        self.assertTrue(codec.encode(Reading('mote01', {'temperature': 21.0}), 'mote01')[0] & KEYFRAME)
+
+    def test_compress(self):
+        codec = BinaryCodec(compress=True)
+        names = {'measure_{:02d}'.format(index): 0.0 for index in range(20)}
+        payload, = self.round_trip(codec, [Reading('mote01', names, 1534000000.0)])
+
+        self.assertTrue(payload[0] & COMPRESSED)
+        with self.assertRaises(ValueError):
+            BinaryDecoder().decode(payload[:1] + b'wrong', 'mote01')
+
+    def test_wrong_payload(self):
+        with self.assertRaises(ValueError):
+            self.decoder.decode(b'{"temperature": 22.5}', 'mote01')
+        with self.assertRaises(ValueError):
+            self.decoder.decode(BinaryCodec().encode(Reading('mote01', {'temp': 22.5}), 'mote01')[:-2], 'mote01')
+        with self.assertRaises(ValueError):
+            BinaryCodec().encode({'temp': [1, 2]}, 'mote01')
+
+    def test_build_codec(self):
+        self.assertIsInstance(build_codec(None), JsonCodec)
+        codec = build_codec({'type': 'binary', 'parameters': {'compress': True, 'level': zlib.Z_BEST_SPEED}})
+        self.assertTrue(codec.compress)
+        self.assertEqual(codec.level, zlib.Z_BEST_SPEED)
+        with self.assertRaises(ConfigurationError):
+            build_codec({'type': 'protobuf'})
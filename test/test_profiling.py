@@ -0,0 +1,89 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from cloud_connector.profiling import Profile, SamplingProfiler, PROFILE_NAME
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = Profile(1)
+        self.profile.samples = 4
+        self.profile.stacks[('MainThread', ('a', 'b', 'c'))] = 3
+        self.profile.stacks[('Worker', ('a', 'd'))] = 1
+
+    def test_top(self):
+        top = self.profile.top(2)
+
+        self.assertListEqual(top, [{'function': 'c', 'self': 3, 'total': 3},
+                                   {'function': 'd', 'self': 1, 'total': 1}])
+
+    def test_summary(self):
+        summary = self.profile.summary(1)
+
+        self.assertIn('4 samples in 1.0 seconds', summary)
+        self.assertIn(' 75.0%   75.0%  c', summary)
+        self.assertNotIn('  d', summary)
+
+    def test_write(self):
+        path = os.path.join(tempfile.mkdtemp(), 'profile.txt')
+
+        self.profile.write(path)
+
+        with open(path) as profile_file:
+            self.assertListEqual(profile_file.read().splitlines(), ['MainThread;a;b;c 3', 'Worker;a;d 1'])
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=busy_loop, args=(self.stop,), name='Busy')
+        self.thread.start()
+        self.profiler = SamplingProfiler(tempfile.mkdtemp(), interval=0.001)
+
+    def tearDown(self):
+        self.stop.set()
+        self.thread.join()
+
+    def test_profile_all_threads(self):
+        profile = self.profiler.profile(0.2)
+
+        self.assertGreater(profile.samples, 0)
+        threads = {thread_name for thread_name, stack in profile.stacks}
+        self.assertIn('Busy', threads)
+        busy = [stack for thread_name, stack in profile.stacks if thread_name == 'Busy']
+        self.assertTrue(all(any(function.endswith(':busy_loop') for function in stack) for stack in busy))
+
+    def test_profile_running(self):
+        self.profiler._lock.acquire()
+
+        self.assertTrue(self.profiler.running)
+        self.assertIsNone(self.profiler.profile(0.1))
+
+    def test_profile_to_file(self):
+        profile, file_name = self.profiler.profile_to_file(0.1)
+
+        self.assertTrue(PROFILE_NAME.match(file_name))
+        self.assertTrue(file_name.endswith('-{}.txt'.format(os.getpid())))
+        self.assertTrue(os.path.isfile(os.path.join(self.profiler.directory, file_name)))
+        self.assertFalse(self.profiler.running)
+
+    def test_profile_to_new_directory(self):
+        self.profiler.directory = os.path.join(self.profiler.directory, 'profiles')
+
+        profile, file_name = self.profiler.profile_to_file(0.1)
+
+        self.assertTrue(os.path.isfile(os.path.join(self.profiler.directory, file_name)))
+
+    def test_profile_name(self):
+        self.assertFalse(PROFILE_NAME.match('config.yml'))
+        self.assertFalse(PROFILE_NAME.match('profile-../config.yml'))
+        self.assertFalse(PROFILE_NAME.match('profile-20180811-150640-12.txt/..'))
@@ -0,0 +1,175 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from cloud_connector.data.model import Reading
+from cloud_connector.relay import (CloudRelay, RelayListener, encode_batch, decode_batch, HEADER, ACK, HELLO,
+                                   read_exactly)
+from cloud_connector.data.spool import Spool
+
+
+class FakeSender(object):
+
+    def __init__(self):
+        self.readings = []
+        self.received = threading.Condition()
+
+    def send_batch(self, readings, source='fleet'):
+        with self.received:
+            self.readings.extend(readings)
+            self.received.notify_all()
+
+    def wait(self, number, timeout=5):
+        with self.received:
+            return self.received.wait_for(lambda: len(self.readings) >= number, timeout)
+
+
+class TestRelay(unittest.TestCase):
+
+    def setUp(self):
+        self.sender = FakeSender()
+        self.listener = RelayListener('127.0.0.1', 0)
+        self.listener.start(self.sender)
+        self.addCleanup(self.listener.close)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def relay(self, port=None, **kwargs):
+        relay = CloudRelay('127.0.0.1', port or self.listener.port, **kwargs)
+        self.addCleanup(relay.close, 1)
+        return relay
+
+    def test_encode_batch(self):
+        readings = [Reading('mote01', {'temp': 22.5}, 100), Reading('mote02', {'temp': 23.0, 'hum': 50.0}, 101)]
+
+        decoded = decode_batch(encode_batch(readings))
+
+        self.assertListEqual(decoded, readings)
+        self.assertListEqual([reading.timestamp for reading in decoded], [100, 101])
+        with self.assertRaises(ValueError):
+            decode_batch(b'not a batch')
+
+    def test_relay_batches(self):
+        relay = self.relay(batch_size=2, flush_interval=0.1)
+
+        for number in range(5):
+            relay.insert_data(Reading('mote01', {'temp': float(number)}, 100 + number), 'mote01')
+
+        self.assertTrue(self.sender.wait(5))
+        self.assertListEqual([reading['temp'] for reading in self.sender.readings], [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(self.sender.readings[4].timestamp, 104)
+        self.assertEqual(self.listener.batches, 3)
+        # The connection is kept between batches
+        self.assertIsNotNone(relay._connection)
+
+    def test_store_and_forward(self):
+        # Nothing listening at the port
+        unused = socket.socket()
+        unused.bind(('127.0.0.1', 0))
+        port = unused.getsockname()[1]
+        unused.close()
+        spool = os.path.join(self.directory, 'relay.jsonl')
+        relay = CloudRelay('127.0.0.1', port, batch_size=10, flush_interval=0.01, spool=spool, timeout=0.5)
+        relay.insert_data(Reading('mote01', {'temp': 22.5}, 100), 'mote01')
+        time.sleep(0.1)
+
+        relay.close(1)
+        self.assertEqual(len(Spool(spool)), 1)
+
+        # Sent first when the listener is reachable
+        self.relay(spool=spool, flush_interval=0.01).insert_data(Reading('mote02', {'temp': 23.0}), 'mote02')
+        self.assertTrue(self.sender.wait(2))
+        self.assertListEqual(sorted(reading.device_name for reading in self.sender.readings), ['mote01', 'mote02'])
+        self.assertEqual(len(Spool(spool)), 0)
+
+    def test_batch_not_sent_twice(self):
+        payload = encode_batch([Reading('mote01', {'temp': 22.5})])
+        acks = []
+        for _ in range(2):
+            # A reconnection sends again the batch whose acknowledgment was lost
+            connection = socket.create_connection(('127.0.0.1', self.listener.port))
+            connection.sendall(HEADER.pack(HELLO, 6) + b'site01')
+            acks.append(ACK.unpack(read_exactly(connection, ACK.size))[0])
+            connection.sendall(HEADER.pack(1, len(payload)) + payload)
+            self.assertEqual(ACK.unpack(read_exactly(connection, ACK.size))[0], 1)
+            connection.close()
+
+        self.assertListEqual(acks, [0, 1])
+        self.assertEqual(len(self.sender.readings), 1)
+        self.assertEqual(self.listener.duplicates, 1)
+
+    def test_wrong_batch_not_acknowledged(self):
+        connection = socket.create_connection(('127.0.0.1', self.listener.port))
+        connection.sendall(HEADER.pack(HELLO, 6) + b'site01')
+        read_exactly(connection, ACK.size)
+        connection.sendall(HEADER.pack(1, 3) + b'bad')
+
+        self.assertEqual(connection.recv(ACK.size), b'')
+        connection.close()
+
+    def test_frame_over_maximum_rejected(self):
+        self.listener.close()
+        self.listener = RelayListener('127.0.0.1', 0, max_frame=16)
+        self.listener.start(self.sender)
+        self.addCleanup(self.listener.close)
+        connection = socket.create_connection(('127.0.0.1', self.listener.port))
+        connection.sendall(HEADER.pack(HELLO, 6) + b'site01')
+        read_exactly(connection, ACK.size)
+        # Closed without waiting for the payload
+        connection.sendall(HEADER.pack(1, 2 ** 31))
+
+        self.assertEqual(connection.recv(ACK.size), b'')
+        connection.close()
+
+    def test_source_kept_next_to_spool(self):
+        spool = os.path.join(self.directory, 'relay.jsonl')
+        relay = self.relay(spool=spool)
+        relay.close(1)
+
+        self.assertEqual(self.relay(spool=spool).source, relay.source)
+        self.assertNotEqual(self.relay().source, relay.source)
+
+    def test_batch_ids_continue_after_restart(self):
+        spool = os.path.join(self.directory, 'relay.jsonl')
+        relay = self.relay(spool=spool, flush_interval=0.01)
+        relay.insert_data(Reading('mote01', {'temp': 22.5}), 'mote01')
+        self.assertTrue(self.sender.wait(1))
+        relay.close(1)
+
+        # The restarted relay numbers its batches from 1 again
+        self.relay(spool=spool, flush_interval=0.01).insert_data(Reading('mote02', {'temp': 23.0}), 'mote02')
+
+        self.assertTrue(self.sender.wait(2))
+        self.assertEqual(self.listener.duplicates, 0)
+
+    def test_close_while_not_acknowledged(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+        spool = os.path.join(self.directory, 'relay.jsonl')
+        relay = CloudRelay('127.0.0.1', server.getsockname()[1], flush_interval=0.01, spool=spool, timeout=1)
+        relay.insert_data(Reading('mote01', {'temp': 22.5}), 'mote01')
+        connection, _ = server.accept()
+        self.addCleanup(connection.close)
+        # Hello acknowledged, the batch never is
+        connection.recv(HEADER.size + len(relay.source))
+        connection.sendall(ACK.pack(0))
+
+        relay.close(0.1)
+
+        self.assertFalse(relay._thread.is_alive())
+        self.assertEqual(len(Spool(spool)), 1)
+
+    def test_strategy_applies(self):
+        strategy = mock.MagicMock()
+        strategy.has_to_send_data.return_value = False
+        relay = self.relay(strategy=strategy, flush_interval=0.01)
+
+        self.assertFalse(relay.insert_data(Reading('mote01', {'temp': 22.5}), 'mote01'))
+        self.assertEqual(relay._buffer, [])
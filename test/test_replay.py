@@ -0,0 +1,117 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from cloud_connector.replay import ReplayDevice, parse_line_protocol, parse_timestamp
+
+
+class TestParsers(unittest.TestCase):
+
+    def test_parse_timestamp(self):
+        self.assertEqual(parse_timestamp('1534000000'), 1534000000)
+        self.assertEqual(parse_timestamp('1534000000500'), 1534000000.5)
+        self.assertEqual(parse_timestamp('1534000000000000000'), 1534000000)
+        self.assertEqual(parse_timestamp('2018-08-11T15:06:40Z'), 1534000000)
+
+    def test_parse_line_protocol(self):
+        line = ('environment,device=mote01,cloud=CloudAmazonMQTT temperature=22.5,count=3i,on=t,label="x" '
+                '1534000000000000000')
+
+        timestamp, device_name, data = parse_line_protocol(line)
+
+        self.assertEqual(timestamp, 1534000000)
+        self.assertEqual(device_name, 'mote01')
+        self.assertDictEqual(data, {'temperature': 22.5, 'count': 3.0, 'on': 1.0})
+
+
+class TestReplayDevice(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as replay_file:
+            replay_file.write(content)
+        return path
+
+    @staticmethod
+    def pairs(batch):
+        return [(reading.device_name, reading.to_dict()) for reading in batch]
+
+    def csv_device(self, **kwargs):
+        path = self.write_file('data.csv', 'timestamp,device,temperature,humidity\n'
+                                           '1534000000,mote01,22.5,50\n'
+                                           '1534000001,mote02,23,\n'
+                                           '1534000010,mote01,22.7,51\n')
+        return ReplayDevice('replay', path, **kwargs)
+
+    def test_csv_as_fast_as_possible(self):
+        device = self.csv_device(speed=0, batch_size=2)
+
+        self.assertListEqual(self.pairs(device.get_batch()), [('mote01', {'temperature': 22.5, 'humidity': 50.0}),
+                                                              ('mote02', {'temperature': 23.0})])
+        self.assertListEqual(self.pairs(device.get_batch()), [('mote01', {'temperature': 22.7, 'humidity': 51.0})])
+        self.assertListEqual(device.get_batch(), [])
+        self.assertEqual(device.replayed, 3)
+        device.close()
+
+    def test_recorded_timestamp(self):
+        device = self.csv_device(speed=0)
+
+        self.assertListEqual([reading.timestamp for reading in device.get_batch()],
+                             [1534000000, 1534000001, 1534000010])
+
+    def test_ready_as_fast_as_possible(self):
+        device = self.csv_device(speed=0, batch_size=2)
+
+        device.get_batch()
+        self.assertTrue(device.ready)
+        device.get_batch()
+        self.assertFalse(device.ready)
+
+    @mock.patch('cloud_connector.replay.time')
+    def test_ready_accelerated(self, mocked_time):
+        device = self.csv_device(speed=5, batch_size=1)
+
+        mocked_time.time.return_value = 100
+        device.get_batch()
+        self.assertFalse(device.ready)
+        mocked_time.time.return_value = 100.5
+        self.assertTrue(device.ready)
+
+    @mock.patch('cloud_connector.replay.time')
+    def test_csv_accelerated(self, mocked_time):
+        device = self.csv_device(speed=5)
+
+        mocked_time.time.return_value = 100
+        self.assertEqual(len(device.get_batch()), 1)
+        mocked_time.time.return_value = 100.5
+        self.assertEqual(len(device.get_batch()), 1)
+        mocked_time.time.return_value = 101.5
+        self.assertEqual(len(device.get_batch()), 0)
+        mocked_time.time.return_value = 102
+        self.assertEqual(len(device.get_batch()), 1)
+
+    def test_loop(self):
+        device = self.csv_device(speed=0, loop=True)
+
+        self.assertEqual(len(device.get_batch()), 3)
+        self.assertEqual(len(device.get_batch()), 3)
+
+    def test_line_protocol(self):
+        path = self.write_file('data.txt', '# recorded data\n'
+                                           'environment,device=mote01 temperature=22.5 1534000000000000000\n'
+                                           'wrong line\n'
+                                           'environment,device=mote02 temperature=23 1534000001000000000\n')
+        device = ReplayDevice('replay', path, speed=0)
+
+        self.assertListEqual(self.pairs(device.get_batch()), [('mote01', {'temperature': 22.5}),
+                                                              ('mote02', {'temperature': 23.0})])
+
+    def test_line_protocol_without_device(self):
+        path = self.write_file('data.txt', 'environment temperature=22.5 1534000000000000000\n')
+        device = ReplayDevice('replay', path, speed=0)
+
+        self.assertListEqual(self.pairs(device.get_batch()), [('replay', {'temperature': 22.5})])
@@ -0,0 +1,76 @@
+import unittest
+from unittest import mock
+
+from cloud_connector.cc_exceptions import ConfigurationError
+from cloud_connector.data.model import Reading
+from cloud_connector.data.routing import RoutingTable
+from cloud_connector.data.strategies import MessageLimit
+
+
+class TestRoutingTable(unittest.TestCase):
+
+    def setUp(self):
+        self.clouds = {'aws': mock.MagicMock(), 'thethingsio': mock.MagicMock(), 'pubnub': mock.MagicMock()}
+
+    def table(self, routes, **kwargs):
+        table = RoutingTable(routes, strategy_factory=lambda config: MessageLimit(**config['parameters']), **kwargs)
+        table.clouds = self.clouds
+        return table
+
+    def clouds_of(self, table, device_name):
+        return [route.cloud for route in table.lookup(device_name)]
+
+    def test_lookup(self):
+        table = self.table([{'devices': ['mote01', 'gw-*'], 'clouds': ['thethingsio']},
+                            {'groups': ['greenhouse'], 'clouds': ['pubnub', 'aws']},
+                            {'devices': ['*'], 'clouds': ['aws']}],
+                           groups={'greenhouse': ['gh01', 'gh-*']})
+
+        self.assertListEqual(self.clouds_of(table, 'mote01'), [self.clouds['thethingsio'], self.clouds['aws']])
+        self.assertListEqual(self.clouds_of(table, 'gw-12'), [self.clouds['thethingsio'], self.clouds['aws']])
+        self.assertListEqual(self.clouds_of(table, 'gh-02'), [self.clouds['pubnub'], self.clouds['aws']])
+        self.assertListEqual(self.clouds_of(table, 'mote02'), [self.clouds['aws']])
+
+    def test_default(self):
+        table = self.table([{'devices': ['mote01'], 'clouds': ['aws']}])
+        self.assertListEqual(self.clouds_of(table, 'mote02'), [])
+
+        table = self.table([{'devices': ['mote01'], 'clouds': ['aws']}], default=['pubnub'])
+        self.assertListEqual(self.clouds_of(table, 'mote02'), [self.clouds['pubnub']])
+
+    def test_measures(self):
+        table = self.table([{'devices': ['mote*'], 'clouds': ['aws'], 'measures': ['temperature', 'light']}])
+        route, = table.lookup('mote01')
+
+        reading = route.select(Reading('mote01', {'temperature': 22.0, 'humidity': 50.0}, 100))
+        self.assertEqual(reading, {'temperature': 22.0})
+        self.assertEqual(reading.timestamp, 100)
+        self.assertIsNone(route.select(Reading('mote01', {'humidity': 50.0})))
+
+    def test_strategy_override(self):
+        table = self.table([{'devices': ['mote*'], 'clouds': ['aws', 'pubnub'],
+                             'strategy': {'type': 'MessageLimit', 'parameters': {'messages_per_day': 100}}},
+                            {'devices': ['*'], 'clouds': ['aws']}])
+
+        aws, pubnub = table.lookup('mote01')
+        self.assertIsInstance(aws.strategy, MessageLimit)
+        self.assertIsNot(aws.strategy, pubnub.strategy)
+        self.assertIsNone(table.lookup('sensor01')[0].strategy)
+        self.assertEqual(len(table.strategies), 2)
+
+    def test_table_bounded_and_cleared(self):
+        table = self.table([{'devices': ['*'], 'clouds': ['aws']}], max_devices=2)
+        for name in ('mote01', 'mote02', 'mote01', 'mote03'):
+            table.lookup(name)
+        self.assertListEqual(list(table._table), ['mote01', 'mote03'])
+
+        table.clouds = dict(self.clouds, aws=mock.MagicMock())
+        self.assertIs(table.lookup('mote01')[0].cloud, table.clouds['aws'])
+
+    def test_wrong_routes(self):
+        with self.assertRaises(ConfigurationError):
+            self.table([{'devices': ['mote01'], 'clouds': ['azure']}])
+        with self.assertRaises(ConfigurationError):
+            self.table([{'groups': ['unknown'], 'clouds': ['aws']}])
+        with self.assertRaises(ConfigurationError):
+            self.table([{'clouds': ['aws']}])
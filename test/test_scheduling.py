@@ -0,0 +1,77 @@
+import unittest
+from unittest import mock
+
+from cloud_connector.scheduling import DeviceSchedule, AdaptiveInterval, SKIP, COALESCE
+
+
+class TestDeviceSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.schedule = DeviceSchedule(mock.MagicMock(), 10)
+
+    def test_first_deadline_without_jitter(self):
+        self.assertEqual(self.schedule.first_deadline(100, jitter=False), 100)
+
+    def test_first_deadline_with_jitter(self):
+        deadline = self.schedule.first_deadline(100)
+        self.assertTrue(100 <= deadline < 110)
+
+    def test_next_deadline_does_not_drift(self):
+        self.schedule.first_deadline(100, jitter=False)
+
+        self.assertEqual(self.schedule.next_deadline(103.5), 110)
+        self.assertEqual(self.schedule.next_deadline(111.2), 120)
+        self.assertEqual(self.schedule.missed, 0)
+
+    def test_run_ending_on_deadline_is_not_overrun(self):
+        self.schedule.first_deadline(100, jitter=False)
+
+        self.assertEqual(self.schedule.next_deadline(110), 110)
+        self.assertEqual(self.schedule.missed, 0)
+        self.assertEqual(self.schedule.skipped, 0)
+
+    def test_overrun_skip(self):
+        self.schedule.first_deadline(100, jitter=False)
+
+        self.assertEqual(self.schedule.next_deadline(125, SKIP), 130)
+        self.assertEqual(self.schedule.missed, 2)
+        self.assertEqual(self.schedule.skipped, 2)
+
+    def test_overrun_coalesce(self):
+        self.schedule.first_deadline(100, jitter=False)
+
+        self.assertEqual(self.schedule.next_deadline(125, COALESCE), 120)
+        self.assertEqual(self.schedule.missed, 2)
+        self.assertEqual(self.schedule.skipped, 1)
+        self.assertEqual(self.schedule.next_deadline(126, COALESCE), 130)
+
+
+class TestAdaptiveInterval(unittest.TestCase):
+
+    def setUp(self):
+        self.adaptive = AdaptiveInterval(5, 60, {'temp': 0.5})
+        self.schedule = DeviceSchedule(mock.MagicMock(), 5)
+
+    def test_interval_grows_while_stable(self):
+        self.adaptive.adapt(self.schedule, {'temp': 20})
+
+        self.assertEqual(self.adaptive.adapt(self.schedule, {'temp': 20.3}), 10)
+        self.assertEqual(self.adaptive.adapt(self.schedule, {'temp': 19.8}), 20)
+        self.assertEqual(self.adaptive.adapt(self.schedule, {'temp': 20}), 40)
+        self.assertEqual(self.adaptive.adapt(self.schedule, {'temp': 20}), 60)
+
+    def test_interval_resets_on_variation(self):
+        self.adaptive.adapt(self.schedule, {'temp': 20})
+        self.adaptive.adapt(self.schedule, {'temp': 20.4})
+
+        self.assertEqual(self.adaptive.adapt(self.schedule, {'temp': 21}), 5)
+        self.assertDictEqual(self.schedule.reference, {'temp': 21})
+
+    def test_not_defined_measure_is_not_stable(self):
+        self.adaptive.adapt(self.schedule, {'temp': 20, 'hum': 50})
+
+        self.assertEqual(self.adaptive.adapt(self.schedule, {'temp': 20, 'hum': 51}), 5)
+
+    def test_wrong_intervals(self):
+        with self.assertRaises(ValueError):
+            AdaptiveInterval(60, 5)
@@ -0,0 +1,255 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from cloud_connector.data.alerts import Alert
+from cloud_connector.data.dedup import Deduplicator
+from cloud_connector.data.latest import LatestCache
+from cloud_connector.data.model import Reading
+from cloud_connector.data.routing import RoutingTable
+from cloud_connector.data.sender import DataSender
+from cloud_connector.data.spool import Spool
+from cloud_connector.data.tsdb import ShardedInfluxDB
+from cloud_connector.tracing import Tracer
+
+
+class TestDataSender(unittest.TestCase):
+
+    def setUp(self):
+        self.configurator = mock.MagicMock()
+        self.configurator.clouds = [mock.MagicMock()]
+        self.configurator.clouds[0].insert_data.return_value = 'CloudAmazonMQTT'
+        self.configurator.tracer = Tracer()
+        self.configurator.latest = LatestCache()
+        self.configurator.stats = None
+        self.configurator.alerts = None
+        self.configurator.dedup = None
+        self.configurator.routing = None
+        self.sender = DataSender(self.configurator)
+
+    def test_send_data(self):
+        data = {'temp': 25}
+        self.sender.send_data(data, 'mote01')
+
+        self.configurator.clouds[0].insert_data.assert_called_once_with({'temp': 25.0}, 'mote01', None)
+        self.configurator.db.insert_data.assert_called_once_with({'temp': 25.0}, 'mote01', ['CloudAmazonMQTT'])
+        # The reading has the value as float and the data received is not modified
+        self.assertIsInstance(self.configurator.db.insert_data.call_args[0][0]['temp'], float)
+        self.assertIsInstance(data['temp'], int)
+
+    def test_latest(self):
+        self.sender.send_batch([({'temp': 25}, 'mote01'), ({'temp': 26.0}, 'mote02')])
+        self.sender.send_data({'temp': 27.0}, 'mote01')
+
+        self.assertEqual(self.sender.latest.get('mote01')['temp']['value'], 27.0)
+        self.assertEqual(self.sender.latest.get('mote02')['temp']['value'], 26.0)
+
+    def test_alerts_evaluated_on_ingest(self):
+        self.configurator.alerts = mock.MagicMock()
+        self.configurator.alerts.check.return_value = {}
+        self.sender.update(self.configurator)
+
+        self.sender.send_data({'temp': 25}, 'mote01')
+        self.sender.send_data({'temp': 26}, 'mote01', source='spool')
+
+        # Spooled readings are not alerted late
+        self.configurator.alerts.check.assert_called_once_with([{'temp': 25.0}])
+
+    def test_history_invalidated_after_tsdb_write(self):
+        self.configurator.history = mock.MagicMock()
+        self.sender.update(self.configurator)
+        self.configurator.db.insert_data.side_effect = \
+            lambda *args: self.assertFalse(self.configurator.history.invalidate.called)
+
+        self.sender.send_data({'temp': 25}, 'mote01')
+
+        self.configurator.history.invalidate.assert_called_once_with([mock.ANY])
+
+    def test_alerted_reading_sent_once(self):
+        aws = self.configurator.clouds[0]
+        self.configurator.alerts = mock.MagicMock()
+        alert = Alert(Reading('mote01', {'temp': 45}), ((aws, mock.ANY, None),))
+        alert.delivered.append(aws)
+        alert._done.set()
+        self.configurator.alerts.check.return_value = {0: alert}
+        self.sender.update(self.configurator)
+
+        self.sender.send_data({'temp': 45}, 'mote01')
+
+        aws.insert_data.assert_not_called()
+        # The alert lane sends it, it is recorded as sent to the cloud
+        self.assertListEqual(self.configurator.db.insert_data.call_args[0][2], [type(aws).__name__])
+
+    def test_failed_alert_sent_routine_way(self):
+        aws = self.configurator.clouds[0]
+        self.configurator.alerts = mock.MagicMock()
+        reading = Reading('mote01', {'temp': 45})
+        alert = Alert(reading, ((aws, reading, None),))
+        alert._done.set()
+        self.configurator.alerts.check.return_value = {0: alert}
+        self.sender.update(self.configurator)
+
+        self.sender.send_data({'temp': 45}, 'mote01')
+
+        aws.insert_data.assert_called_once_with(reading, 'mote01', None, None)
+        self.assertListEqual(self.configurator.db.insert_data.call_args[0][2], ['CloudAmazonMQTT'])
+
+    def test_duplicates_not_sent(self):
+        self.configurator.dedup = Deduplicator()
+        self.sender.update(self.configurator)
+
+        self.assertTrue(self.sender.send_data({'temp': 25}, 'mote01', sequence=1))
+        self.assertFalse(self.sender.send_data({'temp': 25}, 'mote01', sequence=1))
+
+        self.configurator.db.insert_data.assert_called_once_with({'temp': 25.0}, 'mote01', ['CloudAmazonMQTT'])
+        self.assertEqual(self.configurator.dedup.hits, 1)
+
+    def test_retry_after_failure_sent(self):
+        self.configurator.dedup = Deduplicator()
+        self.sender.update(self.configurator)
+        self.configurator.clouds[0].insert_data.side_effect = [ConnectionError, 'CloudAmazonMQTT']
+
+        with self.assertRaises(ConnectionError):
+            self.sender.send_data({'temp': 25}, 'mote01', sequence=1)
+        self.assertTrue(self.sender.send_data({'temp': 25}, 'mote01', sequence=1))
+
+        self.assertEqual(self.configurator.clouds[0].insert_data.call_count, 2)
+
+    def test_client_timestamp(self):
+        self.sender.send_data({'temp': 25}, 'mote01', timestamp=1534000000)
+
+        self.assertEqual(self.configurator.db.insert_data.call_args[0][0].timestamp, 1534000000)
+
+    def test_routes(self):
+        aws, pubnub = mock.MagicMock(), mock.MagicMock()
+        aws.insert_data.return_value = 'CloudAmazonMQTT'
+        self.configurator.routing = RoutingTable([{'devices': ['mote*'], 'clouds': ['aws'], 'measures': ['temp']}])
+        self.configurator.routing.clouds = {'aws': aws, 'pubnub': pubnub}
+        self.sender.update(self.configurator)
+
+        self.sender.send_data({'temp': 25, 'hum': 50}, 'mote01')
+        self.sender.send_data({'temp': 25}, 'other')
+
+        aws.insert_data.assert_called_once_with({'temp': 25.0}, 'mote01', None, None)
+        pubnub.insert_data.assert_not_called()
+        self.configurator.clouds[0].insert_data.assert_not_called()
+        self.assertListEqual([call[0][2] for call in self.configurator.db.insert_data.call_args_list],
+                             [['CloudAmazonMQTT'], []])
+
+    def test_send_data_traced(self):
+        self.sender.send_data({'temp': 25}, 'mote01', trace_id='abc')
+
+        trace = self.configurator.clouds[0].insert_data.call_args[0][2]
+        self.assertEqual(trace.id, 'abc')
+        trace_record, = self.sender.tracer.traces()
+        self.assertEqual(trace_record['source'], 'rest')
+        self.assertListEqual([stage['stage'] for stage in trace_record['stages']], ['tsdb'])
+
+    def test_send_batch_traced(self):
+        self.configurator.tracer = Tracer(sample_rate=1)
+        self.sender.update(self.configurator)
+
+        self.sender.send_batch([({'temp': 25}, 'mote01'), ({'temp': 26.0}, 'mote02')])
+
+        self.assertListEqual([trace['device_name'] for trace in self.sender.tracer.traces()], ['mote02', 'mote01'])
+
+    def test_send_batch(self):
+        self.sender.send_batch([({'temp': 25}, 'mote01'), ({'temp': 26.0}, 'mote02')])
+
+        self.configurator.db.insert_batch.assert_called_once_with([({'temp': 25.0}, 'mote01', ['CloudAmazonMQTT']),
+                                                                   ({'temp': 26.0}, 'mote02', ['CloudAmazonMQTT'])])
+        self.assertEqual(self.configurator.clouds[0].insert_data.call_count, 2)
+
+    def test_close_drains_and_closes_connections(self):
+        self.sender.close(1)
+
+        self.assertFalse(self.sender.accepting)
+        self.configurator.db.close.assert_called_once_with()
+        self.configurator.clouds[0].close.assert_called_once_with()
+
+    def test_data_spooled_when_closed(self):
+        self.sender.close(1)
+
+        self.sender.send_data({'temp': 25}, 'mote01')
+
+        reading, = self.configurator.spool.write.call_args[0][0]
+        self.assertEqual(reading.device_name, 'mote01')
+        self.assertEqual(reading, {'temp': 25.0})
+        self.assertFalse(self.configurator.db.insert_data.called)
+
+    def test_pending_data_spooled_after_timeout(self):
+        release = threading.Event()
+        self.configurator.clouds[0].insert_data.side_effect = lambda data, name, trace: release.wait(5)
+        thread = threading.Thread(target=self.sender.send_data, args=({'temp': 25.0}, 'mote01'))
+        thread.start()
+        time.sleep(0.05)
+
+        self.sender.close(0.1)
+        release.set()
+        thread.join()
+
+        reading, = self.configurator.spool.write.call_args[0][0]
+        self.assertEqual(reading.device_name, 'mote01')
+
+    def test_data_spooled_to_empty_spool(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.configurator.spool = Spool(os.path.join(directory, 'spool.jsonl'))
+        self.sender.update(self.configurator)
+        self.sender.close(1)
+
+        self.sender.send_data({'temp': 25}, 'mote01')
+
+        self.assertEqual(len(self.configurator.spool), 1)
+
+    def test_pending_data_drained_to_empty_spool(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.configurator.spool = Spool(os.path.join(directory, 'spool.jsonl'))
+        self.sender.update(self.configurator)
+        release = threading.Event()
+        self.configurator.clouds[0].insert_data.side_effect = lambda data, name, trace: release.wait(5)
+        thread = threading.Thread(target=self.sender.send_data, args=({'temp': 25.0}, 'mote01'))
+        thread.start()
+        time.sleep(0.05)
+
+        self.sender.close(0.1)
+        release.set()
+        thread.join()
+
+        reading, = self.configurator.spool.pop_all()
+        self.assertEqual(reading.device_name, 'mote01')
+
+    def test_unwritten_rows_spooled_on_close(self):
+        self.configurator.db = mock.MagicMock(spec=ShardedInfluxDB)
+        self.sender.update(self.configurator)
+        row = (Reading('mote01', {'temp': 25.0}), 'mote01', ['CloudAmazonMQTT'])
+        self.configurator.db.flush.return_value = False
+        self.configurator.db.abort.return_value = [row]
+
+        self.sender.close(1)
+
+        self.configurator.spool.write_rows.assert_called_once_with([row])
+        # Rows that can not be written after the retries are also spooled
+        self.assertEqual(self.configurator.db.on_failed, self.sender._spool_rows)
+
+    def test_replay_spool(self):
+        self.configurator.spool.pop_rows.return_value = [(Reading('mote01', {'temp': 25.0}), 'mote01', None)]
+
+        self.sender.replay_spool()
+
+        self.configurator.db.insert_data.assert_called_once_with({'temp': 25.0}, 'mote01', ['CloudAmazonMQTT'])
+
+    def test_replay_unwritten_rows(self):
+        row = (Reading('mote01', {'temp': 25.0}), 'mote01', ['CloudAmazonMQTT'])
+        self.configurator.spool.pop_rows.return_value = [row]
+
+        self.sender.replay_spool()
+
+        # Only written to the TSDB, it was already sent to the clouds
+        self.configurator.db.insert_batch.assert_called_once_with([row])
+        self.configurator.clouds[0].insert_data.assert_not_called()
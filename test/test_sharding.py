@@ -0,0 +1,132 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from cloud_connector.cc_exceptions import ConnectionTimeout
+from cloud_connector.sharding import shard_of, aggregate_status, Shard, HashRing, load_ring, save_ring
+
+
+class TestShardOf(unittest.TestCase):
+
+    def test_same_shard_for_device(self):
+        self.assertEqual(shard_of('mote01', 4), shard_of('mote01', 4))
+
+    def test_devices_are_spread(self):
+        shards = {shard_of('mote{:03d}'.format(index), 4) for index in range(100)}
+        self.assertSetEqual(shards, {0, 1, 2, 3})
+
+
+class TestHashRing(unittest.TestCase):
+
+    def setUp(self):
+        self.devices = ['mote{:04d}'.format(index) for index in range(2000)]
+
+    def test_devices_are_spread(self):
+        ring = HashRing(['influx-a', 'influx-b', 'influx-c'])
+        owners = [ring.nodes_of(device)[0] for device in self.devices]
+
+        for node in ring.nodes:
+            self.assertGreater(owners.count(node), len(self.devices) / 3 * 0.7)
+        self.assertEqual(HashRing(['influx-a', 'influx-b', 'influx-c']).nodes_of('mote0001'), ring.nodes_of('mote0001'))
+
+    def test_replicas(self):
+        ring = HashRing(['influx-a', 'influx-b', 'influx-c'], replicas=2)
+
+        self.assertTrue(all(len(set(ring.nodes_of(device))) == 2 for device in self.devices))
+        with self.assertRaises(ValueError):
+            HashRing(['influx-a'], replicas=2)
+        with self.assertRaises(ValueError):
+            HashRing(['influx-a', 'influx-a'])
+
+    def test_added_node_takes_its_share(self):
+        ring = HashRing(['influx-a', 'influx-b', 'influx-c'])
+        grown = HashRing(['influx-a', 'influx-b', 'influx-c', 'influx-d'])
+
+        moved = [device for device in self.devices if ring.nodes_of(device) != grown.nodes_of(device)]
+
+        # Only the devices taken by the new node move
+        self.assertTrue(all(grown.nodes_of(device) == ('influx-d',) for device in moved))
+        self.assertLess(abs(len(moved) - len(self.devices) / 4), len(self.devices) * 0.08)
+
+    def test_cache_bounded(self):
+        ring = HashRing(['influx-a', 'influx-b'], max_devices=2)
+        for device in ('mote01', 'mote02', 'mote01', 'mote03'):
+            ring.nodes_of(device)
+
+        self.assertListEqual(list(ring._cache), ['mote01', 'mote03'])
+
+    def test_save_ring(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'ring.json')
+        self.assertIsNone(load_ring(path))
+        ring = HashRing(['influx-a', 'influx-b', 'influx-c'], replicas=2, virtual_nodes=10)
+
+        save_ring(ring, path)
+
+        self.assertDictEqual(load_ring(path).layout, ring.layout)
+        self.assertEqual(load_ring(path).nodes_of('mote01'), ring.nodes_of('mote01'))
+
+
+class TestShard(unittest.TestCase):
+
+    def setUp(self):
+        self.inboxes = [queue.Queue(), queue.Queue()]
+        self.shards = [Shard(0, 2, self.inboxes), Shard(1, 2, self.inboxes)]
+
+    def test_device_owned_by_one_shard(self):
+        owners = [shard for shard in self.shards if shard.owns('mote01')]
+        self.assertEqual(len(owners), 1)
+
+    def test_forward_to_owner(self):
+        owner = shard_of('mote01', 2)
+        self.shards[1 - owner].forward({'temp': 25}, 'mote01')
+        self.shards[owner].close()
+        sender = mock.MagicMock()
+
+        self.shards[owner].consume(sender)
+
+        sender.send_data.assert_called_once_with({'temp': 25}, 'mote01', source='forward', sequence=None,
+                                                 timestamp=None)
+        self.assertEqual(self.shards[owner].received, 1)
+        self.assertEqual(self.shards[1 - owner].forwarded, 1)
+
+    def test_ask_owner(self):
+        queries, answers = [queue.Queue(), queue.Queue()], [queue.Queue(), queue.Queue()]
+        shards = [Shard(index, 2, self.inboxes, queries=queries, answers=answers) for index in range(2)]
+        threads = [threading.Thread(target=shards[1].answer, args=({'latest': lambda name: {'temp': name}},)),
+                   threading.Thread(target=shards[0].receive_answers)]
+        for thread in threads:
+            thread.start()
+
+        self.assertDictEqual(shards[0].ask(1, 'latest', 'mote01'), {'temp': 'mote01'})
+        for shard in shards:
+            shard.close()
+        for thread in threads:
+            thread.join()
+
+    @mock.patch('cloud_connector.sharding.QUERY_TIMEOUT', 0.01)
+    def test_ask_timeout(self):
+        shard = Shard(0, 2, self.inboxes, queries=[queue.Queue(), queue.Queue()],
+                      answers=[queue.Queue(), queue.Queue()])
+
+        with self.assertRaises(ConnectionTimeout):
+            shard.ask(1, 'latest', 'mote01')
+
+    def test_report(self):
+        self.shards[0].report({'runs': 3})
+        self.assertDictEqual(self.shards[0].statuses[0], {'runs': 3, 'forwarded': 0, 'received': 0})
+
+
+class TestAggregateStatus(unittest.TestCase):
+
+    def test_totals(self):
+        status = aggregate_status({0: {'pid': 10, 'runs': 3, 'running': True},
+                                   1: {'pid': 11, 'runs': 4, 'running': True}})
+
+        self.assertDictEqual(status['total'], {'runs': 7})
+        self.assertEqual(status['workers']['1']['pid'], 11)
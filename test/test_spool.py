@@ -0,0 +1,48 @@
+import os
+import tempfile
+import unittest
+
+from cloud_connector.data.model import Reading
+from cloud_connector.data.spool import Spool
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'spool.jsonl')
+        self.spool = Spool(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_write_and_pop(self):
+        readings = [Reading('mote01', {'temp': 25.0}, 1534000000.5), Reading('mote02', {'temp': 26.0}, 1534000001)]
+        self.spool.write(readings)
+        self.spool.write([Reading('mote01', {'hum': 50.0}, 1534000002)])
+        self.assertEqual(len(self.spool), 3)
+
+        popped = self.spool.pop_all()
+
+        self.assertListEqual(popped, readings + [Reading('mote01', {'hum': 50.0}, 1534000002)])
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_rows_keep_clouds(self):
+        reading = Reading('mote01', {'temp': 25.0}, 1534000000)
+        self.spool.write([reading])
+        self.spool.write_rows([(reading, 'mote01', ['CloudAmazonMQTT'])])
+
+        self.assertListEqual(self.spool.pop_rows(),
+                             [(reading, 'mote01', None), (reading, 'mote01', ['CloudAmazonMQTT'])])
+
+    def test_pop_empty(self):
+        self.assertListEqual(self.spool.pop_all(), [])
+
+    def test_malformed_line_discarded(self):
+        with open(self.path, 'w') as spool_file:
+            spool_file.write('{"device_name": "mote01", "data": {"temp": 1.0}}\nnot json\n')
+
+        reading, = self.spool.pop_all()
+
+        self.assertEqual(reading.device_name, 'mote01')
+        self.assertEqual(reading, {'temp': 1.0})
@@ -0,0 +1,72 @@
+import statistics
+import unittest
+from unittest import mock
+
+from cloud_connector.data.model import Reading, RecordBatch
+from cloud_connector.data.stats import WindowStats
+
+
+@mock.patch('cloud_connector.data.stats.time')
+class TestWindowStats(unittest.TestCase):
+
+    def test_statistics(self, mocked_time):
+        mocked_time.time.return_value = 1000
+        values = [22.0, 22.5, 21.0, 23.5, 22.25, 20.0, 24.0]
+        stats = WindowStats(windows=[300], buckets=10)
+
+        # Readings in several buckets of the window
+        stats.update([Reading('mote01', {'temperature': value}, 750 + 35 * index)
+                      for index, value in enumerate(values)])
+
+        result = stats.window('mote01', 'temperature', 300)
+        self.assertEqual(result['count'], len(values))
+        self.assertEqual(result['min'], 20.0)
+        self.assertEqual(result['max'], 24.0)
+        self.assertAlmostEqual(result['mean'], statistics.mean(values))
+        self.assertAlmostEqual(result['std'], statistics.stdev(values))
+
+    def test_window_slides(self, mocked_time):
+        stats = WindowStats(windows=[60, 600], buckets=6)
+        stats.update([Reading('mote01', {'temperature': 10.0}, 1000), Reading('mote01', {'temperature': 20.0}, 1050)])
+
+        mocked_time.time.return_value = 1055
+        self.assertEqual(stats.window('mote01', 'temperature', 60)['count'], 2)
+        mocked_time.time.return_value = 1100
+        self.assertDictEqual(stats.get('mote01', 60), {'temperature': {60: {'count': 1, 'min': 20.0, 'max': 20.0,
+                                                                            'mean': 20.0, 'std': None}}})
+        self.assertEqual(stats.window('mote01', 'temperature', 600)['count'], 2)
+        mocked_time.time.return_value = 2000
+        self.assertIsNone(stats.window('mote01', 'temperature', 60))
+
+    def test_old_readings_ignored(self, mocked_time):
+        mocked_time.time.return_value = 1000
+        stats = WindowStats(windows=[60], buckets=6)
+
+        stats.update([Reading('mote01', {'temperature': 10.0}, 1000), Reading('mote01', {'temperature': 99.0}, 900)])
+
+        self.assertEqual(stats.window('mote01', 'temperature', 60)['max'], 10.0)
+
+    def test_record_batch(self, mocked_time):
+        mocked_time.time.return_value = 1000
+        stats = WindowStats(windows=[60])
+
+        stats.update(RecordBatch(['mote01', 'mote02'], {'temperature': [22.0, 23.0], 'state': ['on', 'off']}, 1000))
+        stats.update(RecordBatch(['mote01', 'mote02'], {'temperature': [24.0, 23.0], 'state': ['on', 'off']}, 1001))
+
+        self.assertEqual(stats.window('mote01', 'temperature', 60)['mean'], 23.0)
+        self.assertEqual(stats.window('mote02', 'temperature', 60)['std'], 0.0)
+        self.assertListEqual(list(stats.get('mote01')), ['temperature'])
+
+    def test_bounded(self, mocked_time):
+        mocked_time.time.return_value = 1000
+        stats = WindowStats(windows=[60], max_devices=2, max_measures=1)
+
+        stats.update([Reading('mote01', {'temperature': 22.0, 'humidity': 50.0}, 1000),
+                      Reading('mote02', {'temperature': 22.0}, 1000),
+                      Reading('mote03', {'temperature': 22.0}, 1000)])
+
+        self.assertIsNone(stats.get('mote01'))
+        self.assertEqual(stats.evicted, 1)
+        self.assertListEqual(list(stats.get('mote02')), ['temperature'])
+        with self.assertRaises(ValueError):
+            stats.window('mote02', 'temperature', 5)
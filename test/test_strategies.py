@@ -1,6 +1,7 @@
-from unittest import TestCase
+from unittest import TestCase, mock
 import datetime
-from cloud_connector.data.strategies import All, Variation, MessageLimit, TimeLimit
+from cloud_connector.data.model import Reading
+from cloud_connector.data.strategies import All, Variation, MessageLimit, TimeLimit, Deviation
 
 
 class TestAll(TestCase):
@@ -119,3 +120,23 @@ class TestMessageLimit(TestCase):
                                     'data': {'temp': 25, 'hum': 50}
                                     }
         return strategy
+
+
+class TestDeviation(TestCase):
+
+    def setUp(self):
+        self.strategy = Deviation(300, 2, 3600)
+        self.strategy.stats = mock.MagicMock()
+        self.strategy.stats.window.return_value = {'count': 10, 'min': 20, 'max': 24, 'mean': 22, 'std': 1}
+        self.strategy.ok_to_insert_data(Reading('mote01', {'temp': 22}))
+
+    def test_has_to_send_data_deviation(self):
+        self.assertTrue(self.strategy.has_to_send_data(Reading('mote01', {'temp': 25})))
+        self.strategy.stats.window.assert_called_once_with('mote01', 'temp', 300)
+
+    def test_has_to_send_data_no_deviation(self):
+        self.assertFalse(self.strategy.has_to_send_data(Reading('mote01', {'temp': 23})))
+
+    def test_has_to_send_data_without_stats(self):
+        self.strategy.stats.window.return_value = None
+        self.assertTrue(self.strategy.has_to_send_data(Reading('mote01', {'temp': 23})))
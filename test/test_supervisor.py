@@ -0,0 +1,39 @@
+import unittest
+from unittest import mock
+
+from cloud_connector.supervisor import Supervisor
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.supervisor = Supervisor('config.yml', 2)
+        self.supervisor._running = True
+        self.supervisor._start_worker = mock.MagicMock()
+        self.supervisor._processes = [mock.MagicMock(), mock.MagicMock()]
+
+    def test_alive_workers_are_not_restarted(self):
+        self.supervisor.check_workers()
+
+        self.assertFalse(self.supervisor._start_worker.called)
+
+    def test_crashed_worker_is_restarted(self):
+        self.supervisor._processes[1].is_alive.return_value = False
+
+        self.supervisor.check_workers()
+
+        self.supervisor._start_worker.assert_called_once_with(1)
+        self.assertListEqual(self.supervisor.restarts, [0, 1])
+
+    @mock.patch('cloud_connector.supervisor.time')
+    def test_restart_delay_grows(self, mocked_time):
+        mocked_time.time.return_value = 100
+        self.supervisor.restarts = [0, 3]
+        self.supervisor._processes[1].is_alive.return_value = False
+
+        self.supervisor.check_workers()
+        self.assertFalse(self.supervisor._start_worker.called)
+
+        mocked_time.time.return_value = 107
+        self.supervisor.check_workers()
+        self.supervisor._start_worker.assert_called_once_with(1)
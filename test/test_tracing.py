@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from cloud_connector.data.model import Reading, RecordBatch
+from cloud_connector.tracing import Tracer, Trace
+
+
+class TestTrace(unittest.TestCase):
+
+    @mock.patch('cloud_connector.tracing.time')
+    def test_to_dict(self, mocked_time):
+        mocked_time.time.return_value = 1534000000
+        mocked_time.perf_counter.side_effect = [10, 10.0025]
+        trace = Trace('abc', 'mote01', 'poll')
+
+        trace.mark('tsdb')
+
+        self.assertDictEqual(trace.to_dict(), {'id': 'abc', 'device_name': 'mote01', 'source': 'poll',
+                                               'timestamp': 1534000000, 'stages': [{'stage': 'tsdb', 'ms': 2.5}]})
+
+
+class TestTracer(unittest.TestCase):
+
+    def test_start_not_sampled(self):
+        tracer = Tracer()
+
+        self.assertIsNone(tracer.start('mote01', 'rest'))
+        self.assertIsNone(tracer.start_batch([Reading('mote01', {})], 'fleet'))
+
+    def test_start_with_trace_id(self):
+        trace = Tracer().start('mote01', 'rest', trace_id='abc')
+
+        self.assertEqual(trace.id, 'abc')
+
+    def test_start_batch(self):
+        readings = RecordBatch(['mote{}'.format(index) for index in range(10000)], {'temp': [0.0] * 10000})
+
+        traces = Tracer(sample_rate=0.01).start_batch(readings, 'fleet')
+
+        self.assertTrue(50 < len(traces) < 200)
+        index, trace = next(iter(traces.items()))
+        self.assertEqual(trace.device_name, readings[index].device_name)
+        self.assertEqual(len(Tracer(sample_rate=1).start_batch(readings, 'fleet')), 10000)
+
+    def test_traces(self):
+        tracer = Tracer(buffer_size=2)
+        for trace_id, device_name in (('a', 'mote01'), ('b', 'mote02'), ('c', 'mote01')):
+            tracer.finish(Trace(trace_id, device_name, 'rest'))
+
+        self.assertListEqual([trace['id'] for trace in tracer.traces()], ['c', 'b'])
+        self.assertListEqual([trace['id'] for trace in tracer.traces(device_name='mote01')], ['c'])
+        self.assertListEqual([trace['id'] for trace in tracer.traces(trace_id='b')], ['b'])
+        self.assertListEqual([trace['id'] for trace in tracer.traces(limit=1)], ['c'])
+
+    def test_finish_to_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'traces.jsonl')
+        tracer = Tracer(file=path)
+
+        tracer.finish(Trace('abc', 'mote01', 'rest'))
+        tracer.close()
+
+        with open(path) as traces_file:
+            self.assertEqual(json.loads(traces_file.readline())['id'], 'abc')
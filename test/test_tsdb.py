@@ -2,7 +2,8 @@ from __future__ import absolute_import, print_function
 import unittest
 # noinspection PyUnresolvedReferences
 import cloud_connector
-from cloud_connector.data.tsdb import InfluxDB
+from cloud_connector.data.model import Reading
+from cloud_connector.data.tsdb import InfluxDB, ShardedInfluxDB
 from influxdb.resultset import ResultSet
 from unittest import mock
 from datetime import datetime
@@ -125,3 +126,245 @@ class TestsInfluxDB(unittest.TestCase):
 
         influx.db.write_points.assert_called_once_with([point], tags={'device': 'device_name'})
 
+
+    @staticmethod
+    @mock.patch('cloud_connector.data.tsdb.InfluxDBClient', spec=True)
+    def test_insert_batch(mocked_client):
+        """
+        Data of many devices is inserted with a single write
+        """
+        influx = InfluxDB('host', '9999', 'user', 'password', 'mockdb')
+
+        influx.insert_batch([({'temperature': 22.0}, 'mote01', ['CloudAmazonMQTT']),
+                             ({'temperature': 23.0}, 'mote02', [])])
+
+        influx.db.write_points.assert_called_once_with(
+            [{'measurement': 'environment', 'tags': {'device': 'mote01', 'cloud': 'CloudAmazonMQTT'},
+              'fields': {'temperature': 22.0}},
+             {'measurement': 'environment', 'tags': {'device': 'mote02'}, 'fields': {'temperature': 23.0}}],
+            batch_size=5000)
+
+    @staticmethod
+    @mock.patch('cloud_connector.data.tsdb.InfluxDBClient', spec=True)
+    def test_insert_reading(mocked_client):
+        """
+        A reading is inserted with the time it was received
+        """
+        influx = InfluxDB('host', '9999', 'user', 'password', 'mockdb')
+
+        influx.insert_data(Reading('mote01', {'temperature': 22.0}, 1534000000.5), 'mote01', ['CloudAmazonMQTT'])
+
+        influx.db.write_points.assert_called_once_with(
+            [{'measurement': 'environment', 'fields': {'temperature': 22.0}, 'time': 1534000000500000000}],
+            tags={'device': 'mote01', 'cloud': 'CloudAmazonMQTT'})
+
+    @mock.patch('cloud_connector.data.tsdb.InfluxDBClient', spec=True)
+    def test_history(self, mocked_client):
+        """
+        History is read in chunks, each one after the last point of the previous one
+        """
+        def result(*rows):
+            return ResultSet({'series': [{'name': 'environment', 'columns': ['time', 'cloud', 'device', 'temp'],
+                                          'values': [list(row) for row in rows]}]})
+        influx = InfluxDB('host', '9999', 'user', 'password', 'mockdb')
+        influx.db.query.side_effect = [result((1000000000, None, "mo'te", 22.0), (2000000000, 'aws', "mo'te", 23.0)),
+                                       result((3000000000, None, "mo'te", None))]
+
+        chunks = list(influx.history("mo'te", ['temp'], start=1, end=10, limit=5, chunk_size=2))
+
+        self.assertListEqual(chunks, [[{'time': 1.0, 'temp': 22.0}, {'time': 2.0, 'temp': 23.0}], [{'time': 3.0}]])
+        self.assertListEqual([call[0][0] for call in influx.db.query.call_args_list], [
+            'SELECT "temp" FROM "environment" WHERE "device" = \'mo\\\'te\' AND time <= 10000000000 AND '
+            'time >= 1000000000 ORDER BY time ASC LIMIT 2',
+            'SELECT "temp" FROM "environment" WHERE "device" = \'mo\\\'te\' AND time <= 10000000000 AND '
+            'time > 2000000000 ORDER BY time ASC LIMIT 2'])
+
+    @mock.patch('cloud_connector.data.tsdb.InfluxDBClient', spec=True)
+    def test_unsent(self, mocked_client):
+        """
+        Readings with the same time in two chunks are neither skipped nor repeated
+        """
+        def result(*rows):
+            return ResultSet({'series': [{'name': 'environment', 'columns': ['time', 'cloud', 'device', 'temp'],
+                                          'values': [list(row) for row in rows]}]})
+        influx = InfluxDB('host', '9999', 'user', 'password', 'mockdb')
+        influx.db.query.side_effect = [result((1000000000, None, 'mote01', 22.0), (2000000000, '', 'mote01', 23.0)),
+                                       result((2000000000, 'CloudPubnub', 'mote02', 24.0))]
+
+        chunks = list(influx.unsent('CloudAmazonMQTT', start=1, end=10, chunk_size=2))
+
+        self.assertListEqual([[position for position, reading in chunk] for chunk in chunks],
+                             [[(1000000000, 1), (2000000000, 1)], [(2000000000, 2)]])
+        reading = chunks[1][0][1]
+        self.assertEqual(reading, {'temp': 24.0})
+        self.assertEqual(reading.device_name, 'mote02')
+        self.assertEqual(reading.timestamp, 2.0)
+        condition = '"cloud" !~ /(^|;)CloudAmazonMQTT(;|$)/ AND time <= 10000000000'
+        self.assertListEqual([call[0][0] for call in influx.db.query.call_args_list], [
+            'SELECT * FROM "environment" WHERE {} AND time >= 1000000000 ORDER BY time ASC LIMIT 2 '
+            'OFFSET 0'.format(condition),
+            'SELECT * FROM "environment" WHERE {} AND time >= 2000000000 ORDER BY time ASC LIMIT 2 '
+            'OFFSET 1'.format(condition)])
+
+        # Resumed after a position
+        influx.db.query.side_effect = [result()]
+        self.assertListEqual(list(influx.unsent('CloudAmazonMQTT', position=(2000000000, 2))), [])
+        self.assertIn('time >= 2000000000 ORDER BY time ASC LIMIT 1000 OFFSET 2', influx.db.query.call_args[0][0])
+        with self.assertRaises(ValueError):
+            next(influx.unsent('Cloud/ ; DROP'))
+
+
+class TestsShardedInfluxDB(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('cloud_connector.data.tsdb.InfluxDBClient', spec=True)
+        mocked_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        mocked_client.side_effect = lambda **parameters: mock.MagicMock()
+        self.devices = ['mote{:02d}'.format(index) for index in range(20)]
+
+    def sharded(self, names=('influx-a', 'influx-b', 'influx-c'), **kwargs):
+        sharded = ShardedInfluxDB([{'name': name, 'host': name, 'port': 8086, 'user': 'user', 'password': 'password',
+                                    'database': 'mockdb'} for name in names], **kwargs)
+        self.addCleanup(sharded.close)
+        return sharded
+
+    @staticmethod
+    def written(shard):
+        return [point['tags']['device'] for call in shard.db.write_points.call_args_list for point in call[0][0]]
+
+    def test_writes_in_batches_to_replicas(self):
+        sharded = self.sharded(replicas=2, batch_size=8, flush_interval=10)
+
+        sharded.insert_batch([(Reading(device, {'temp': 22.0}, 1), device, ['CloudAmazonMQTT'])
+                              for device in self.devices[1:]])
+        sharded.insert_data(Reading(self.devices[0], {'temp': 22.0}, 1), self.devices[0])
+        self.assertTrue(sharded.flush(5))
+
+        for name, shard in sharded.shards.items():
+            self.assertListEqual(sorted(self.written(shard)),
+                                 [device for device in self.devices if name in sharded.ring.nodes_of(device)])
+            self.assertTrue(all(len(call[0][0]) <= 8 for call in shard.db.write_points.call_args_list))
+        self.assertEqual(sum(writer.written for writer in sharded.writers.values()), 40)
+
+    def test_on_written_after_write(self):
+        sharded = self.sharded(flush_interval=10)
+        sharded.on_written = mock.MagicMock()
+        row = (Reading('mote01', {'temp': 22.0}, 1), 'mote01', None)
+
+        sharded.insert_batch([row])
+        self.assertFalse(sharded.on_written.called)
+        self.assertTrue(sharded.flush(5))
+
+        sharded.on_written.assert_called_once_with([row])
+
+    @mock.patch('cloud_connector.data.tsdb.SHARD_RETRY_WAIT', 0)
+    def test_failed_batch_retried(self):
+        sharded = self.sharded(('influx-a',), flush_interval=10)
+        sharded.on_failed = mock.MagicMock()
+        shard = sharded.shards['influx-a']
+        shard.db.write_points.side_effect = [IOError('Unreachable'), None]
+        row = (Reading('mote01', {'temp': 22.0}, 1), 'mote01', None)
+
+        sharded.insert_batch([row])
+        self.assertTrue(sharded.flush(5))
+
+        self.assertEqual(shard.db.write_points.call_count, 2)
+        self.assertFalse(sharded.on_failed.called)
+
+        # Given to on_failed when the retries fail
+        shard.db.write_points.side_effect = IOError('Unreachable')
+        sharded.insert_batch([row])
+        self.assertTrue(sharded.flush(5))
+        sharded.on_failed.assert_called_once_with([row])
+
+    def test_abort_returns_rows_not_written(self):
+        sharded = self.sharded(replicas=2, flush_interval=10)
+        row = (Reading('mote01', {'temp': 22.0}, 1), 'mote01', None)
+        sharded.insert_batch([row])
+
+        self.assertListEqual(sharded.abort(), [row])
+        sharded.close()
+
+        self.assertFalse(any(shard.db.write_points.called for shard in sharded.shards.values()))
+
+    def test_rows_written_on_close(self):
+        sharded = self.sharded(flush_interval=10)
+        sharded.insert_data({'temp': 22.0}, 'mote01')
+
+        sharded.close()
+
+        owner, = sharded.ring.nodes_of('mote01')
+        self.assertListEqual(self.written(sharded.shards[owner]), ['mote01'])
+
+    def test_unchanged_connections_reused(self):
+        previous = self.sharded(('influx-a', 'influx-b'))
+        sharded = ShardedInfluxDB([{'name': name, 'host': name, 'port': 8086, 'user': 'user', 'password': 'password',
+                                    'database': 'mockdb' if name == 'influx-a' else 'otherdb'}
+                                   for name in ('influx-a', 'influx-b', 'influx-c')], previous=previous)
+        self.addCleanup(sharded.close)
+
+        self.assertIs(sharded.shards['influx-a'], previous.shards['influx-a'])
+        self.assertIsNot(sharded.shards['influx-b'], previous.shards['influx-b'])
+        # The connections still used are not closed with the previous TSDB
+        previous.close()
+        self.assertFalse(sharded.shards['influx-a'].db.close.called)
+        self.assertTrue(previous.shards['influx-b'].db.close.called)
+        sharded.close()
+        self.assertTrue(sharded.shards['influx-a'].db.close.called)
+
+    def test_history_from_replica(self):
+        sharded = self.sharded(replicas=2)
+        first, second = [sharded.shards[name] for name in sharded.ring.nodes_of('mote01')]
+        first.db.query.side_effect = requests.exceptions.ConnectionError('Unreachable')
+        second.db.query.return_value = ResultSet({'series': [{'name': 'environment', 'columns': ['time', 'temp'],
+                                                              'values': [[1000000000, 22.0]]}]})
+
+        self.assertListEqual(list(sharded.history('mote01')), [[{'time': 1.0, 'temp': 22.0}]])
+
+    def test_unsent_from_first_shard(self):
+        sharded = self.sharded(replicas=2)
+        rows = [[1000000000 + index, None, device, 22.0] for index, device in enumerate(self.devices)]
+        for shard in sharded.shards.values():
+            shard.db.query.side_effect = lambda query, epoch: ResultSet(
+                {'series': [{'name': 'environment', 'columns': ['time', 'cloud', 'device', 'temp'],
+                             'values': [] if 'OFFSET 0' not in query else rows}]})
+
+        chunks = list(sharded.unsent('CloudAmazonMQTT'))
+
+        readings = [reading.device_name for chunk in chunks for _, reading in chunk]
+        self.assertListEqual(sorted(readings), self.devices)
+        names = list(sharded.shards)
+        for chunk in chunks:
+            for position, reading in chunk:
+                self.assertEqual(names[position[0]], sharded.ring.nodes_of(reading.device_name)[0])
+        # Resumed in the shard of the position
+        for shard in sharded.shards.values():
+            shard.db.query.reset_mock()
+        last_shard = sharded.shards[names[-1]]
+        list(sharded.unsent('CloudAmazonMQTT', position=(2, 1000000005, 1)))
+        self.assertIn('OFFSET 1', last_shard.db.query.call_args[0][0])
+        self.assertFalse(sharded.shards[names[0]].db.query.called)
+
+    def test_rebalance(self):
+        previous = self.sharded(('influx-a', 'influx-b')).ring
+        sharded = self.sharded(('influx-a', 'influx-b', 'influx-c'))
+        for name, shard in sharded.shards.items():
+            owned = [device for device in self.devices if previous.nodes_of(device)[0] == name]
+            shard.db.query.side_effect = lambda query, epoch=None, owned=owned: ResultSet(
+                {'series': [{'name': 'environment', 'columns': ['key', 'value'] if 'SHOW' in query else
+                             ['time', 'cloud', 'device', 'temp'],
+                             'values': [['device', device] for device in owned] if 'SHOW' in query else
+                             [[1000000000, 'CloudPubnub', query.split("'")[1], 22.0]]}]})
+
+        sharded.rebalance(previous).join(5)
+
+        moved = [device for device in self.devices if sharded.ring.nodes_of(device) == ('influx-c',)]
+        self.assertTrue(moved)
+        self.assertListEqual(sorted(self.written(sharded.shards['influx-c'])), moved)
+        point = sharded.shards['influx-c'].db.write_points.call_args[0][0][0]
+        self.assertDictEqual(point, {'measurement': 'environment', 'tags': {'device': point['tags']['device'],
+                                                                            'cloud': 'CloudPubnub'},
+                                     'fields': {'temp': 22.0}, 'time': 1000000000})
+        self.assertEqual(sharded.rebalanced, len(moved))
+        self.assertFalse(sharded.shards['influx-a'].db.write_points.called)